@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import contextlib
+import tracemalloc
+import multiprocessing
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from pipeline_core import (load_config, get_dataset_config, load_csv, validate_data, latest_per_key,
+                           sum_per_key, compute_effective_stock)
+from reconciliation import ReconciliationEngine
+from master_snapshot import load_master_snapshot
+from storage import FACT_NAME, QUARANTINE_NAME, column_types, write_dataset, read_dataset
+from data_generator import COVERAGE, LAYOUTS, START_DATE, generate_dataset, check_fact
+from metrics import peak_rss_mb
+import main
+
+# --- Benchmark Suite ---
+# Generates synthetic datasets at several scales, then (1) times and
+# memory-profiles each stage of the serial pipeline (in two passes, since
+# tracing allocations slows pandas down several-fold), (2) measures CSV parser
+# throughput per load_csv engine and pyarrow thread count and (3) times
+# complete run_pipeline calls per execution mode, each in a fresh process so
+# peak RSS is that run's own, and checks each run's fact table against the
+# Gold table the generator expects. Results go to a JSON report; passing an
+# earlier report as --baseline lists the stages that got slower.
+BENCH_DIR = os.path.join(main.BASE_DIR, "data", "bench")
+REPORT_VERSION = 1
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+DEFAULT_DAYS = 7
+MIN_REGRESSION_SECONDS = 0.05 # Ignore timing noise on very fast stages
+
+def dims_for_rows(rows: int, days: int = DEFAULT_DAYS) -> dict:
+    """Store and product counts giving about `rows` snapshot rows over `days` days."""
+    per_day = max(1, math.ceil(rows / days / COVERAGE))
+    stores = max(1, round(math.sqrt(per_day / 20)))
+    return {"num_stores": stores, "num_products": max(1, math.ceil(per_day / stores)), "num_days": days}
+
+def prepare_data(scale: int, days: int, seed: int, work_dir: str, layout: str = "daily",
+                 late_rate: float = 0.0, resend_rate: float = 0.0, workers: int = 1) -> dict:
+    """
+    Generates (or reuses, if generated with the same parameters) the raw
+    files for one scale, with the late and expected directories beside them.
+    Late files stay undelivered: runs are checked against the on-time Gold.
+    """
+    scale_dir = os.path.join(work_dir, str(scale))
+    raw_dir = os.path.join(scale_dir, "raw")
+    params = {**dims_for_rows(scale, days), "seed": seed, "start_date": START_DATE, "layout": layout,
+              "late_rate": late_rate, "resend_rate": resend_rate}
+    marker = os.path.join(raw_dir, "generator.json")
+    if os.path.exists(marker):
+        with open(marker, 'r') as f:
+            stored = json.load(f)
+        if stored["params"] == params:
+            return stored
+    for sub in ("raw", "late", "expected"):
+        shutil.rmtree(os.path.join(scale_dir, sub), ignore_errors=True)
+    start = time.perf_counter()
+    counts = generate_dataset(raw_dir, workers=workers, **params)
+    stored = {"params": params, "rows": counts, "generate_seconds": round(time.perf_counter() - start, 3)}
+    with open(marker, 'w') as f:
+        json.dump(stored, f, indent=2)
+    return stored
+
+# --- Stage Profiling ---
+class StageTimer:
+    """Records wall time and CPU time, or traced peak memory, for named stages."""
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **info):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        record = {"stage": name, **info}
+        yield record
+        if self.trace_memory:
+            record["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        else:
+            record["seconds"] = round(time.perf_counter() - wall, 4)
+            record["cpu_seconds"] = round(time.process_time() - cpu, 4)
+        self.stages.append(record)
+
+def profile_stages(raw_dir: str, out_dir: str, trace_memory: bool = False) -> list:
+    """Runs the serial pipeline stage by stage over raw_dir, as run_serial does."""
+    config = load_config(main.CONFIG_PATH)
+    os.makedirs(out_dir, exist_ok=True)
+    timer = StageTimer(trace_memory)
+    all_files = os.listdir(raw_dir)
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with timer.stage("load_master") as record:
+            master = load_master_snapshot(raw_dir, os.path.join(out_dir, "master"))
+            master_data = master.key_sets()
+            plans = main.compile_plans(config, master_data)
+            reconciler = ReconciliationEngine(master)
+            record["rows"] = master.rows("products") + master.rows("stores")
+            record["rebuilt"] = master.rebuilt
+
+        valid_frames, quarantine_frames = {}, []
+        for ds_name in ["inventory_snapshot"] + [ds for ds, _ in main.EVENT_DATASETS]:
+            ds_config = get_dataset_config(config, ds_name)
+            files = main.list_dataset_files(all_files, ds_config)
+            with timer.stage(f"read:{ds_name}", files=len(files)) as record:
+                frames = [load_csv(raw_dir, f, ds_config) for f in files]
+                record["rows"] = sum(len(df) for df in frames)
+            with timer.stage(f"validate:{ds_name}") as record:
+                results = [validate_data(df, plans[ds_name]) for df in frames]
+                del frames
+                record["rows"] = sum(len(v) + len(q) for v, q in results)
+                record["quarantined"] = sum(len(q) for _, q in results)
+            if ds_name == "inventory_snapshot":
+                with timer.stage("reconcile") as record:
+                    recovered = [reconciler.reconcile(q) for _, q in results]
+                    record["rows"] = sum(len(q) for _, q in results)
+                    record["recovered"] = sum(len(r) for r in recovered)
+                results = [(pd.concat([v, r], ignore_index=True) if not r.empty else v, q)
+                           for (v, q), r in zip(results, recovered)]
+            valid_frames[ds_name] = [v for v, _ in results]
+            quarantine_frames += [q for _, q in results]
+
+        with timer.stage("aggregate") as record:
+            latest_inventory = latest_per_key(pd.concat(valid_frames["inventory_snapshot"], ignore_index=True),
+                                              per_date=True)
+            totals = {}
+            for ds_name, qty_col in main.EVENT_DATASETS:
+                frames = [v for v in valid_frames[ds_name] if not v.empty]
+                totals[qty_col] = (sum_per_key(pd.concat(frames, ignore_index=True), qty_col, per_date=True)
+                                   if frames else None)
+            record["rows"] = len(latest_inventory)
+        del valid_frames
+
+        with timer.stage("effective_stock") as record:
+            merged = compute_effective_stock(latest_inventory, totals['restock_qty'], totals['damaged_qty'])
+            record["rows"] = len(merged)
+
+        with timer.stage("write_outputs") as record:
+            types = column_types(config)
+            write_dataset(merged, out_dir, FACT_NAME, "csv", types)
+            all_quarantine = pd.concat(quarantine_frames, ignore_index=True)
+            write_dataset(all_quarantine, out_dir, QUARANTINE_NAME, "csv", types)
+            record["rows"] = len(merged) + len(all_quarantine)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return timer.stages
+
+# --- Parser Throughput ---
+def parser_throughput(raw_dir: str, thread_counts: list, repeats: int = 3) -> list:
+    """
+    Times load_csv on the largest snapshot file in raw_dir with each CSV
+    engine, the arrow engine once per pyarrow thread count. Best of repeats.
+    """
+    config = load_config(main.CONFIG_PATH)
+    rules = get_dataset_config(config, "inventory_snapshot")
+    files = main.list_dataset_files(os.listdir(raw_dir), rules)
+    if not files:
+        return []
+    filename = max(files, key=lambda f: os.path.getsize(os.path.join(raw_dir, f)))
+    file_mb = os.path.getsize(os.path.join(raw_dir, filename)) / 2**20
+    try:
+        import pyarrow
+    except ImportError:
+        pyarrow = None
+    runs = [("pandas", None)] + ([("arrow", n) for n in thread_counts] if pyarrow else [])
+    default_threads = pyarrow.cpu_count() if pyarrow else None
+    results = []
+    try:
+        for engine, threads in runs:
+            if threads:
+                pyarrow.set_cpu_count(threads)
+            best = math.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                rows = len(load_csv(raw_dir, filename, rules, engine))
+                best = min(best, time.perf_counter() - start)
+            results.append({"engine": engine, "threads": threads, "file": filename, "file_mb": round(file_mb, 2),
+                            "rows": rows, "seconds": round(best, 4), "mb_per_second": round(file_mb / best, 1)})
+    finally:
+        if pyarrow:
+            pyarrow.set_cpu_count(default_threads)
+    return results
+
+# --- End-to-end Runs ---
+def _run_mode(data_dir: str, kwargs: dict, queue):
+    # Runs in a fresh process: point the pipeline at the benchmark data
+    main.RAW_DIR = os.path.join(data_dir, "raw")
+    main.PROCESSED_DIR = os.path.join(data_dir, "processed")
+    main.QUARANTINE_DIR = os.path.join(data_dir, "quarantine")
+    main.STATE_DIR = os.path.join(data_dir, "state")
+    main.MATCH_CACHE_PATH = os.path.join(main.STATE_DIR, "reconciliation_cache.json")
+    main.MATCH_INDEX_PATH = os.path.join(main.STATE_DIR, "candidate_index.npz")
+    main.SQL_DB_PATH = os.path.join(main.STATE_DIR, "pipeline.sqlite")
+    main.KEY_INDEX_DIR = os.path.join(main.STATE_DIR, "key_index")
+    main.MASTER_SNAPSHOT_DIR = os.path.join(data_dir, "master")
+    main.CHECKPOINT_DIR = os.path.join(data_dir, "checkpoints")
+    main.METRICS_PATH = os.path.join(data_dir, "run_metrics.jsonl")
+    for d in (main.PROCESSED_DIR, main.QUARANTINE_DIR):
+        os.makedirs(d, exist_ok=True)
+    # Every mode starts cold: no incremental state and no Silver checkpoints from the previous mode
+    for d in (main.STATE_DIR, main.CHECKPOINT_DIR):
+        shutil.rmtree(d, ignore_errors=True)
+    wall, cpu = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        main.run_pipeline(**kwargs)
+    result = {"seconds": round(time.perf_counter() - wall, 4),
+              "cpu_seconds": round(time.process_time() - cpu, 4), "max_rss_mb": peak_rss_mb()}
+    expected_dir = os.path.join(data_dir, "expected")
+    if os.path.exists(expected_dir):
+        result["check"] = check_fact(read_dataset(main.PROCESSED_DIR, FACT_NAME), expected_dir, on_time=True)
+    queue.put(result)
+
+def run_end_to_end(data_dir: str, modes: dict) -> list:
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for mode, kwargs in modes.items():
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_mode, args=(data_dir, kwargs, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            results.append({"mode": mode, "options": kwargs, "error": f"exit code {proc.exitcode}"})
+            continue
+        results.append({"mode": mode, "options": kwargs, **queue.get()})
+    return results
+
+# --- Report ---
+def environment_info() -> dict:
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "pandas": pd.__version__, "numpy": np.__version__}
+
+def find_regressions(report: dict, baseline: dict, tolerance: float) -> list:
+    """Stages and modes whose time grew by more than tolerance against baseline, per scale."""
+    def timings(rep):
+        found = {}
+        for result in rep.get("results", []):
+            for stage in result.get("stages", []):
+                found[(result["scale"], "stage", stage["stage"])] = stage["seconds"]
+            for run in result.get("end_to_end", []):
+                if "seconds" in run:
+                    found[(result["scale"], "mode", run["mode"])] = run["seconds"]
+            for run in result.get("parser", []):
+                name = run["engine"] if run["threads"] is None else f"{run['engine']}x{run['threads']}"
+                found[(result["scale"], "parser", name)] = run["seconds"]
+        return found
+
+    old = timings(baseline)
+    regressions = []
+    for key, seconds in timings(report).items():
+        before = old.get(key)
+        if before is None or seconds - before < MIN_REGRESSION_SECONDS:
+            continue
+        if seconds > before * (1 + tolerance):
+            scale, kind, name = key
+            regressions.append({"scale": scale, "kind": kind, "name": name, "baseline_seconds": before,
+                                "seconds": seconds, "change": round(seconds / before - 1, 3)})
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data")
+    parser.add_argument("--scales", type=float, nargs="+", default=DEFAULT_SCALES,
+                        help="Snapshot row counts to benchmark, e.g. 1e4 1e6 1e8")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--layout", choices=LAYOUTS, default="daily",
+                        help="Raw files per day, or per day and store (exercises the multi-file paths)")
+    parser.add_argument("--late-rate", type=float, default=0.0, help="Share of files generated as late")
+    parser.add_argument("--resend-rate", type=float, default=0.0, help="Share of files generated twice")
+    parser.add_argument("--generator-workers", type=int, default=1, help="Processes writing the raw files")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Worker count for the parallel mode")
+    parser.add_argument("--chunk-size", type=int, default=200_000, help="Chunk size for the streaming mode")
+    parser.add_argument("--shards", type=int, default=8, help="Store shards for the sharded mode")
+    parser.add_argument("--modes", nargs="*", default=["serial", "parallel", "streaming"],
+                        choices=["serial", "parallel", "streaming", "incremental", "sql", "arrow", "sharded", "dag"],
+                        help="run_pipeline modes to time end to end (none to skip)")
+    parser.add_argument("--skip-stages", action="store_true", help="Skip the per-stage profile")
+    parser.add_argument("--parser-threads", type=int, nargs="*",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}),
+                        help="pyarrow thread counts for the CSV parser throughput runs (none to skip them)")
+    parser.add_argument("--skip-memory", action="store_true",
+                        help="Skip the traced pass that measures per-stage peak memory")
+    parser.add_argument("--work-dir", default=BENCH_DIR)
+    parser.add_argument("--report", default=None, help="Report path (default: <work-dir>/benchmark_report.json)")
+    parser.add_argument("--baseline", default=None, help="Earlier report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown against the baseline before it counts as a regression")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    mode_options = {"serial": {}, "parallel": {"workers": args.workers},
+                    "streaming": {"chunk_size": args.chunk_size}, "incremental": {"incremental": True},
+                    "sql": {"backend": "sql"}, "arrow": {"csv_engine": "arrow"},
+                    "sharded": {"workers": args.workers, "shards": args.shards}, "dag": {"dag": True}}
+    report = {"version": REPORT_VERSION, "created_at": datetime.now(timezone.utc).isoformat(),
+              "environment": environment_info(), "results": []}
+
+    for scale in sorted(int(s) for s in args.scales):
+        print(f"--- Scale {scale:,} snapshot rows ---")
+        data = prepare_data(scale, args.days, args.seed, args.work_dir, args.layout, args.late_rate,
+                            args.resend_rate, args.generator_workers)
+        print(f"  Data: {data['rows']}")
+        scale_dir = os.path.join(args.work_dir, str(scale))
+        result = {"scale": scale, "generator": data}
+        if not args.skip_stages:
+            out_dir = os.path.join(scale_dir, "stage_output")
+            result["stages"] = profile_stages(os.path.join(scale_dir, "raw"), out_dir)
+            if not args.skip_memory:
+                traced = profile_stages(os.path.join(scale_dir, "raw"), out_dir, trace_memory=True)
+                for stage, peak in zip(result["stages"], traced):
+                    stage["peak_mb"] = peak["peak_mb"]
+            for stage in result["stages"]:
+                print(f"  {stage['stage']:<28} {stage['seconds']:>9.3f}s  peak {stage.get('peak_mb', '-'):>9} MB")
+        if args.parser_threads:
+            result["parser"] = parser_throughput(os.path.join(scale_dir, "raw"), args.parser_threads)
+            for run in result["parser"]:
+                print(f"  load_csv[{run['engine']}, threads={run['threads'] or '-'}] {run['file_mb']} MB: "
+                      f"{run['seconds']:.3f}s, {run['mb_per_second']} MB/s")
+        result["end_to_end"] = run_end_to_end(scale_dir, {m: mode_options[m] for m in args.modes})
+        for run in result["end_to_end"]:
+            check = run.get("check")
+            verdict = "" if check is None else "  correct" if check["correct"] else f"  WRONG {check}"
+            print(f"  run_pipeline[{run['mode']}] {run.get('seconds', run.get('error'))}s  "
+                  f"max RSS {run.get('max_rss_mb')} MB{verdict}")
+        report["results"].append(result)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        report["baseline"] = {"path": args.baseline, "tolerance": args.tolerance, "regressions": regressions}
+
+    report_path = args.report or os.path.join(args.work_dir, "benchmark_report.json")
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {report_path}")
+
+    for r in regressions:
+        print(f"REGRESSION: {r['kind']} {r['name']} at {r['scale']:,} rows: "
+              f"{r['baseline_seconds']}s -> {r['seconds']}s ({r['change']:+.0%})")
+    wrong = [run for result in report["results"] for run in result.get("end_to_end", [])
+             if not run.get("check", {"correct": True})["correct"]]
+    sys.exit(1 if regressions or wrong else 0)
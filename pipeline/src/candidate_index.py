@@ -0,0 +1,186 @@
+import os
+import math
+import numpy as np
+from typing import List, Optional
+
+# --- Candidate Blocking Index ---
+# Brute-force fuzzy matching scores every bad ID against every master ID. For
+# large catalogs this index narrows each lookup to a small candidate set using
+# filters that can never drop an ID scoring at or above the cutoff under
+# fuzz.ratio (100 * (1 - indel_distance / (len_a + len_b))):
+#   * length blocking: the cutoff caps the indel distance d, d >= |len_a - len_b|
+#     and d has the parity of len_a + len_b, so most lengths are ruled out;
+#   * positional q-grams: strings within edit distance d share at least
+#     max(len_a, len_b) - q + 1 - d*q q-grams (Ukkonen), each shifted by at
+#     most d positions. Only the posting lists of the query's rarest grams are
+#     read (prefix filter) and the resulting IDs are then checked against the
+#     full count.
+# Candidates are returned in master-list order, so scoring them with
+# extractOne picks the same best match as the brute-force scan.
+INDEX_FORMAT_VERSION = 1
+CODE_BITS = 21 # Bits per Unicode code point when packing q-grams into int64
+POS_BITS = 8 # Gram positions past MAX_POS share one bucket
+MAX_POS = (1 << POS_BITS) - 1
+
+def _to_codes(strings: List[str], length: int) -> np.ndarray:
+    return np.array(strings, dtype=f"<U{length}").view(np.uint32).reshape(len(strings), length)
+
+def _gram_codes(codes: np.ndarray, q: int) -> np.ndarray:
+    """Packs every q-gram of each row of code points into one int64 key."""
+    n, length = codes.shape
+    keys = np.zeros((n, length - q + 1), dtype=np.int64)
+    for k in range(q):
+        keys = (keys << CODE_BITS) | codes[:, k:length - q + 1 + k].astype(np.int64)
+    return keys
+
+def _positional_keys(grams: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    return (grams << POS_BITS) | np.minimum(positions, MAX_POS)
+
+class CandidateIndex:
+    def __init__(self, positions: np.ndarray, lengths: np.ndarray, gram_offsets: np.ndarray,
+                 grams: np.ndarray, keys: np.ndarray, offsets: np.ndarray, post_idx: np.ndarray,
+                 q: int, cutoff: float):
+        # Master IDs are addressed in length-sorted order internally
+        self.positions = positions # original master-list position of each sorted ID
+        self.lengths = lengths
+        self.gram_offsets = gram_offsets # grams of sorted ID i are grams[gram_offsets[i]:gram_offsets[i+1]]
+        self.grams = grams
+        self.keys = keys # CSR: postings of positional gram keys[j] are offsets[j]:offsets[j+1]
+        self.offsets = offsets
+        self.post_idx = post_idx # sorted-ID index, ascending within each key
+        self.q = q
+        self.cutoff = cutoff
+        distinct = np.unique(lengths)
+        bounds = np.searchsorted(lengths, np.append(distinct, distinct[-1] + 1 if len(distinct) else 0))
+        self.length_blocks = [(int(distinct[i]), int(bounds[i]), int(bounds[i + 1])) for i in range(len(distinct))]
+
+    @classmethod
+    def build(cls, master_ids: List[str], cutoff: float, q: int = 2) -> "CandidateIndex":
+        if q * CODE_BITS + POS_BITS > 63:
+            raise ValueError(f"q={q} is too long to pack into int64 keys")
+        master_ids = [str(m) for m in master_ids]
+        lengths = np.array([len(m) for m in master_ids], dtype=np.int32)
+        order = np.argsort(lengths, kind='stable')
+        ids = [master_ids[i] for i in order]
+        lengths = lengths[order]
+
+        gram_counts = np.maximum(lengths.astype(np.int64) - q + 1, 0)
+        gram_offsets = np.concatenate([[0], np.cumsum(gram_counts)])
+        gram_parts, key_parts, idx_parts = [], [], []
+        for length in np.unique(lengths):
+            if length < q:
+                continue
+            start, end = np.searchsorted(lengths, [length, length + 1])
+            grams = _gram_codes(_to_codes(ids[start:end], int(length)), q)
+            gram_parts.append(grams.ravel())
+            key_parts.append(_positional_keys(grams, np.arange(grams.shape[1])).ravel())
+            idx_parts.append(np.repeat(np.arange(start, end, dtype=np.int32), grams.shape[1]))
+
+        if key_parts:
+            grams = np.concatenate(gram_parts)
+            keys = np.concatenate(key_parts)
+            idx = np.concatenate(idx_parts)
+            pair_order = np.lexsort((idx, keys))
+            keys, idx = keys[pair_order], idx[pair_order]
+            # One posting per (key, ID); keys past MAX_POS can repeat within an ID
+            new_pair = np.ones(len(keys), dtype=bool)
+            new_pair[1:] = (keys[1:] != keys[:-1]) | (idx[1:] != idx[:-1])
+            keys, post_idx = keys[new_pair], idx[new_pair]
+            keys, key_starts = np.unique(keys, return_index=True)
+            offsets = np.append(key_starts, len(post_idx)).astype(np.int64)
+        else:
+            grams = np.zeros(0, dtype=np.int64)
+            keys = np.zeros(0, dtype=np.int64)
+            offsets = np.zeros(1, dtype=np.int64)
+            post_idx = np.zeros(0, dtype=np.int32)
+
+        return cls(order.astype(np.int64), lengths, gram_offsets, grams, keys, offsets, post_idx, q, cutoff)
+
+    def _max_distance(self, length: int, cand_length: int) -> Optional[int]:
+        """Largest indel distance that still reaches the cutoff, or None if no such ID can."""
+        total = length + cand_length
+        max_dist = math.floor((1 - self.cutoff / 100) * total + 1e-9)
+        if (max_dist - total) % 2:
+            max_dist -= 1 # indel distance has the parity of the summed lengths
+        if max_dist < abs(length - cand_length):
+            return None
+        return max_dist
+
+    def candidates(self, query: str) -> np.ndarray:
+        """Original master-list positions that could score >= cutoff against query, ascending."""
+        length = len(query)
+        query_grams = _gram_codes(_to_codes([query], length), self.q)[0] if length >= self.q else None
+        found = []
+        for cand_length, start, end in self.length_blocks:
+            max_dist = self._max_distance(length, cand_length)
+            if max_dist is None:
+                continue
+            need = max(length, cand_length) - self.q + 1 - self.q * max_dist
+            if need <= 0 or query_grams is None or cand_length < self.q:
+                found.append(np.arange(start, end, dtype=np.int64)) # gram bound is vacuous here
+                continue
+            cands = self._probe(query_grams, need, max_dist, start, end)
+            if len(cands):
+                found.append(self._count_filter(cands, query_grams, need, max_dist, cand_length, start, end))
+
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(self.positions[np.concatenate(found)])
+
+    def _probe(self, query_grams: np.ndarray, need: int, max_dist: int, start: int, end: int) -> np.ndarray:
+        """
+        Prefix filter: an ID matching none of any (occurrences - need + 1) query
+        grams shares fewer than need, so probing only the rarest occurrences
+        (each at its position +- max_dist) finds every candidate in [start, end).
+        """
+        if len(self.keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        shifts = np.arange(-max_dist, max_dist + 1)
+        positions = np.arange(len(query_grams))[:, None] + shifts[None, :]
+        probes = _positional_keys(np.repeat(query_grams[:, None], len(shifts), axis=1), np.maximum(positions, 0))
+        slots = np.minimum(np.searchsorted(self.keys, probes), len(self.keys) - 1)
+        known = (self.keys[slots] == probes) & (positions >= 0)
+        sizes = np.where(known, self.offsets[slots + 1] - self.offsets[slots], 0)
+
+        idx_parts = []
+        for occurrence in np.argsort(sizes.sum(axis=1), kind='stable')[:len(query_grams) - need + 1]:
+            for slot in np.unique(slots[occurrence][known[occurrence]]):
+                lo, hi = self.offsets[slot], self.offsets[slot + 1]
+                s, e = np.searchsorted(self.post_idx[lo:hi], [start, end])
+                idx_parts.append(self.post_idx[lo + s:lo + e])
+        if not idx_parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(idx_parts)).astype(np.int64)
+
+    def _count_filter(self, cands: np.ndarray, query_grams: np.ndarray, need: int, max_dist: int,
+                      cand_length: int, start: int, end: int) -> np.ndarray:
+        """Keeps IDs where at least need query grams occur within max_dist positions."""
+        width = cand_length - self.q + 1
+        block = self.grams[self.gram_offsets[start]:self.gram_offsets[end]].reshape(end - start, width)
+        rows = block[cands - start]
+        matched = np.zeros((len(cands), len(query_grams)), dtype=bool)
+        for shift in range(-max_dist, max_dist + 1):
+            p = np.arange(max(0, -shift), min(len(query_grams), width - shift))
+            if len(p):
+                matched[:, p] |= rows[:, p + shift] == query_grams[p]
+        return cands[matched.sum(axis=1) >= need]
+
+    def save(self, path: str, version: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, format_version=INDEX_FORMAT_VERSION, version=version,
+                 positions=self.positions, lengths=self.lengths, gram_offsets=self.gram_offsets,
+                 grams=self.grams, keys=self.keys, offsets=self.offsets, post_idx=self.post_idx,
+                 q=self.q, cutoff=self.cutoff)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, version: str) -> Optional["CandidateIndex"]:
+        """Returns the stored index, or None if it is missing or was built for other master data."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if int(data["format_version"]) != INDEX_FORMAT_VERSION or str(data["version"]) != version:
+                return None
+            return cls(data["positions"], data["lengths"], data["gram_offsets"], data["grams"],
+                       data["keys"], data["offsets"], data["post_idx"], int(data["q"]), float(data["cutoff"]))
@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+import pandas as pd
+from typing import Dict, Optional, Tuple
+from incremental import file_hashes
+
+# --- Silver Checkpoints ---
+# Each raw file's Silver output (its validated rows, with the reconciled ones
+# for snapshots, and its quarantine) is checkpointed once computed, so a run
+# that failed later (merging events, writing the fact table) or a re-run with
+# other aggregation settings starts from Silver instead of parsing every CSV
+# and re-running fuzzy reconciliation. Cross-file dedupe and everything after
+# it always run: they depend on the other files, not just this one.
+#
+# A checkpoint is keyed by the file's name and content hash and by a context
+# (its dataset's rules and the master data, see main.open_checkpoints), so a
+# change invalidates exactly the checkpoints it affects. Frames are pickled:
+# a fast binary format that restores dtypes (categoricals, nullable ints) and
+# the row index the quarantine is ordered by exactly. Content hashes are
+# remembered by size and mtime, so unchanged files are not read to be hashed.
+CHECKPOINT_VERSION = 2 # 2: quarantines carry reason codes
+INDEX_FILE = "index.json"
+Silver = Tuple[int, pd.DataFrame, pd.DataFrame, int] # rows read, valid (with recovered), quarantine, recovered
+
+class SilverCheckpoints:
+    """
+    The checkpoints of one run's files in data_dir, each with its context.
+    Picklable, so pool workers load and save checkpoints themselves; the
+    parent calls commit() once the run's outputs are written.
+    """
+    def __init__(self, path: str, data_dir: str, contexts: Dict[str, str]):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        known = self._load_index()
+        self.hashes = file_hashes(data_dir, contexts, known)
+        self.keys = {}
+        for f, context in contexts.items():
+            key = f"{CHECKPOINT_VERSION}\0{context}\0{f}\0{self.hashes[f]['sha256']}"
+            self.keys[f] = hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def _load_index(self) -> Dict:
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {}
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        return index.get("files", {}) if index.get("version") == CHECKPOINT_VERSION else {}
+
+    def _file(self, f: str) -> Optional[str]:
+        key = self.keys.get(f)
+        return os.path.join(self.path, key + ".pkl") if key else None
+
+    def __contains__(self, f: str) -> bool:
+        """Whether the file is checkpointed under its current content and context."""
+        path = self._file(f)
+        return path is not None and os.path.exists(path)
+
+    def load(self, f: str) -> Silver:
+        return pd.read_pickle(self._file(f))
+
+    def save(self, f: str, silver: Silver):
+        path = self._file(f)
+        if path is None:
+            return
+        tmp = f"{path}.{os.getpid()}.tmp"
+        pd.to_pickle(silver, tmp)
+        os.replace(tmp, path)
+
+    def commit(self):
+        """Records the content hashes and removes checkpoints no current file or context uses."""
+        current = {key + ".pkl" for key in self.keys.values()}
+        for name in os.listdir(self.path):
+            if name != INDEX_FILE and name not in current:
+                os.remove(os.path.join(self.path, name))
+        index_path = os.path.join(self.path, INDEX_FILE)
+        with open(index_path + ".tmp", 'w') as f:
+            json.dump({"version": CHECKPOINT_VERSION, "files": self.hashes}, f)
+        os.replace(index_path + ".tmp", index_path)
@@ -0,0 +1,113 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, List
+
+# --- Stage Graph ---
+# A run expressed as a DAG of named stages, each a function of its
+# dependencies' results (in the order the dependencies were listed). The
+# scheduler starts stages whose dependencies are done on a thread pool, so
+# independent branches overlap: pandas, numpy and the CSV parsers release the
+# GIL for much of their work, and results are handed over in memory. At most
+# workers stages run at once. Ready stages start in the order they were added,
+# those with dependencies first, so work already under way (a file that was
+# read) moves on before new work (reading the next file) starts. A stage's
+# result is dropped once every stage that depends on it has finished, unless
+# nothing depends on it (the graph's outputs).
+#
+# Each stage's start and end (seconds from the run's start) and thread CPU
+# time are recorded. The critical path is the chain of dependent stages with
+# the longest total duration: the wall time no amount of concurrency gets
+# below, and where speeding up a stage shortens the run.
+
+class StageGraph:
+    def __init__(self):
+        self.stages: Dict[str, tuple] = {} # name -> (fn, deps), in insertion (so topological) order
+        self.timings: Dict[str, Dict] = {}
+
+    def add(self, name: str, fn: Callable, deps: Iterable[str] = ()) -> str:
+        """Adds a stage. Dependencies must already be in the graph, which keeps it acyclic."""
+        deps = tuple(deps)
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage '{name}'")
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages {missing}")
+        self.stages[name] = (fn, deps)
+        return name
+
+    def run(self, workers: int = 1) -> Dict[str, object]:
+        """Runs every stage, up to workers at a time. Returns the results of stages nothing depends on."""
+        waiting = {name: set(deps) for name, (_, deps) in self.stages.items()}
+        consumers = {name: 0 for name in self.stages}
+        for _, deps in self.stages.values():
+            for dep in deps:
+                consumers[dep] += 1
+        outputs = {name for name, count in consumers.items() if count == 0}
+        results = {}
+        self.timings = {}
+        origin = time.perf_counter()
+
+        def call(name):
+            fn, deps = self.stages[name]
+            began, cpu = time.perf_counter(), time.thread_time()
+            result = fn(*(results[dep] for dep in deps))
+            self.timings[name] = {"stage": name, "deps": list(deps), "start": round(began - origin, 4),
+                                  "end": round(time.perf_counter() - origin, 4),
+                                  "cpu_seconds": round(time.thread_time() - cpu, 4),
+                                  "thread": threading.current_thread().name}
+            return result
+
+        workers = max(1, workers)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage") as pool:
+            running = {}
+            try:
+                while waiting or running:
+                    ready = sorted((name for name, deps in waiting.items() if not deps),
+                                   key=lambda name: not self.stages[name][1])
+                    for name in ready[:workers - len(running)]:
+                        del waiting[name]
+                        running[pool.submit(call, name)] = name
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        results[name] = future.result()
+                        for deps in waiting.values():
+                            deps.discard(name)
+                        for dep in self.stages[name][1]:
+                            consumers[dep] -= 1
+                            if consumers[dep] == 0 and dep not in outputs:
+                                del results[dep]
+            except BaseException:
+                # Stages not started yet never run; running ones finish before the error propagates
+                for future in running:
+                    future.cancel()
+                raise
+        return {name: results[name] for name in outputs}
+
+    def critical_path(self) -> List[str]:
+        """The chain of dependent stages with the longest total duration, first stage first."""
+        total, via = {}, {}
+        for name, (_, deps) in self.stages.items():
+            timing = self.timings[name]
+            before = max(deps, key=lambda dep: total[dep], default=None)
+            total[name] = timing["end"] - timing["start"] + (total[before] if before else 0.0)
+            via[name] = before
+        # On ties the later stage wins, so the path runs on through instant stages to the end
+        path, name = [], max(reversed(list(total)), key=total.get, default=None)
+        while name is not None:
+            path.append(name)
+            name = via[name]
+        return path[::-1]
+
+    def report(self) -> Dict:
+        """Per-stage timings in start order, the critical path and the run's wall time."""
+        stages = sorted(self.timings.values(), key=lambda timing: (timing["start"], timing["stage"]))
+        path = self.critical_path()
+        return {
+            "stages": [{**timing, "seconds": round(timing["end"] - timing["start"], 4)} for timing in stages],
+            "critical_path": path,
+            "critical_path_seconds": round(sum(self.timings[name]["end"] - self.timings[name]["start"]
+                                               for name in path), 4),
+            "wall_seconds": max((timing["end"] for timing in stages), default=0.0),
+        }
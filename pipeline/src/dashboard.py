@@ -2,6 +2,11 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import os
+from datetime import timedelta
+from storage import FACT_NAME, QUARANTINE_NAME, query_dataset, dataset_mtime
+from metrics import load_metrics
+from rollups import ROLLUP_FILE, load_rollup
+from ledger import LEDGER_NAME, OPEN_KEYS_FILE, open_counts, scan_ledger
 
 # Page Config
 st.set_page_config(page_title="Retail Ops Intelligence", layout="wide")
@@ -14,41 +19,83 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__)) # pipeline/src
 # Go up one level to find data
 DATA_DIR = os.path.join(os.path.dirname(BASE_DIR), "data")
 
-PROCESSED_PATH = os.path.join(DATA_DIR, "processed", "inventory_fact.csv")
-QUARANTINE_PATH = os.path.join(DATA_DIR, "quarantine", "quarantine_records.csv")
+PROCESSED_DIR = os.path.join(DATA_DIR, "processed")
+QUARANTINE_DIR = os.path.join(DATA_DIR, "quarantine")
+LEDGER_DIR = os.path.join(QUARANTINE_DIR, LEDGER_NAME)
+OPEN_KEYS_PATH = os.path.join(LEDGER_DIR, OPEN_KEYS_FILE)
+METRICS_PATH = os.path.join(DATA_DIR, "metrics", "run_metrics.jsonl")
+ROLLUP_PATH = os.path.join(PROCESSED_DIR, ROLLUP_FILE)
+PRODUCTS_PATH = os.path.join(DATA_DIR, "raw", "products.csv")
+PAGE_SIZES = [50, 100, 500, 1000]
+
+def file_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+@st.cache_data(max_entries=64)
+def load_page(base_dir, name, mtime, filters, offset, limit):
+    # mtime is only the cache key: a pipeline run replaces the dataset and busts it.
+    # Only the requested page is read into memory and sent to the browser; Parquet
+    # outputs are pruned by their date/store_id partitions, CSVs scanned in chunks
+    return query_dataset(base_dir, name, filters, offset, limit)
+
+@st.cache_data
+def load_categories(mtime):
+    # category -> product IDs, for the category filter
+    if mtime is None:
+        return {}
+    products = pd.read_csv(PRODUCTS_PATH, usecols=['product_id', 'category'])
+    return products.groupby('category')['product_id'].apply(list).to_dict()
+
+@st.cache_data
+def load_dashboard_rollup(mtime):
+    # Headline metrics and summary charts come from the run's precomputed rollup,
+    # so they cost the same however large the fact table grows
+    return load_rollup(ROLLUP_PATH)
 
 @st.cache_data
-def load_data():
-    inv_df = pd.DataFrame()
-    quarantine_df = pd.DataFrame()
-    
-    if os.path.exists(PROCESSED_PATH):
-        inv_df = pd.read_csv(PROCESSED_PATH)
-    
-    if os.path.exists(QUARANTINE_PATH):
-        quarantine_df = pd.read_csv(QUARANTINE_PATH)
-        
-    return inv_df, quarantine_df
-
-inv_df, quarantine_df = load_data()
+def load_open_counts(mtime):
+    return open_counts(LEDGER_DIR) if mtime is not None else {}
+
+@st.cache_data(max_entries=16)
+def load_open_records(mtime, dataset, since, until):
+    # mtime is only the cache key: a pipeline run rewrites the open keys and busts it.
+    # Only the ledger partitions holding open records are read
+    return scan_ledger(LEDGER_DIR, dataset, since, until, unresolved_only=True)
+
+@st.cache_data
+def load_run_metrics(mtime):
+    # mtime is only the cache key: a new run appends to the log and busts it
+    reports = load_metrics(METRICS_PATH)
+    runs = pd.DataFrame([{
+        "started_at": r["started_at"], "run_id": r["run_id"], "mode": r["mode"],
+        "wall_seconds": r["wall_seconds"], "cpu_seconds": r["cpu_seconds"], "peak_rss_mb": r["peak_rss_mb"],
+        "quarantine_total": r["quarantine_total"], "reconciliation_hit_rate": r["reconciliation"]["hit_rate"],
+    } for r in reports])
+    stages = pd.DataFrame([{"started_at": r["started_at"], "run_id": r["run_id"], "stage": name, **stage}
+                           for r in reports for name, stage in r["stages"].items()])
+    reasons = pd.DataFrame([{"started_at": r["started_at"], "reason": reason, "count": count}
+                            for r in reports for reason, count in r["quarantine_by_reason"].items()])
+    files = pd.DataFrame([{"run_id": r["run_id"], **{k: v for k, v in f.items() if k != "stages"},
+                           "wall_seconds": sum(s["wall_seconds"] for s in f["stages"].values())}
+                          for r in reports for f in r["files"]])
+    for frame in (runs, stages, reasons):
+        if not frame.empty:
+            frame["started_at"] = pd.to_datetime(frame["started_at"])
+    return runs, stages, reasons, files
+
+rollup = load_dashboard_rollup(file_mtime(ROLLUP_PATH))
+if rollup is None:
+    st.warning("No dashboard rollup found. Run the pipeline (python main.py) to build it.")
+    rollup = {"totals": {}, "quarantine_rows": 0, "quality_score": None,
+              "by_store": [], "by_category": [], "quarantine_by_reason": {}}
 
 # Top Level Metrics
-total_stock = 0
-total_products = 0
-total_damaged = 0
-quarantine_count = len(quarantine_df)
-valid_count = len(inv_df)
-quality_score = 0
-
-if not inv_df.empty:
-    total_stock = inv_df['effective_stock'].sum()
-    total_products = inv_df['product_id'].nunique()
-    if 'damaged_qty' in inv_df.columns:
-        total_damaged = inv_df['damaged_qty'].sum()
-    
-total_processed = valid_count + quarantine_count
-if total_processed > 0:
-    quality_score = (valid_count / total_processed) * 100
+totals = rollup["totals"]
+total_stock = totals.get("effective_stock", 0)
+total_products = totals.get("active_skus", 0)
+total_damaged = totals.get("damaged_qty", 0)
+quarantine_count = rollup["quarantine_rows"]
+quality_score = rollup["quality_score"] or 0
 
 col1, col2, col3, col4, col5 = st.columns(5)
 with col1:
@@ -69,10 +116,10 @@ c1, c2 = st.columns(2)
 
 with c1:
     st.subheader("Inventory Flow (Restock vs Damage)")
-    if not inv_df.empty and 'restock_qty' in inv_df.columns and 'damaged_qty' in inv_df.columns:
+    if totals:
         flow_data = pd.DataFrame({
             "Type": ["Total Restocked", "Total Damaged"],
-            "Units": [inv_df['restock_qty'].sum(), inv_df['damaged_qty'].sum()]
+            "Units": [totals["restock_qty"], totals["damaged_qty"]]
         })
         fig_flow = px.bar(flow_data, x="Type", y="Units", color="Type", 
                           color_discrete_map={"Total Restocked": "blue", "Total Damaged": "orange"})
@@ -80,28 +127,141 @@ with c1:
 
 with c2:
     st.subheader("Quarantine Reasons")
-    if not quarantine_df.empty:
-        # Extract base reason (sometimes we might have detailed strings)
-        # Just count by 'quarantine_reason'
-        reason_counts = quarantine_df['quarantine_reason'].value_counts().reset_index()
-        reason_counts.columns = ['Reason', 'Count']
+    if rollup["quarantine_by_reason"]:
+        # Reasons are grouped (type errors without the offending value)
+        reason_counts = pd.DataFrame(list(rollup["quarantine_by_reason"].items()), columns=['Reason', 'Count'])
         fig_reasons = px.bar(reason_counts, x="Count", y="Reason", orientation='h', color="Reason")
         st.plotly_chart(fig_reasons, use_container_width=True)
     else:
         st.info("No quarantine records found. Great job!")
 
+c3, c4 = st.columns(2)
+
+with c3:
+    st.subheader("Effective Stock by Category")
+    if rollup["by_category"]:
+        by_category = pd.DataFrame(rollup["by_category"])
+        fig_category = px.bar(by_category, x="category", y="effective_stock", color="category",
+                              hover_data=["skus", "restock_qty", "damaged_qty"])
+        st.plotly_chart(fig_category, use_container_width=True)
+
+with c4:
+    st.subheader("Effective Stock by Store (Top 20)")
+    if rollup["by_store"]:
+        by_store = pd.DataFrame(rollup["by_store"]).nlargest(20, "effective_stock")
+        fig_store = px.bar(by_store, x="store_id", y="effective_stock",
+                           hover_data=["skus", "restock_qty", "damaged_qty"])
+        st.plotly_chart(fig_store, use_container_width=True)
+
 # Detailed Views
 st.divider()
 st.subheader("Inventory Deep Dive")
 
-tab1, tab2 = st.tabs(["Fact Table (Valid)", "Quarantine Ledger"])
+def filter_controls(key, reasons=None):
+    """Filter widgets for a table view. Returns storage filters (column, op, value)."""
+    filters = []
+    f1, f2, f3, f4 = st.columns(4)
+    stores = f1.multiselect("Store", [row["store_id"] for row in rollup["by_store"]], key=f"{key}_store")
+    if stores:
+        filters.append(("store_id", "in", stores))
+    product = f2.text_input("Product ID starts with", key=f"{key}_product").strip()
+    if product:
+        filters.append(("product_id", "startswith", product))
+    categories = load_categories(file_mtime(PRODUCTS_PATH))
+    chosen = f3.multiselect("Category", sorted(categories), key=f"{key}_category")
+    if chosen:
+        filters.append(("product_id", "in", sorted({p for c in chosen for p in categories[c]})))
+    dates = f4.date_input("Date range", value=(), key=f"{key}_dates")
+    if len(dates) == 2:
+        filters.append(("date", ">=", dates[0].isoformat()))
+        filters.append(("date", "<", (dates[1] + timedelta(days=1)).isoformat()))
+    if reasons:
+        chosen_reasons = st.multiselect("Reason", reasons, key=f"{key}_reason")
+        if chosen_reasons:
+            # A row lists all its reasons, type errors with the offending value, so match reasons as substrings
+            filters.append(("quarantine_reason", "contains", chosen_reasons))
+    return filters
+
+def paged_table(base_dir, name, filters, key):
+    """Shows one page of the filtered dataset. Returns the number of matching rows."""
+    p1, p2 = st.columns([1, 3])
+    page_size = p1.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_size")
+    page = p2.number_input("Page", min_value=1, value=1, step=1, key=f"{key}_page")
+    page_df, total = load_page(base_dir, name, dataset_mtime(base_dir, name), filters,
+                               (page - 1) * page_size, page_size)
+    pages = max(1, -(-total // page_size))
+    if page > pages:
+        st.info(f"Only {pages} page(s) match the filters.")
+    else:
+        st.dataframe(page_df, use_container_width=True)
+    st.caption(f"Page {page} of {pages} | {total:,} matching rows")
+    return total
+
+tab1, tab2, tab3 = st.tabs(["Fact Table (Valid)", "Quarantine Ledger", "Pipeline Performance"])
 
 with tab1:
-    st.dataframe(inv_df, use_container_width=True)
+    paged_table(PROCESSED_DIR, FACT_NAME, filter_controls("fact"), "fact")
 
 with tab2:
-    if not quarantine_df.empty:
-        st.dataframe(quarantine_df, use_container_width=True)
+    q_filters = filter_controls("quarantine", reasons=sorted(rollup["quarantine_by_reason"]))
+    if paged_table(QUARANTINE_DIR, QUARANTINE_NAME, q_filters, "quarantine"):
         st.caption("These records require manual intervention or rule adjustment.")
-    else:
+    elif not q_filters:
         st.write("No issues.")
+
+    with st.expander("Unresolved records by first quarantine date"):
+        ledger_mtime = file_mtime(OPEN_KEYS_PATH)
+        open_by_dataset = load_open_counts(ledger_mtime)
+        if not open_by_dataset:
+            st.write("No unresolved records in the ledger.")
+        else:
+            l1, l2 = st.columns(2)
+            dataset = l1.selectbox("Dataset", sorted(open_by_dataset),
+                                   format_func=lambda name: f"{name} ({open_by_dataset[name]:,} open)")
+            first_seen = l2.date_input("First quarantined", value=(), key="ledger_dates")
+            since, until = (first_seen[0].isoformat(), first_seen[1].isoformat()) if len(first_seen) == 2 \
+                else (None, None)
+            open_df = load_open_records(ledger_mtime, dataset, since, until)
+            st.dataframe(open_df.head(PAGE_SIZES[-1]), use_container_width=True)
+            st.caption(f"{len(open_df):,} unresolved records (up to {PAGE_SIZES[-1]:,} shown)")
+
+with tab3:
+    metrics_mtime = file_mtime(METRICS_PATH)
+    runs_df, stages_df, reasons_df, files_df = load_run_metrics(metrics_mtime)
+    if runs_df.empty:
+        st.write("No run metrics yet. They are recorded by every pipeline run.")
+    else:
+        latest = runs_df.iloc[-1]
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Last Run", f"{latest['wall_seconds']:.2f}s", latest['mode'])
+        m2.metric("CPU Time", f"{latest['cpu_seconds']:.2f}s")
+        m3.metric("Peak RSS", f"{latest['peak_rss_mb']} MB")
+        hit_rate = latest['reconciliation_hit_rate']
+        m4.metric("Fuzzy Match Hit Rate", "-" if pd.isna(hit_rate) else f"{hit_rate:.0%}")
+
+        p1, p2 = st.columns(2)
+        with p1:
+            st.subheader("Run Duration")
+            fig_runs = px.line(runs_df, x="started_at", y="wall_seconds", color="mode", markers=True)
+            st.plotly_chart(fig_runs, use_container_width=True)
+        with p2:
+            st.subheader("Time per Stage")
+            fig_stages = px.bar(stages_df, x="started_at", y="wall_seconds", color="stage")
+            st.plotly_chart(fig_stages, use_container_width=True)
+
+        p3, p4 = st.columns(2)
+        with p3:
+            st.subheader("Peak Memory (RSS)")
+            fig_rss = px.line(runs_df, x="started_at", y="peak_rss_mb", color="mode", markers=True)
+            st.plotly_chart(fig_rss, use_container_width=True)
+        with p4:
+            st.subheader("Quarantine by Reason")
+            if not reasons_df.empty:
+                fig_q = px.bar(reasons_df, x="started_at", y="count", color="reason")
+                st.plotly_chart(fig_q, use_container_width=True)
+
+        st.subheader("Slowest Files (Last Run)")
+        if not files_df.empty:
+            last_files = files_df[files_df["run_id"] == latest["run_id"]]
+            st.dataframe(last_files.sort_values("wall_seconds", ascending=False).head(20),
+                         use_container_width=True)
@@ -1,151 +1,431 @@
-import pandas as pd
-import random
-from faker import Faker
 import os
-from datetime import datetime
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
 
-fake = Faker()
-Faker.seed(42)  # For reproducibility
+# Paths
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # pipeline/
+OUTPUT_DIR = os.path.join(BASE_DIR, "data", "raw")
+LATE_DIR = os.path.join(BASE_DIR, "data", "late")
+EXPECTED_DIR = os.path.join(BASE_DIR, "data", "expected")
 
-# Configuration
+# Configuration (defaults; every value can be overridden per run)
 NUM_PRODUCTS = 50
 NUM_STORES = 5
-NUM_SNAPSHOTS = 200
-NUM_RESTOCKS = 50
-OUTPUT_DIR = r"C:\Users\91823\.gemini\antigravity\brain\8f155d49-b9ca-49ba-bcb8-3c7db8ff8b32\pipeline\data\raw"
-
-def generate_products():
-    products = []
-    # Create some "base" products to simulate logic
-    categories = ['Electronics', 'Clothing', 'Home', 'Toys']
-    for i in range(NUM_PRODUCTS):
-        cat = random.choice(categories)
-        products.append({
-            "product_id": f"P{str(i).zfill(4)}",
-            "product_name": f"{fake.word()} {cat}",
-            "category": cat,
-            "unit_price": round(random.uniform(10.0, 500.0), 2)
-        })
-    df = pd.DataFrame(products)
-    df.to_csv(os.path.join(OUTPUT_DIR, "products.csv"), index=False)
-    return df
-
-def generate_stores():
-    stores = []
-    for i in range(NUM_STORES):
-        stores.append({
-            "store_id": f"S{str(i).zfill(3)}",
-            "store_name": f"{fake.city()} Store",
-            "city": fake.city()
-        })
-    df = pd.DataFrame(stores)
-    df.to_csv(os.path.join(OUTPUT_DIR, "stores.csv"), index=False)
-    return df
-
-def generate_inventory_snapshot(products_df, stores_df):
-    snapshots = []
-    product_ids = products_df['product_id'].tolist()
-    store_ids = stores_df['store_id'].tolist()
-    
-    # 1. Valid Data
-    for _ in range(NUM_SNAPSHOTS):
-        product_id = random.choice(product_ids)
-        snapshots.append({
-            "date": datetime.now().strftime("%Y-%m-%d"),
-            "store_id": random.choice(store_ids),
-            "product_id": product_id,
-            "quantity": random.randint(0, 500)
-        })
-    
-    # 2. INTRODUCE ERRORS (For Validation Testing)
-    
-    # Error: Negative Stock
-    snapshots.append({
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "store_id": list(store_ids)[0],
-        "product_id": list(product_ids)[0],
-        "quantity": -10 # INVALID
-    })
-    
-    # Error: Mismatched Product ID (Typos for fuzzy matching)
-    # Pick a real product and mutate it slightly
-    valid_pid = list(product_ids)[5] # e.g., P0005
-    invalid_pid = valid_pid.replace("0", "O") # P0O05
-    snapshots.append({
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "store_id": list(store_ids)[0],
-        "product_id": invalid_pid, # INVALID
-        "quantity": 50
-    })
-    
-    # Error: Duplicate Entry for same store/product/date
-    dup_pid = list(product_ids)[2]
-    dup_store = list(store_ids)[1]
-    snapshots.append({
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "store_id": dup_store,
-        "product_id": dup_pid,
-        "quantity": 100
-    })
-    snapshots.append({
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "store_id": dup_store,
-        "product_id": dup_pid, # DUPLICATE
-        "quantity": 120 # Conflicting qty
+NUM_DAYS = 1
+START_DATE = "2026-01-01" # Fixed, like SEED, so the same arguments give the same files on any day
+SEED = 42
+COVERAGE = 0.8 # Share of (store, product) pairs reported in each day's snapshot
+RESTOCK_RATE = 0.2 # Share of pairs restocked per day
+DAMAGE_RATE = 0.1 # Share of pairs with a damage entry per day
+BLOCK_ROWS = 1_000_000 # Pairs generated per vectorized block, bounds memory at any scale
+LAYOUTS = ("daily", "per_store") # One file per dataset and day, or one per dataset, day and store
+LATE_RATE = 0.0 # Share of files held back in late_dir, to be delivered after the run
+RESEND_RATE = 0.0 # Share of files also delivered a second time, unchanged, in late_dir
+DATASETS = ("inventory_snapshot", "restock_events", "damaged_log")
+EVENT_COLUMNS = {"restock_events": "restock_qty", "damaged_log": "damaged_qty"}
+
+# Error mix: share of rows that get each defect
+ERROR_RATES = {
+    "negative": 0.005, # Negative snapshot quantity / damaged quantity (fails min_0)
+    "typo": 0.005, # Product ID with one character dropped (Unknown Product ID, fuzzy-matchable)
+    "duplicate": 0.005, # Second row for the same store/product/date with a conflicting quantity
+    "oversize": 0.01, # Restock above the max_1000 limit
+}
+
+CATEGORIES = ['Electronics', 'Clothing', 'Home', 'Toys']
+WORDS = ['purpose', 'brother', 'member', 'station', 'garden', 'river', 'signal', 'copper',
+         'harbor', 'summit', 'meadow', 'canvas', 'falcon', 'ember', 'orbit', 'willow']
+CITIES = ['Northfield', 'Riverton', 'Lakeside', 'Fairview', 'Springdale', 'Hillcrest',
+          'Oakridge', 'Brookhaven', 'Cedarville', 'Westport']
+
+def _ids(prefix: str, count: int, min_digits: int) -> np.ndarray:
+    digits = max(min_digits, len(str(max(count - 1, 0))))
+    return np.char.add(prefix, np.char.zfill(np.arange(count).astype(str), digits))
+
+def generate_products(num_products: int = NUM_PRODUCTS, seed: int = SEED) -> pd.DataFrame:
+    rng = np.random.default_rng([seed, 0])
+    # Five digits at least, so dropping one character still scores >= MATCH_THRESHOLD
+    categories = rng.choice(CATEGORIES, size=num_products)
+    return pd.DataFrame({
+        "product_id": _ids("P", num_products, 5),
+        "product_name": np.char.add(np.char.add(rng.choice(WORDS, size=num_products), " "), categories),
+        "category": categories,
+        "unit_price": np.round(rng.uniform(10.0, 500.0, size=num_products), 2),
     })
 
-    df = pd.DataFrame(snapshots)
-    df.to_csv(os.path.join(OUTPUT_DIR, f"inventory_snapshot_{datetime.now().strftime('%Y%m%d')}.csv"), index=False)
-    return df
-
-def generate_restock_events(products_df, stores_df):
-    events = []
-    product_ids = products_df['product_id'].tolist()
-    store_ids = stores_df['store_id'].tolist()
-
-    for _ in range(NUM_RESTOCKS):
-        events.append({
-            "event_date": datetime.now().strftime("%Y-%m-%d"),
-            "store_id": random.choice(store_ids),
-            "product_id": random.choice(product_ids),
-            "restock_qty": random.randint(10, 200)
-        })
-    
-    # Error: Logical Max (Huge restock)
-    events.append({
-        "event_date": datetime.now().strftime("%Y-%m-%d"),
-        "store_id": list(store_ids)[0],
-        "product_id": list(product_ids)[0],
-        "restock_qty": 50000 # Unrealistic
+def generate_stores(num_stores: int = NUM_STORES, seed: int = SEED) -> pd.DataFrame:
+    rng = np.random.default_rng([seed, 1])
+    return pd.DataFrame({
+        "store_id": _ids("S", num_stores, 3),
+        "store_name": np.char.add(rng.choice(CITIES, size=num_stores), " Store"),
+        "city": rng.choice(CITIES, size=num_stores),
     })
 
-    df = pd.DataFrame(events)
-    df.to_csv(os.path.join(OUTPUT_DIR, f"restock_events_{datetime.now().strftime('%Y%m%d')}.csv"), index=False)
-    return df
-
-def generate_damaged_log(products_df, stores_df):
-    logs = []
-    product_ids = products_df['product_id'].tolist()
-    store_ids = stores_df['store_id'].tolist()
-    
-    # Generate some random damage events
-    for _ in range(30):
-        logs.append({
-            "date": datetime.now().strftime("%Y-%m-%d"),
-            "store_id": random.choice(store_ids),
-            "product_id": random.choice(product_ids),
-            "damaged_qty": random.randint(1, 20)
-        })
-    
-    df = pd.DataFrame(logs)
-    df.to_csv(os.path.join(OUTPUT_DIR, f"damaged_log_{datetime.now().strftime('%Y%m%d')}.csv"), index=False)
-    return df
+def _drop_char(ids: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Deletes one character (never the prefix letter) from each fixed-width ID."""
+    width = ids.dtype.itemsize // 4
+    codes = np.ascontiguousarray(ids).view(np.uint32).reshape(len(ids), width)
+    drop = rng.integers(1, width, size=len(ids))
+    keep = np.arange(width)[None, :] != drop[:, None]
+    return codes[keep].reshape(len(ids), width - 1).copy().view(f"<U{width - 1}").ravel()
+
+def _with_duplicates(df: pd.DataFrame, qty_col: str, rate: float, low: int, high: int,
+                     rng: np.random.Generator) -> pd.DataFrame:
+    dup = rng.random(len(df)) < rate
+    if not dup.any():
+        return df
+    copies = df[dup].copy()
+    copies[qty_col] = rng.integers(low, high, size=len(copies))
+    return pd.concat([df, copies], ignore_index=True)
+
+def _day_block(day: str, store_ids: np.ndarray, product_ids: np.ndarray, rng: np.random.Generator,
+               coverage: float, restock_rate: float, damage_rate: float, error_rates: dict):
+    """Snapshot, restock and damaged rows for one block of stores on one day."""
+    stores = np.repeat(store_ids, len(product_ids))
+    products = np.tile(product_ids, len(store_ids))
+    n = len(stores)
+    rates = {**ERROR_RATES, **(error_rates or {})}
+
+    # Snapshots
+    reported = rng.random(n) < coverage
+    quantity = rng.integers(0, 501, size=n)
+    negative = rng.random(n) < rates["negative"]
+    quantity[negative] = -rng.integers(1, 51, size=negative.sum())
+    snap_products = products.copy()
+    typo = rng.random(n) < rates["typo"]
+    if typo.any():
+        snap_products[typo] = _drop_char(snap_products[typo], rng)
+    snapshot = pd.DataFrame({"date": day, "store_id": stores[reported],
+                             "product_id": snap_products[reported], "quantity": quantity[reported]})
+    snapshot = _with_duplicates(snapshot, "quantity", rates["duplicate"], 0, 501, rng)
+
+    # Restocks
+    restocked = rng.random(n) < restock_rate
+    restock_qty = rng.integers(10, 201, size=restocked.sum())
+    oversize = rng.random(len(restock_qty)) < rates["oversize"]
+    restock_qty[oversize] = rng.integers(1001, 50001, size=oversize.sum())
+    restock = pd.DataFrame({"event_date": day, "store_id": stores[restocked],
+                            "product_id": products[restocked], "restock_qty": restock_qty})
+    restock = _with_duplicates(restock, "restock_qty", rates["duplicate"], 10, 201, rng)
+
+    # Damaged
+    damaged = rng.random(n) < damage_rate
+    damaged_qty = rng.integers(1, 21, size=damaged.sum())
+    negative = rng.random(len(damaged_qty)) < rates["negative"]
+    damaged_qty[negative] = -damaged_qty[negative]
+    damaged_log = pd.DataFrame({"date": day, "store_id": stores[damaged],
+                                "product_id": products[damaged], "damaged_qty": damaged_qty})
+    damaged_log = _with_duplicates(damaged_log, "damaged_qty", rates["duplicate"], 1, 21, rng)
+
+    return snapshot, restock, damaged_log
+
+# --- Expected Results ---
+# Each mode records the Gold table the pipeline should publish, worked out
+# from the generated frames by the rules the generator injects errors for,
+# not by pipeline code:
+#   * a snapshot row is valid unless negative, duplicated in its file or
+#     typo'd; a typo'd row with a non-negative quantity is recovered as the
+#     lowest catalog ID one inserted digit away (the first fuzzy match);
+#   * an event row is valid unless oversize, negative or duplicated in its
+#     file; a re-sent event file is quarantined whole as already accepted;
+#   * a key's stock restarts at each snapshot and moves with the valid
+#     events from that day on; events of keys never snapshotted are dropped.
+# The expectation is kept twice: with every file, and with the on-time files
+# only (before the late ones are delivered).
+EXPECTED_FACT = "inventory_fact.csv"
+EXPECTED_ON_TIME_FACT = "inventory_fact_on_time.csv"
+EXPECTED_SUMMARY = "expected.json"
+ARRIVALS_FILE = "arrivals.csv"
+FACT_KEYS = ["store_id", "product_id"]
+
+def _recover_typos(ids: np.ndarray, num_products: int) -> np.ndarray:
+    """
+    The lowest catalog ID one inserted digit away from each typo'd ID: at
+    every spot a 0 gives the lowest ID, so only the spot is searched.
+    """
+    digits = max(5, len(str(max(num_products - 1, 0))))
+    codes = np.ascontiguousarray(ids.astype(f"<U{digits}")).view(np.uint32).reshape(len(ids), digits)
+    values = (codes[:, 1:] - ord('0')).astype(np.int64)
+    powers = 10 ** np.arange(digits - 1, -1, -1, dtype=np.int64)
+    best = np.full(len(ids), num_products, dtype=np.int64)
+    for spot in range(digits):
+        candidate = (values[:, :spot] * powers[:spot]).sum(axis=1) + (values[:, spot:] * powers[spot + 1:]).sum(axis=1)
+        best = np.where(candidate < best, candidate, best)
+    return np.char.add("P", np.char.zfill(best.astype(str), digits))
+
+def _expected_snapshot(snapshot: pd.DataFrame, num_products: int):
+    """(surviving rows, quarantined mask) of one snapshot file's rows."""
+    width = 1 + max(5, len(str(max(num_products - 1, 0))))
+    products = snapshot['product_id'].to_numpy(dtype=str)
+    negative = snapshot['quantity'].to_numpy() < 0
+    duplicate = snapshot.duplicated(FACT_KEYS, keep=False).to_numpy()
+    typo = np.char.str_len(products) != width
+    valid = snapshot[~(negative | duplicate | typo)]
+    # Only rows failing on their product ID alone are reconciled (see pipeline_core's Quarantine Reasons)
+    recovered = snapshot[typo & ~negative & ~duplicate].copy()
+    recovered['product_id'] = _recover_typos(products[typo & ~negative & ~duplicate], num_products)
+    rows = pd.concat([valid, recovered], ignore_index=True).drop_duplicates(FACT_KEYS, keep='last')
+    return rows, negative | duplicate | typo
+
+def _expected_events(events: pd.DataFrame, qty_col: str):
+    """(valid rows, quarantined mask) of one event file's rows."""
+    qty = events[qty_col].to_numpy()
+    bad = (qty < 0) | (qty > 1000) | events.duplicated(FACT_KEYS, keep=False).to_numpy()
+    return events[~bad], bad
+
+class ExpectedState:
+    """Running expected position per (store, product), folded day by day."""
+    def __init__(self):
+        self.state = pd.DataFrame(columns=['date', 'quantity', 'restock_qty', 'damaged_qty'],
+                                  index=pd.MultiIndex.from_tuples([], names=FACT_KEYS))
+
+    def fold(self, snapshot: pd.DataFrame, events: dict):
+        """Applies one day's valid snapshot rows, then that day's valid event rows."""
+        fresh = snapshot.set_index(FACT_KEYS)[['date', 'quantity']].assign(restock_qty=0, damaged_qty=0)
+        kept = self.state[~self.state.index.isin(fresh.index)]
+        self.state = pd.concat([kept, fresh]) if len(kept) else fresh
+        for qty_col, rows in events.items():
+            moved = rows.set_index(FACT_KEYS)[qty_col].reindex(self.state.index)
+            self.state[qty_col] = self.state[qty_col] + moved.fillna(0).astype(np.int64).to_numpy()
+
+    def fact(self) -> pd.DataFrame:
+        fact = self.state.reset_index()[['date'] + FACT_KEYS + ['quantity', 'restock_qty', 'damaged_qty']]
+        fact['effective_stock'] = fact['quantity'] + fact['restock_qty'] - fact['damaged_qty']
+        return fact
+
+# --- File Layout and Arrival ---
+# A task is one day's blocks (daily layout: every block goes into the same
+# file) or one block (per_store layout: each block's stores get their own
+# files). Tasks write their own files, so they run in worker processes; which
+# files arrive late or twice is drawn from a separate seeded stream, so the
+# data itself is the same in every layout and arrival mix.
+_gen = {}
+
+def _init_generator(output_dir, late_dir, store_ids, product_ids, params):
+    _gen.update(output_dir=output_dir, late_dir=late_dir, store_ids=store_ids, product_ids=product_ids, **params)
+
+def _file_name(dataset: str, stamp: str, store_id: str = None) -> str:
+    return f"{dataset}_{stamp}_{store_id}.csv" if store_id else f"{dataset}_{stamp}.csv"
+
+def _split_files(layout: str, dataset: str, stamp: str, frame: pd.DataFrame):
+    """(file name, store ID or None, rows) of each file a block's frame is written to."""
+    if layout == "daily":
+        return [(_file_name(dataset, stamp), None, frame)]
+    return [(_file_name(dataset, stamp, store), store, rows)
+            for store, rows in frame.groupby('store_id', sort=False)]
+
+def _generate_task(task):
+    """Generates and writes one task's files. Returns what the parent needs to fold the expectation."""
+    day_index, day, blocks = task
+    g = _gen
+    stamp = day.replace('-', '')
+    written = {}  # file -> (dataset, store, on_time, resent, quarantined, valid)
+    truths = []
+    handles = {}
+    try:
+        for block, first in blocks:
+            rng = np.random.default_rng([g["seed"], 2, day_index, block])
+            frames = _day_block(day, g["store_ids"][first:first + g["stores_per_block"]], g["product_ids"], rng,
+                                g["coverage"], g["restock_rate"], g["damage_rate"], g["error_rates"])
+            arrival = np.random.default_rng([g["seed"], 3, day_index, block])
+            truth = {"block": block}
+            for dataset, frame in zip(DATASETS, frames):
+                if dataset == "inventory_snapshot":
+                    rows, bad = _expected_snapshot(frame, len(g["product_ids"]))
+                else:
+                    rows, bad = _expected_events(frame, EVENT_COLUMNS[dataset])
+                frame = frame.assign(_bad=bad)
+                late_stores = set()
+                for name, store, part in _split_files(g["layout"], dataset, stamp, frame):
+                    if name not in written:
+                        late, resent = arrival.random(2) < (g["late_rate"], g["resend_rate"])
+                        handles[name] = open(os.path.join(g["late_dir"] if late else g["output_dir"], name),
+                                             'w', newline='')
+                        written[name] = {"dataset": dataset, "store_id": store, "late": bool(late),
+                                         "resent": bool(resent), "rows": 0, "quarantined": 0}
+                    info = written[name]
+                    part.drop(columns='_bad').to_csv(handles[name], header=info["rows"] == 0, index=False)
+                    info["rows"] += len(part)
+                    info["quarantined"] += int(part['_bad'].sum())
+                    if info["late"]:
+                        late_stores.add(store)
+                truth[dataset] = (rows, late_stores)
+            truths.append(truth)
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    # Re-sent files are byte-for-byte copies delivered with the late ones; the suffix sorts them last
+    for name, info in written.items():
+        if info["resent"]:
+            src = os.path.join(g["late_dir"] if info["late"] else g["output_dir"], name)
+            with open(src, 'rb') as f, open(os.path.join(g["late_dir"], name[:-4] + "_resent.csv"), 'wb') as out:
+                out.write(f.read())
+    return day_index, day, written, truths
+
+def _on_time(rows: pd.DataFrame, late_stores: set) -> pd.DataFrame:
+    if not late_stores:
+        return rows
+    if None in late_stores:
+        return rows.iloc[:0]
+    return rows[~rows['store_id'].isin(late_stores)]
+
+def _write_expected(expected_dir: str, states: dict, on_time_states: dict, arrivals: list, summary: dict):
+    os.makedirs(expected_dir, exist_ok=True)
+    for filename, block_states in ((EXPECTED_FACT, states), (EXPECTED_ON_TIME_FACT, on_time_states)):
+        facts = [state.fact() for _, state in sorted(block_states.items())]
+        fact = pd.concat(facts, ignore_index=True) if facts else ExpectedState().fact()
+        fact.to_csv(os.path.join(expected_dir, filename), index=False)
+        key = "all" if filename == EXPECTED_FACT else "on_time"
+        summary[key].update(fact_rows=len(fact), effective_stock_total=int(fact['effective_stock'].sum()))
+    pd.DataFrame(arrivals, columns=["file", "dataset", "date", "store_id", "arrival", "resent_of"]).to_csv(
+        os.path.join(expected_dir, ARRIVALS_FILE), index=False)
+    with open(os.path.join(expected_dir, EXPECTED_SUMMARY), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+def check_fact(fact: pd.DataFrame, expected_dir: str, on_time: bool = False) -> dict:
+    """
+    Compares a published fact table with the expected one (on_time: the one
+    without the late files). Returns row counts and how many keys are
+    missing, extra or carry a different position.
+    """
+    expected = pd.read_csv(os.path.join(expected_dir, EXPECTED_ON_TIME_FACT if on_time else EXPECTED_FACT))
+    values = ['quantity', 'restock_qty', 'damaged_qty', 'effective_stock']
+    merged = fact[FACT_KEYS + ['date'] + values].merge(expected, on=FACT_KEYS, how='outer', indicator=True,
+                                                       suffixes=('', '_expected'))
+    both = merged[merged['_merge'] == 'both']
+    differs = pd.to_datetime(both['date']) != pd.to_datetime(both['date_expected'])
+    for col in values:
+        differs = differs | (both[col].astype(np.int64) != both[col + '_expected'])
+    result = {"rows": len(fact), "expected_rows": len(expected),
+              "missing": int((merged['_merge'] == 'right_only').sum()),
+              "extra": int((merged['_merge'] == 'left_only').sum()), "different": int(differs.sum())}
+    result["correct"] = result["missing"] == result["extra"] == result["different"] == 0
+    return result
+
+def generate_dataset(output_dir: str = OUTPUT_DIR, num_stores: int = NUM_STORES,
+                     num_products: int = NUM_PRODUCTS, num_days: int = NUM_DAYS,
+                     start_date=START_DATE, seed: int = SEED, coverage: float = COVERAGE,
+                     restock_rate: float = RESTOCK_RATE, damage_rate: float = DAMAGE_RATE,
+                     error_rates: dict = None, layout: str = "daily", workers: int = 1,
+                     late_rate: float = LATE_RATE, resend_rate: float = RESEND_RATE,
+                     late_dir: str = None, expected_dir: str = None) -> dict:
+    """
+    Writes products.csv, stores.csv and the snapshot, restock and damaged
+    files into output_dir: one per day, or with layout="per_store" one per
+    day and store. Rows are built a block of stores at a time with numpy, and
+    every (day, block) draws from its own seeded generator, so the same
+    arguments always produce the same rows in any layout; workers > 1 writes
+    files from that many processes. late_rate and resend_rate hold files back
+    in late_dir and deliver copies there. The expected Gold tables (with and
+    without the late files), an arrivals list and a summary go to
+    expected_dir. Returns row and file counts.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}', expected one of {LAYOUTS}")
+    data_dir = os.path.dirname(os.path.abspath(output_dir))
+    late_dir = late_dir or os.path.join(data_dir, "late")
+    expected_dir = expected_dir or os.path.join(data_dir, "expected")
+    for path in (output_dir, late_dir):
+        os.makedirs(path, exist_ok=True)
+    start = date.fromisoformat(start_date) if isinstance(start_date, str) else start_date
+
+    products_df = generate_products(num_products, seed)
+    stores_df = generate_stores(num_stores, seed)
+    products_df.to_csv(os.path.join(output_dir, "products.csv"), index=False)
+    stores_df.to_csv(os.path.join(output_dir, "stores.csv"), index=False)
+
+    product_ids = products_df['product_id'].to_numpy(dtype=str)
+    store_ids = stores_df['store_id'].to_numpy(dtype=str)
+    stores_per_block = max(1, BLOCK_ROWS // max(num_products, 1))
+    params = {"seed": seed, "coverage": coverage, "restock_rate": restock_rate, "damage_rate": damage_rate,
+              "error_rates": error_rates, "layout": layout, "late_rate": late_rate, "resend_rate": resend_rate,
+              "stores_per_block": stores_per_block}
+    blocks = list(enumerate(range(0, num_stores, stores_per_block)))
+    days = [(start + timedelta(days=day_index)).isoformat() for day_index in range(num_days)]
+    if layout == "daily":
+        tasks = [(day_index, day, blocks) for day_index, day in enumerate(days)]
+    else:
+        tasks = [(day_index, day, [b]) for day_index, day in enumerate(days) for b in blocks]
+
+    counts = {"products": num_products, "stores": num_stores, **{name: 0 for name in DATASETS},
+              "files": 0, "late_files": 0, "resent_files": 0}
+    summary = {"layout": layout, "late_rate": late_rate, "resend_rate": resend_rate,
+               "all": {"quarantined": 0}, "on_time": {"quarantined": 0}}
+    states, on_time_states, arrivals = {}, {}, []
+
+    def fold(result):
+        _, day, written, truths = result
+        for name, info in written.items():
+            counts[info["dataset"]] += info["rows"]
+            counts["files"] += 1
+            counts["late_files"] += info["late"]
+            arrivals.append([name, info["dataset"], day, info["store_id"], "late" if info["late"] else "on_time", None])
+            summary["all"]["quarantined"] += info["quarantined"]
+            if not info["late"]:
+                summary["on_time"]["quarantined"] += info["quarantined"]
+            if info["resent"]:
+                counts["resent_files"] += 1
+                arrivals.append([name[:-4] + "_resent.csv", info["dataset"], day, info["store_id"], "late", name])
+                # A re-sent event file's valid rows are already accepted; a snapshot just repeats itself
+                repeated = info["rows"] if info["dataset"] in EVENT_COLUMNS else info["quarantined"]
+                summary["all"]["quarantined"] += repeated
+        for truth in truths:
+            block = truth["block"]
+            snapshot, late_snapshots = truth["inventory_snapshot"]
+            events = {EVENT_COLUMNS[name]: truth[name][0] for name in EVENT_COLUMNS}
+            states.setdefault(block, ExpectedState()).fold(snapshot, events)
+            on_time_events = {EVENT_COLUMNS[name]: _on_time(*truth[name]) for name in EVENT_COLUMNS}
+            on_time_states.setdefault(block, ExpectedState()).fold(_on_time(snapshot, late_snapshots),
+                                                                   on_time_events)
+
+    init_args = (output_dir, late_dir, store_ids, product_ids, params)
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_generator, initargs=init_args) as pool:
+            for result in pool.map(_generate_task, tasks):
+                fold(result)
+    else:
+        _init_generator(*init_args)
+        for task in tasks:
+            fold(_generate_task(task))
+
+    _write_expected(expected_dir, states, on_time_states, arrivals, summary)
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate synthetic inventory data")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--stores", type=int, default=NUM_STORES)
+    parser.add_argument("--products", type=int, default=NUM_PRODUCTS)
+    parser.add_argument("--days", type=int, default=NUM_DAYS)
+    parser.add_argument("--start-date", default=START_DATE, help=f"First day (YYYY-MM-DD); defaults to {START_DATE}")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--coverage", type=float, default=COVERAGE)
+    parser.add_argument("--restock-rate", type=float, default=RESTOCK_RATE)
+    parser.add_argument("--damage-rate", type=float, default=DAMAGE_RATE)
+    for name, rate in ERROR_RATES.items():
+        parser.add_argument(f"--{name}-rate", type=float, default=rate,
+                            help=f"Share of rows with a {name} error (default {rate})")
+    parser.add_argument("--layout", choices=LAYOUTS, default="daily",
+                        help="One file per dataset and day, or one per dataset, day and store")
+    parser.add_argument("--workers", type=int, default=1, help="Processes writing files")
+    parser.add_argument("--late-rate", type=float, default=LATE_RATE,
+                        help="Share of files held back in --late-dir")
+    parser.add_argument("--resend-rate", type=float, default=RESEND_RATE,
+                        help="Share of files delivered again, unchanged, in --late-dir")
+    parser.add_argument("--late-dir", default=None, help=f"Defaults to {LATE_DIR} (next to --output-dir)")
+    parser.add_argument("--expected-dir", default=None, help=f"Defaults to {EXPECTED_DIR} (next to --output-dir)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_args()
     print("Generating Synthetic Data...")
-    products = generate_products()
-    stores = generate_stores()
-    generate_inventory_snapshot(products, stores)
-    generate_restock_events(products, stores)
-    generate_damaged_log(products, stores)
-    print(f"Data generated in {OUTPUT_DIR}")
+    counts = generate_dataset(args.output_dir, args.stores, args.products, args.days, args.start_date,
+                              args.seed, args.coverage, args.restock_rate, args.damage_rate,
+                              {name: getattr(args, f"{name}_rate") for name in ERROR_RATES}, args.layout,
+                              args.workers, args.late_rate, args.resend_rate, args.late_dir, args.expected_dir)
+    print(f"Data generated in {args.output_dir}: {counts}")
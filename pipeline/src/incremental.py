@@ -0,0 +1,136 @@
+import os
+import json
+import hashlib
+import shutil
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from pipeline_core import QUARANTINE_CODE, TYPE_COLUMNS, apply_types
+
+# --- Manifest Functions ---
+# The manifest records every raw file the pipeline has already ingested, so an
+# incremental run only has to process files that are new or whose content changed.
+MANIFEST_VERSION = 4 # 2: per-file state holds per-day aggregates; 3: quarantine rows carry their source;
+                     # 4: quarantine rows carry reason codes
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_fingerprint(path: str) -> Dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def file_hashes(data_dir: str, files, known: Optional[Dict] = None) -> Dict[str, Dict]:
+    """
+    Fingerprint and content hash of each file. Hashes in known (entries of
+    this shape from an earlier run) are reused when size and mtime match.
+    """
+    known = known or {}
+    hashes = {}
+    for f in files:
+        entry = file_fingerprint(os.path.join(data_dir, f))
+        old = known.get(f)
+        if old and old.get("size") == entry["size"] and old.get("mtime") == entry["mtime"]:
+            entry["sha256"] = old["sha256"]
+        else:
+            entry["sha256"] = file_hash(os.path.join(data_dir, f))
+        hashes[f] = entry
+    return hashes
+
+def load_manifest(state_dir: str) -> Dict:
+    path = os.path.join(state_dir, "manifest.json")
+    if not os.path.exists(path):
+        return {"version": MANIFEST_VERSION, "context": None, "files": {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(state_dir: str, manifest: Dict):
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, "manifest.json")
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def diff_manifest(manifest: Dict, data_dir: str, files: List[str]) -> Tuple[List[str], List[str], List[str], Dict]:
+    """
+    Compares the raw files on disk with the manifest.
+    Returns (new, changed, removed, entries) where entries are the up-to-date
+    manifest records for every file in `files`. Size and mtime are checked
+    first; a file is only hashed when they differ, and a touched file whose
+    content hash is unchanged is not reprocessed.
+    """
+    known = manifest.get("files", {})
+    new, changed, entries = [], [], {}
+    for f in files:
+        path = os.path.join(data_dir, f)
+        entry = file_fingerprint(path)
+        old = known.get(f)
+        if old and old["size"] == entry["size"] and old["mtime"] == entry["mtime"]:
+            entries[f] = old
+            continue
+        entry["sha256"] = file_hash(path)
+        entries[f] = entry
+        if old is None:
+            new.append(f)
+        elif old.get("sha256") != entry["sha256"]:
+            changed.append(f)
+    removed = sorted(set(known) - set(files))
+    return new, changed, removed, entries
+
+# --- Per-file State ---
+# Each ingested file leaves behind its compact contribution (latest rows per
+# key, or per-key totals) and its quarantined rows. Changed or removed files
+# can then be retracted by re-merging the remaining contributions.
+def _file_state_path(state_dir: str, filename: str, kind: str) -> str:
+    return os.path.join(state_dir, "files", f"{filename}.{kind}.csv")
+
+def save_file_state(state_dir: str, filename: str, partial: pd.DataFrame, quarantine: pd.DataFrame):
+    os.makedirs(os.path.join(state_dir, "files"), exist_ok=True)
+    partial.to_csv(_file_state_path(state_dir, filename, "partial"), index=False)
+    quarantine.to_csv(_file_state_path(state_dir, filename, "quarantine"), index=False)
+
+def _read_state_csv(path: str, rules: Optional[Dict]) -> pd.DataFrame:
+    # Restores the compact dtypes a fresh ingest would produce (see load_csv).
+    # Stored quarantine rows keep their codes; re-parsing their bad values flags nothing new.
+    if rules is None:
+        return pd.read_csv(path)
+    df = pd.read_csv(path, dtype=str)
+    if QUARANTINE_CODE in df.columns:
+        df[QUARANTINE_CODE] = df[QUARANTINE_CODE].astype('int64')
+    return apply_types(df, rules).drop(columns=TYPE_COLUMNS, errors='ignore')
+
+def load_file_state(state_dir: str, filename: str,
+                    rules: Optional[Dict] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return (_read_state_csv(_file_state_path(state_dir, filename, "partial"), rules),
+            _read_state_csv(_file_state_path(state_dir, filename, "quarantine"), rules))
+
+def drop_file_state(state_dir: str, filename: str):
+    for kind in ("partial", "quarantine"):
+        path = _file_state_path(state_dir, filename, kind)
+        if os.path.exists(path):
+            os.remove(path)
+
+# --- Running Totals ---
+# The merged per-key state (latest snapshots and event totals). New files are
+# folded straight into it; only retractions force a re-merge from per-file state.
+def save_running_state(state_dir: str, name: str, frame: Optional[pd.DataFrame]):
+    path = os.path.join(state_dir, f"{name}.csv")
+    if frame is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    frame.to_csv(path, index=False)
+
+def load_running_state(state_dir: str, name: str, rules: Optional[Dict] = None) -> Optional[pd.DataFrame]:
+    path = os.path.join(state_dir, f"{name}.csv")
+    if not os.path.exists(path):
+        return None
+    return _read_state_csv(path, rules)
+
+def reset_state(state_dir: str):
+    if os.path.exists(state_dir):
+        shutil.rmtree(state_dir)
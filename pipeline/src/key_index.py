@@ -0,0 +1,366 @@
+import os
+import json
+import shutil
+import hashlib
+import uuid
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from pipeline_core import KEY_COLUMNS, ACCEPTED_KEY_REASON, get_date_column
+
+# --- Accepted Key Index ---
+# Remembers which raw file first supplied each accepted (store, product, date)
+# key of a dataset, across files and across runs, so a re-sent file or a key
+# split over two files is quarantined instead of counted twice. Keys are
+# 64-bit hashes (store and product hashed once per distinct value, mixed with
+# the day number), so a batch of rows is checked with vectorized numpy
+# operations.
+#
+# Storage is a small LSM tree under the index directory: sorted segments of
+# keys with their owning file's id (raw little-endian files, memory-mapped for
+# lookups), merged pairwise whenever the newest is at least half the size of
+# the one before, so there are O(log n) segments and merges stream through
+# MERGE_CHUNK keys at a time. A Bloom filter (also memory-mapped) in front of
+# them sends most new keys past the segment searches; its hits are confirmed
+# exactly against the segments. Memory is the Bloom filter's pages plus the
+# current run's new keys, whatever the history holds.
+#
+# A file owns its keys while it is unchanged (same size and mtime). When it
+# changes or disappears its owner id is retired, its keys stop counting and
+# the files that were blocked by it are reported, to be re-validated.
+INDEX_VERSION = 1
+KEY_DTYPE = np.dtype('<u8')
+OWNER_DTYPE = np.dtype('<i4')
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 4
+MIN_BLOOM_KEYS = 1 << 16
+MERGE_CHUNK = 1 << 20
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, elementwise on uint64."""
+    x = x.astype(np.uint64, copy=True)
+    with np.errstate(over='ignore'):
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return x
+
+def _hash_text(series: pd.Series) -> np.ndarray:
+    # blake2b of each distinct value (stable across processes and library versions)
+    codes, uniques = pd.factorize(series.astype(object), use_na_sentinel=True)
+    hashes = np.array([int.from_bytes(hashlib.blake2b(str(v).encode(), digest_size=8).digest(), 'little')
+                       for v in uniques] + [0], dtype=np.uint64)
+    return hashes[codes]
+
+def _day_numbers(dates: pd.Series) -> np.ndarray:
+    # NaT becomes the smallest int64, a day of its own
+    days = pd.to_datetime(dates, errors='coerce').to_numpy(dtype='datetime64[D]').astype(np.int64)
+    return days.astype(np.uint64)
+
+def key_hashes(df: pd.DataFrame) -> np.ndarray:
+    """64-bit key of each row's (store_id, product_id, date or event_date)."""
+    date_col = get_date_column(df.columns)
+    store, product = (_hash_text(df[col]) for col in KEY_COLUMNS)
+    with np.errstate(over='ignore'):
+        return _mix(_mix(store ^ _mix(product + np.uint64(1))) + _day_numbers(df[date_col]))
+
+class BloomFilter:
+    """Bloom filter over uint64 keys in a memory-mapped bit array of a power-of-two size."""
+    def __init__(self, path: str):
+        self.path = path
+        self.mask = np.uint64(os.path.getsize(path) * 8 - 1)
+        self.bits = np.memmap(path, dtype=np.uint8, mode='r+')
+
+    @staticmethod
+    def create(path: str, capacity: int) -> "BloomFilter":
+        bits = 1 << max(int(capacity * BLOOM_BITS_PER_KEY - 1).bit_length(), 3)
+        with open(path, 'wb') as f:
+            f.truncate(bits // 8)
+        return BloomFilter(path)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.bits) * 8 // BLOOM_BITS_PER_KEY
+
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        step = _mix(keys ^ np.uint64(0x9E3779B97F4A7C15)) | np.uint64(1)
+        with np.errstate(over='ignore'):
+            return np.stack([(keys + np.uint64(i) * step) & self.mask for i in range(BLOOM_HASHES)])
+
+    def add(self, keys: np.ndarray):
+        if len(keys):
+            positions = self._positions(keys).ravel()
+            np.bitwise_or.at(self.bits, (positions >> np.uint64(3)).astype(np.int64),
+                             (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        if not len(keys):
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(keys)
+        bits = self.bits[(positions >> np.uint64(3)).astype(np.int64)]
+        return ((bits >> (positions & np.uint64(7)).astype(np.uint8)) & 1).astype(bool).all(axis=0)
+
+    def flush(self):
+        self.bits.flush()
+
+class SortedSegments:
+    """
+    uint64 keys with one value each, stored in directory path as the LSM tree
+    described above: sorted segments (name.keys and name + VALUE_EXT), the
+    current run's additions in memory until saved, a Bloom filter in front.
+    Subclasses set self.meta (with "segments" and "keys") before _open(), and
+    may drop entries from lookups and merges by overriding _keep.
+    """
+    VALUE_EXT = ".owners"
+    VALUE_DTYPE = OWNER_DTYPE
+
+    def _load_meta(self) -> Optional[Dict]:
+        meta_path = os.path.join(self.path, "index.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    def _open(self):
+        self.segments = [self._open_segment(name) for name in self.meta["segments"]]
+        self.new_segments = [] # this run's additions, (keys, values) in memory until saved
+        bloom_path = os.path.join(self.path, "bloom.bin")
+        if os.path.exists(bloom_path):
+            self.bloom = BloomFilter(bloom_path)
+        else:
+            self._rebuild_bloom(bloom_path)
+
+    def _open_segment(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        base = os.path.join(self.path, name)
+        if os.path.getsize(base + ".keys") == 0:
+            return np.empty(0, dtype=KEY_DTYPE), np.empty(0, dtype=self.VALUE_DTYPE)
+        return (np.memmap(base + ".keys", dtype=KEY_DTYPE, mode='r'),
+                np.memmap(base + self.VALUE_EXT, dtype=self.VALUE_DTYPE, mode='r'))
+
+    def _keep(self, values: np.ndarray) -> np.ndarray:
+        """Which stored entries, by value, still count."""
+        return np.ones(len(values), dtype=bool)
+
+    def _lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Whether each key (sorted input) is stored, and its value; later segments win."""
+        found = np.zeros(len(keys), dtype=bool)
+        values = np.zeros(len(keys), dtype=self.VALUE_DTYPE)
+        for seg_keys, seg_values in self.segments + self.new_segments:
+            if not len(seg_keys):
+                continue
+            idx = np.searchsorted(seg_keys, keys)
+            inside = idx < len(seg_keys)
+            hit = np.zeros(len(keys), dtype=bool)
+            hit[inside] = seg_keys[idx[inside]] == keys[inside]
+            hit[hit] = self._keep(seg_values[idx[hit]])
+            found |= hit
+            values[hit] = seg_values[idx[hit]]
+        return found, values
+
+    def find(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """_lookup for keys in any order; only the Bloom filter's hits are searched."""
+        found = np.zeros(len(keys), dtype=bool)
+        values = np.zeros(len(keys), dtype=self.VALUE_DTYPE)
+        candidates = np.flatnonzero(self.bloom.contains(keys))
+        if len(candidates):
+            order = candidates[np.argsort(keys[candidates], kind='stable')]
+            found[order], values[order] = self._lookup(keys[order])
+        return found, values
+
+    def _add(self, keys: np.ndarray, values: np.ndarray):
+        """Stores keys (new ones) with their values until the next save."""
+        order = np.argsort(keys, kind='stable')
+        self.new_segments.append((keys[order], values[order].astype(self.VALUE_DTYPE)))
+        self.bloom.add(keys)
+        self.meta["keys"] += len(keys)
+        self._merge_new()
+
+    def _merge_new(self):
+        while len(self.new_segments) > 1 and len(self.new_segments[-1][0]) * 2 >= len(self.new_segments[-2][0]):
+            (a_keys, a_values), (b_keys, b_values) = self.new_segments.pop(-2), self.new_segments.pop()
+            keys = np.concatenate([a_keys, b_keys])
+            order = np.argsort(keys, kind='stable')
+            self.new_segments.append((keys[order], np.concatenate([a_values, b_values])[order]))
+
+    def _write_segment(self, chunks: Iterable[Tuple[np.ndarray, np.ndarray]]) -> str:
+        name = f"seg-{uuid.uuid4().hex[:12]}"
+        base = os.path.join(self.path, name)
+        with open(base + ".keys", 'wb') as keys_file, open(base + self.VALUE_EXT, 'wb') as values_file:
+            for keys, values in chunks:
+                keys.astype(KEY_DTYPE).tofile(keys_file)
+                values.astype(self.VALUE_DTYPE).tofile(values_file)
+        return name
+
+    def _merged_chunks(self, a, b):
+        """Merges two sorted segments MERGE_CHUNK keys at a time, dropping entries _keep rejects."""
+        (a_keys, a_values), (b_keys, b_values) = a, b
+        i = j = 0
+        while i < len(a_keys) or j < len(b_keys):
+            limits = [x[min(k + MERGE_CHUNK, len(x)) - 1] for x, k in ((a_keys, i), (b_keys, j)) if k < len(x)]
+            limit = min(limits)
+            i_end = int(np.searchsorted(a_keys, limit, side='right')) if i < len(a_keys) else i
+            j_end = int(np.searchsorted(b_keys, limit, side='right')) if j < len(b_keys) else j
+            keys = np.concatenate([a_keys[i:i_end], b_keys[j:j_end]])
+            values = np.concatenate([a_values[i:i_end], b_values[j:j_end]])
+            order = np.argsort(keys, kind='stable')
+            keys, values = keys[order], values[order]
+            keep = self._keep(values)
+            yield keys[keep], values[keep]
+            i, j = i_end, j_end
+
+    def _save_segments(self) -> List[str]:
+        """
+        Writes this run's additions as segments and merges segments down,
+        updating meta. Returns the names of the segments merged away, for
+        _commit to remove.
+        """
+        names = list(self.meta["segments"])
+        for keys, values in self.new_segments:
+            names.append(self._write_segment([(keys, values)]))
+            self.segments.append(self._open_segment(names[-1]))
+        self.new_segments = []
+        obsolete = []
+        while len(self.segments) > 1 and len(self.segments[-1][0]) * 2 >= len(self.segments[-2][0]):
+            b, a = self.segments.pop(), self.segments.pop()
+            merged = self._write_segment(self._merged_chunks(a, b))
+            del a, b # unmapped, so the files can be removed below (Windows refuses to delete mapped files)
+            obsolete += names[-2:]
+            names[-2:] = [merged]
+            self.segments.append(self._open_segment(merged))
+        self.meta["segments"] = names
+        self.meta["keys"] = int(sum(len(keys) for keys, _ in self.segments))
+        return obsolete
+
+    def _commit(self, obsolete: List[str]):
+        """Stores the metadata, removes the obsolete segments and grows the Bloom filter if it is full."""
+        self.bloom.flush()
+        meta_path = os.path.join(self.path, "index.json")
+        with open(meta_path + ".tmp", 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        for name in obsolete:
+            for ext in (".keys", self.VALUE_EXT):
+                if os.path.exists(os.path.join(self.path, name + ext)):
+                    os.remove(os.path.join(self.path, name + ext))
+        if self.meta["keys"] > self.bloom.capacity:
+            self._rebuild_bloom(self.bloom.path)
+
+    def _rebuild_bloom(self, path: str):
+        """Sizes the Bloom filter for twice the stored keys and fills it from the segments."""
+        bloom = BloomFilter.create(path + ".tmp", max(2 * self.meta["keys"], MIN_BLOOM_KEYS))
+        for keys, _ in self.segments:
+            for start in range(0, len(keys), MERGE_CHUNK):
+                bloom.add(np.asarray(keys[start:start + MERGE_CHUNK]))
+        bloom.flush()
+        del bloom
+        self.bloom = None # the old mapping must be closed before its file is replaced
+        os.replace(path + ".tmp", path)
+        self.bloom = BloomFilter(path)
+
+class KeyIndex(SortedSegments):
+    """
+    The accepted-key index of one dataset, in directory path. Call sync()
+    with the dataset's current files before claiming, claim() per file in
+    processing order, and save() once the run's outputs are published.
+    context fingerprints the rules and master data; when it differs from the
+    stored one the index starts over, as incremental state does.
+    """
+    def __init__(self, path: str, context: Optional[str] = None):
+        self.path = path
+        meta = self._load_meta()
+        if meta is None or meta.get("version") != INDEX_VERSION or meta.get("context") != context:
+            shutil.rmtree(path, ignore_errors=True)
+            meta = {"version": INDEX_VERSION, "context": context, "next_owner": 0, "owners": {},
+                    "blocked": {}, "segments": [], "keys": 0}
+        os.makedirs(path, exist_ok=True)
+        self.meta = meta
+        self.owners = {int(i): o for i, o in meta["owners"].items()} # id -> {"file", "fingerprint", "live"}
+        self._open()
+        self.present = {}
+        self.claimed = set()
+
+    def _live_mask(self) -> np.ndarray:
+        live = np.zeros(self.meta["next_owner"] + 1, dtype=bool)
+        for owner_id, owner in self.owners.items():
+            live[owner_id] = owner["live"]
+        return live
+
+    def _keep(self, values: np.ndarray) -> np.ndarray:
+        return self._live_mask()[values.astype(np.int64)]
+
+    def _live_owner(self, f: str) -> Optional[int]:
+        for owner_id, owner in self.owners.items():
+            if owner["file"] == f and owner["live"]:
+                return owner_id
+        return None
+
+    def sync(self, present: Dict[str, list]) -> Set[str]:
+        """
+        Retires owners whose file is gone or changed (fingerprints are
+        [size, mtime]). Returns the present files that must be validated again
+        for their keys to be right: retired owners and files blocked by them.
+        """
+        self.present = {f: list(fingerprint) for f, fingerprint in present.items()}
+        self.meta["blocked"] = {f: owners for f, owners in self.meta["blocked"].items() if f in self.present}
+        retired = set()
+        for owner in self.owners.values():
+            if owner["live"] and self.present.get(owner["file"]) != owner["fingerprint"]:
+                owner["live"] = False
+                retired.add(owner["file"])
+        blocked = {f for f, owners in self.meta["blocked"].items() if retired & set(owners)}
+        return (retired | blocked) & set(self.present)
+
+    def claim(self, df: pd.DataFrame, f: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Claims df's keys (unique within the file) for file f. Returns a mask of
+        the rows whose key another file already owns, and those files' names.
+        """
+        return self.claim_keys(key_hashes(df) if not df.empty else np.empty(0, dtype=KEY_DTYPE), f)
+
+    def claim_keys(self, keys: np.ndarray, f: str) -> Tuple[np.ndarray, np.ndarray]:
+        """claim() for keys already hashed with key_hashes, e.g. by a pool worker. A file may claim in parts."""
+        owner_id = self._live_owner(f)
+        if owner_id is None:
+            owner_id = self.meta["next_owner"]
+            self.meta["next_owner"] += 1
+            self.owners[owner_id] = {"file": f, "fingerprint": self.present.get(f), "live": True}
+        if f not in self.claimed:
+            self.claimed.add(f)
+            self.meta["blocked"].pop(f, None)
+        if not len(keys):
+            return np.zeros(0, dtype=bool), np.empty(0, dtype=object)
+
+        found, owners = self.find(keys)
+        owners = np.where(found, owners.astype(np.int64), -1)
+        duplicate = (owners >= 0) & (owners != owner_id)
+        new = owners < 0
+        if new.any():
+            self._add(keys[new], np.full(int(new.sum()), owner_id, dtype=OWNER_DTYPE))
+        names = np.array([self.owners[o]["file"] for o in owners[duplicate]], dtype=object)
+        if len(names):
+            blocked = set(self.meta["blocked"].get(f, [])) | set(names)
+            self.meta["blocked"][f] = sorted(blocked)
+        return duplicate, names
+
+    def save(self):
+        """Writes this run's claims as segments, merges segments down and stores the metadata."""
+        obsolete = self._save_segments()
+        # Retired owners no segment refers to any more are forgotten
+        referenced = set()
+        for _, owners in self.segments:
+            referenced.update(np.unique(owners).tolist())
+        self.owners = {i: o for i, o in self.owners.items() if o["live"] or i in referenced}
+        self.meta["owners"] = {str(i): o for i, o in self.owners.items()}
+        self._commit(obsolete)
+
+def file_fingerprints(data_dir: str, files: Iterable[str]) -> Dict[str, list]:
+    fingerprints = {}
+    for f in files:
+        stat = os.stat(os.path.join(data_dir, f))
+        fingerprints[f] = [stat.st_size, stat.st_mtime]
+    return fingerprints
+
+def duplicate_reasons(owner_files: np.ndarray) -> List[str]:
+    return [f"{ACCEPTED_KEY_REASON} ({owner})" for owner in owner_files]
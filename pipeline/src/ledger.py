@@ -0,0 +1,343 @@
+import os
+import json
+import shutil
+import hashlib
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional
+from incremental import file_hashes
+from key_index import SortedSegments
+
+# --- Quarantine Ledger ---
+# quarantine_records holds only the current run's quarantine and is replaced
+# every run. The ledger keeps the history: an append-only store partitioned as
+# run_date=YYYY-MM-DD/dataset=<name>/part-<run_id>-<seq>.(csv|parquet),
+# holding each quarantined record once, from the run that first saw it.
+#
+# A record's key is a 64-bit hash of its dataset, source file, its own column
+# values (canonicalised, so CSV and Parquet round trips agree) and its
+# occurrence among identical rows of that file. Keys already in the ledger are
+# kept under seen_keys/ with the run date of their partition, in the same kind
+# of LSM tree as the accepted-key index (sorted memory-mapped segments behind a
+# Bloom filter), so looking up a run's keys costs what the run holds rather
+# than what the history does; a rerun over the same files appends nothing.
+# open_keys.npz holds the keys still in quarantine (with their source
+# file, dataset and run date) and the fingerprint of every file they came
+# from: a file's rules, master data and content. A run hashes only the rows of
+# files whose fingerprint changed and carries the other files' open keys
+# forward, so it costs what changed, whatever the size of the quarantine or
+# the history. A record that drops out of the quarantine is logged under
+# resolutions/.
+LEDGER_NAME = "quarantine_ledger"
+LEDGER_VERSION = 2 # 2: files are fingerprinted and only changed files' records are hashed
+SOURCE_COLUMNS = ['dataset', 'source_file']
+SEEN_DIR = "seen_keys"
+SEEN_VERSION = 1
+KEYS_FILE = "record_keys.bin" # where keys were listed before SEEN_DIR, with their dates in DATES_FILE
+DATES_FILE = "record_dates.bin"
+OPEN_KEYS_FILE = "open_keys.npz"
+RESOLUTIONS_DIR = "resolutions"
+LEDGER_EXTENSIONS = (".csv", ".parquet")
+UNKNOWN_DATE = -1 # run date of keys listed before dates were
+EPOCH = date(1970, 1, 1)
+
+def _text(value) -> str:
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()[:10]
+    return str(value)
+
+def _canonical(series: pd.Series) -> pd.Series:
+    """Values as text that does not depend on how the column was typed or stored (None for missing)."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        text = series.dt.strftime('%Y-%m-%d')
+    else:
+        text = series.astype(object).map(_text)
+        numeric = pd.to_numeric(series.astype(object), errors='coerce').astype(float)
+        integral = np.isfinite(numeric) & (numeric % 1 == 0) & (numeric.abs() < 2 ** 53)
+        text = text.where(~integral, numeric[integral].astype('int64').astype(str))
+    return text.where(series.notna(), None)
+
+def record_texts(quarantine: pd.DataFrame, key_columns: Dict[str, List[str]]) -> pd.Series:
+    """The identifying text of every row of quarantine, without its occurrence."""
+    records = pd.Series("", index=quarantine.index, dtype=object)
+    for ds_name, rows in quarantine.groupby('dataset', sort=False).groups.items():
+        part = quarantine.loc[rows]
+        text = "dataset=" + part['dataset'].astype(str) + "\x1fsource_file=" + part['source_file'].astype(str)
+        for col in key_columns.get(ds_name, []):
+            if col in part.columns:
+                values = _canonical(part[col])
+                text = text + ("\x1f" + col + "=" + values).fillna("")
+        records.loc[rows] = text
+    return records
+
+def _hash(records: pd.Series) -> np.ndarray:
+    return np.fromiter((int.from_bytes(hashlib.blake2b(r.encode(), digest_size=8).digest(), 'little')
+                        for r in records), dtype=np.uint64, count=len(records))
+
+def key_hex(keys: np.ndarray) -> pd.Series:
+    return pd.Series([f"{k:016x}" for k in keys.tolist()], dtype=object)
+
+class SeenKeys(SortedSegments):
+    """Every key listed in the ledger in directory path, with the run date (days since 1970-01-01) of its partition."""
+    VALUE_EXT = ".dates"
+    VALUE_DTYPE = np.dtype('<i4')
+
+    def __init__(self, path: str):
+        self.path = path
+        meta = self._load_meta()
+        if meta is None or meta.get("version") != SEEN_VERSION:
+            shutil.rmtree(path, ignore_errors=True)
+            meta = {"version": SEEN_VERSION, "segments": [], "keys": 0}
+        os.makedirs(path, exist_ok=True)
+        self.meta = meta
+        self._open()
+
+    def add(self, keys: np.ndarray, run_date: int):
+        self._add(keys, np.full(len(keys), run_date, dtype=self.VALUE_DTYPE))
+
+    def save(self):
+        self._commit(self._save_segments())
+
+def open_seen_keys(ledger_dir: str) -> SeenKeys:
+    """The ledger's SeenKeys, taking over the keys a ledger listed in KEYS_FILE."""
+    seen = SeenKeys(os.path.join(ledger_dir, SEEN_DIR))
+    keys_path, dates_path = os.path.join(ledger_dir, KEYS_FILE), os.path.join(ledger_dir, DATES_FILE)
+    if os.path.exists(keys_path):
+        keys = np.fromfile(keys_path, dtype='<u8').astype(np.uint64)
+        dates = np.fromfile(dates_path, dtype='<i4') if os.path.exists(dates_path) else np.empty(0, dtype='<i4')
+        # Dates were appended before their keys; keys listed before dates were have none
+        dates = dates[:len(keys)]
+        dates = np.concatenate([np.full(len(keys) - len(dates), UNKNOWN_DATE, dtype='<i4'), dates])
+        found, _ = seen.find(keys)
+        if not found.all():
+            seen._add(keys[~found], dates[~found])
+            seen.save()
+        for path in (keys_path, dates_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return seen
+
+def load_ledger_state(ledger_dir: str) -> Dict:
+    """The open records after the last run (keys, sources, datasets, dates) and the files they came from."""
+    state = {"keys": np.empty(0, dtype=np.uint64), "sources": np.empty(0, dtype=object),
+             "datasets": np.empty(0, dtype=object), "dates": np.empty(0, dtype=np.int32), "files": {}}
+    path = os.path.join(ledger_dir, OPEN_KEYS_FILE)
+    if os.path.exists(path):
+        with np.load(path, allow_pickle=True) as stored:
+            for name in ("keys", "sources", "datasets", "dates"):
+                if name in stored.files:
+                    state[name] = stored[name]
+            if "files" in stored.files:
+                files = json.loads(str(stored["files"]))
+                state["files"] = files["files"] if files.get("version") == LEDGER_VERSION else {}
+    # Written before datasets and dates were kept
+    count = len(state["keys"])
+    if len(state["datasets"]) != count:
+        state["datasets"] = np.full(count, None, dtype=object)
+    if len(state["dates"]) != count:
+        state["dates"] = np.full(count, UNKNOWN_DATE, dtype=np.int32)
+    return state
+
+def _save_state(ledger_dir: str, keys: np.ndarray, sources: np.ndarray, datasets: np.ndarray, dates: np.ndarray,
+                files: Dict):
+    path = os.path.join(ledger_dir, OPEN_KEYS_FILE)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, keys=keys.astype(np.uint64), sources=sources.astype(object), datasets=datasets.astype(object),
+             dates=dates.astype(np.int32), files=json.dumps({"version": LEDGER_VERSION, "files": files}))
+    os.replace(tmp, path)
+
+def _write_part(df: pd.DataFrame, directory: str, name: str, output_format: str, types: Optional[Dict[str, str]]):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.{output_format}")
+    tmp = path + ".tmp"
+    if output_format == "parquet":
+        from storage import to_arrow_table
+        import pyarrow.parquet as pq
+        pq.write_table(to_arrow_table(df, types or {}), tmp, compression="zstd")
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+class QuarantineLedger:
+    """
+    The ledger of one run. The run add()s its published quarantine, whole or
+    chunk by chunk as it is written, then close()s the ledger. contexts maps
+    every dataset file in data_dir to what besides its content shapes its
+    quarantine; groups lists files whose quarantines depend on each other's
+    content (datasets deduplicated across files). hashes may pass the files'
+    content hashes when the caller already has them.
+    """
+    def __init__(self, ledger_dir: str, data_dir: str, contexts: Dict[str, str], key_columns: Dict[str, List[str]],
+                 run_id: str, output_format: str = "csv", types: Optional[Dict[str, str]] = None,
+                 groups: Iterable[List[str]] = (), hashes: Optional[Dict[str, Dict]] = None):
+        self.path = ledger_dir
+        os.makedirs(ledger_dir, exist_ok=True)
+        self.key_columns, self.run_id, self.output_format, self.types = key_columns, run_id, output_format, types
+        self.now = datetime.now(timezone.utc)
+        self.run_date = self.now.strftime('%Y-%m-%d')
+        self.today = (self.now.date() - EPOCH).days
+        self.state = load_ledger_state(ledger_dir)
+        known = self.state["files"]
+
+        hashes = hashes or {}
+        self.files = {f: dict(hashes[f]) for f in contexts if f in hashes}
+        self.files.update(file_hashes(data_dir, [f for f in contexts if f not in self.files], known))
+        linked = {}
+        for group in groups:
+            contents = "\0".join(f"{f}\0{self.files[f]['sha256']}" for f in sorted(group))
+            linked.update((f, contents) for f in group)
+        for f, context in contexts.items():
+            text = f"{LEDGER_VERSION}\0{context}\0{f}\0{self.files[f]['sha256']}\0{linked.get(f, '')}"
+            self.files[f]["fingerprint"] = hashlib.sha256(text.encode()).hexdigest()[:32]
+        # Files whose open keys are carried forward rather than hashed again
+        self.unchanged = {f for f, entry in self.files.items()
+                          if known.get(f, {}).get("fingerprint") == entry["fingerprint"]}
+
+        self.seen = open_seen_keys(ledger_dir)
+        self._keys, self._sources, self._datasets, self._dates = [], [], [], []
+        self._last_file, self._counts = None, {}
+        self._parts = 0
+        self.new = 0
+
+    def add(self, quarantine: pd.DataFrame):
+        """
+        Hashes the rows of changed files in quarantine (which needs
+        SOURCE_COLUMNS) and appends the new ones. A file's rows may span
+        consecutive calls.
+        """
+        if quarantine.empty:
+            return
+        rows = quarantine[~quarantine['source_file'].isin(self.unchanged)].reset_index(drop=True)
+        if rows.empty:
+            return
+        texts = record_texts(rows, self.key_columns)
+        occurrence = texts.groupby(texts, sort=False).cumcount()
+        # Identical rows of a file split across calls keep counting up
+        sources = rows['source_file'].astype(object).to_numpy()
+        carried = sources == self._last_file
+        if carried.any():
+            occurrence[carried] += texts[carried].map(self._counts).fillna(0).astype('int64')
+        last = sources[-1]
+        counts = texts[sources == last].value_counts().to_dict()
+        if last == self._last_file:
+            for text, count in self._counts.items():
+                counts[text] = counts.get(text, 0) + count
+        self._last_file, self._counts = last, counts
+        keys = _hash(texts + "\x1e" + occurrence.astype(str))
+
+        # Keys the ledger has (this run's included) keep their run date; the others are new
+        seen, seen_dates = self.seen.find(keys)
+        dates = np.where(seen, seen_dates, self.today).astype(np.int32)
+        new = ~seen
+        new[new] = ~pd.Series(keys[new]).duplicated().to_numpy()
+        if new.any():
+            self._append(rows[new], keys[new])
+        self._keys.append(keys)
+        self._sources.append(sources)
+        self._datasets.append(rows['dataset'].astype(object).to_numpy())
+        self._dates.append(dates)
+
+    def _append(self, rows: pd.DataFrame, keys: np.ndarray):
+        """Writes new records as one part per dataset under today's partition, then lists their keys."""
+        rows = rows.copy()
+        rows.insert(0, 'quarantined_at', self.now.isoformat())
+        rows.insert(0, 'run_id', self.run_id)
+        rows.insert(0, 'record_key', key_hex(keys).to_numpy())
+        for ds_name, part in rows.groupby('dataset', sort=False):
+            _write_part(part, os.path.join(self.path, f"run_date={self.run_date}", f"dataset={ds_name}"),
+                        f"part-{self.run_id}-{self._parts:05d}", self.output_format, self.types)
+        self._parts += 1
+        # Listed once their rows are on disk; close() saves the list
+        self.seen.add(keys, self.today)
+        self.new += len(keys)
+
+    def close(self, processed: Optional[Iterable[str]] = None) -> Dict:
+        """
+        Records the open keys and logs the records that left the quarantine.
+        processed names the files the published quarantine covers (by default
+        every file in contexts); open records of other files are resolved.
+        Returns counts of new, resolved and open records.
+        """
+        processed = set(self.files) if processed is None else set(processed) & set(self.files)
+        state = self.state
+        kept = np.isin(state["sources"], list(processed & self.unchanged))
+        keys = np.concatenate([state["keys"][kept]] + self._keys)
+        resolved = ~np.isin(state["keys"], keys)
+        self.seen.save()
+        if resolved.any():
+            _write_part(pd.DataFrame({'record_key': key_hex(state["keys"][resolved]),
+                                      'source_file': state["sources"][resolved],
+                                      'run_id': self.run_id, 'resolved_at': self.now.isoformat()}),
+                        os.path.join(self.path, RESOLUTIONS_DIR, f"run_date={self.run_date}"),
+                        f"part-{self.run_id}", "csv", None)
+        _save_state(self.path, keys,
+                    np.concatenate([state["sources"][kept]] + self._sources),
+                    np.concatenate([state["datasets"][kept]] + self._datasets),
+                    np.concatenate([state["dates"][kept]] + self._dates),
+                    {f: self.files[f] for f in sorted(processed)})
+        return {"new": self.new, "resolved": int(resolved.sum()), "open": len(keys)}
+
+def _partition_dirs(directory: str, key: str) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    prefix = key + "="
+    return sorted(name[len(prefix):] for name in os.listdir(directory) if name.startswith(prefix))
+
+def _read_part(path: str, columns: Optional[List[str]]) -> pd.DataFrame:
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns).to_pandas()
+    return pd.read_csv(path, usecols=columns)
+
+def open_partitions(state: Dict) -> set:
+    """(run date, dataset) partitions holding the open records of state; None where it is not known."""
+    pairs = pd.DataFrame({'date': state["dates"], 'dataset': state["datasets"]}).drop_duplicates()
+    return {(None if d == UNKNOWN_DATE else (EPOCH + timedelta(days=int(d))).isoformat(), n)
+            for d, n in zip(pairs['date'], pairs['dataset'])}
+
+def open_counts(ledger_dir: str) -> Dict[str, int]:
+    """Number of open records per dataset."""
+    datasets = load_ledger_state(ledger_dir)["datasets"]
+    return pd.Series(datasets, dtype=object).dropna().value_counts().sort_index().to_dict()
+
+def scan_ledger(ledger_dir: str, dataset: Optional[str] = None, since: Optional[str] = None,
+                until: Optional[str] = None, unresolved_only: bool = False,
+                columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Ledger records first quarantined between the run dates since and until
+    (inclusive, YYYY-MM-DD), optionally of one dataset and/or still
+    unresolved. Only the matching partitions are read: for unresolved
+    records, only the ones open_keys.npz places open records in.
+    """
+    open_hex, partitions = None, None
+    if unresolved_only:
+        state = load_ledger_state(ledger_dir)
+        open_hex = set(key_hex(state["keys"]))
+        partitions = open_partitions(state)
+    if columns is not None and 'record_key' not in columns:
+        columns = ['record_key'] + list(columns)
+    frames = []
+    for run_date in _partition_dirs(ledger_dir, "run_date"):
+        if (since and run_date < since) or (until and run_date > until):
+            continue
+        date_dir = os.path.join(ledger_dir, f"run_date={run_date}")
+        for ds_name in _partition_dirs(date_dir, "dataset"):
+            if dataset and ds_name != dataset:
+                continue
+            if partitions is not None and not any(d in (run_date, None) and n in (ds_name, None)
+                                                  for d, n in partitions):
+                continue
+            ds_dir = os.path.join(date_dir, f"dataset={ds_name}")
+            for name in sorted(os.listdir(ds_dir)):
+                if os.path.splitext(name)[1] not in LEDGER_EXTENSIONS:
+                    continue
+                part = _read_part(os.path.join(ds_dir, name), columns)
+                if open_hex is not None:
+                    part = part[part['record_key'].isin(open_hex)]
+                if not part.empty:
+                    frames.append(part)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    # A run interrupted between writing its parts and listing their keys can leave repeats
+    return pd.concat(frames, ignore_index=True).drop_duplicates('record_key')
@@ -1,8 +1,33 @@
 import os
-import glob
+import json
+import fnmatch
+import shutil
+import time
+import hashlib
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from pipeline_core import load_config, get_dataset_config, load_csv, validate_data
+from pipeline_core import (load_config, get_dataset_config, load_csv, validate_data, compile_rules,
+                           iter_csv_chunks, find_duplicate_keys, latest_per_key, sum_per_key,
+                           combine_latest, combine_sums, AsOfStockEngine, reason_codes, QUARANTINE_CODE,
+                           QUARANTINE_DETAIL, UNKNOWN_PRODUCT_CODE, ACCEPTED_KEY_CODE, CSV_ENGINES)
 from reconciliation import ReconciliationEngine
+from storage import (OUTPUT_FORMATS, FACT_NAME, FACT_HISTORY_NAME, QUARANTINE_NAME, column_types, write_dataset,
+                     append_parquet, publish_dataset, read_dataset)
+from incremental import (MANIFEST_VERSION, file_hash, load_manifest, save_manifest, diff_manifest, save_file_state,
+                         load_file_state, drop_file_state, save_running_state, load_running_state,
+                         reset_state)
+from metrics import RunMetrics, StageClock, append_metrics, peak_rss_mb
+from sql_backend import SqlBackend, FETCH_ROWS
+from watcher import FileBatcher, scan_raw_dir
+from rollups import ROLLUP_FILE, FACT_COLUMNS, build_rollup, write_rollup
+from ledger import LEDGER_NAME, SOURCE_COLUMNS, QuarantineLedger
+from key_index import KeyIndex, KEY_DTYPE, key_hashes, file_fingerprints, duplicate_reasons
+from master_snapshot import load_master_snapshot
+from dag import StageGraph
+from checkpoints import SilverCheckpoints
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # pipeline/
@@ -10,124 +35,1487 @@ CONFIG_PATH = os.path.join(BASE_DIR, "config", "schema_config.yaml")
 RAW_DIR = os.path.join(BASE_DIR, "data", "raw")
 PROCESSED_DIR = os.path.join(BASE_DIR, "data", "processed")
 QUARANTINE_DIR = os.path.join(BASE_DIR, "data", "quarantine")
+STATE_DIR = os.path.join(BASE_DIR, "data", "state")
+MASTER_SNAPSHOT_DIR = os.path.join(BASE_DIR, "data", "master") # compiled master data (see master_snapshot)
+MATCH_CACHE_PATH = os.path.join(STATE_DIR, "reconciliation_cache.json")
+MATCH_INDEX_PATH = os.path.join(STATE_DIR, "candidate_index.npz")
+METRICS_PATH = os.path.join(BASE_DIR, "data", "metrics", "run_metrics.jsonl")
+SQL_DB_PATH = os.path.join(STATE_DIR, "pipeline.sqlite") # scratch database of the sql backend
+KEY_INDEX_DIR = os.path.join(STATE_DIR, "key_index") # accepted keys of datasets deduplicated across files
+CHECKPOINT_DIR = os.path.join(BASE_DIR, "data", "checkpoints") # per-file Silver outputs (see checkpoints)
+BACKENDS = ("pandas", "sql")
 
-def run_pipeline():
+# Event datasets and the quantity column each contributes to the fact table
+EVENT_DATASETS = [("restock_events", "restock_qty"), ("damaged_log", "damaged_qty")]
+
+def list_dataset_files(all_files, ds_config):
+    return sorted(f for f in all_files if fnmatch.fnmatch(f, ds_config['file_pattern']))
+
+def quarantine_columns(config, datasets=None):
+    """
+    Column layout of the quarantine output: every dataset's columns (or
+    those of datasets) in processing order, with the reason right after the
+    snapshot columns and the source of each row last.
+    """
+    columns = []
+    for name in ["inventory_snapshot"] + [ds for ds, _ in EVENT_DATASETS]:
+        if datasets is not None and name not in datasets:
+            continue
+        for col in get_dataset_config(config, name).get('required_columns', []):
+            if col['name'] not in columns:
+                columns.append(col['name'])
+        if 'quarantine_reason' not in columns:
+            columns.append('quarantine_reason')
+    return columns + SOURCE_COLUMNS
+
+def key_columns(config):
+    """The columns that identify a record of each dataset, for ledger keys."""
+    return {name: [col['name'] for col in ds_config.get('required_columns', [])]
+            for name, ds_config in config['datasets'].items()}
+
+def tag_source(quarantine, ds_name, source_file):
+    """Adds the dataset and raw file (a name, or one per row) that quarantined rows came from."""
+    return quarantine.assign(dataset=ds_name, source_file=source_file)
+
+def accepted_duplicates(rows, owners):
+    """Valid rows whose keys another file owns, with the reason code and owner they are quarantined with."""
+    return rows.drop(columns='quarantine_reason', errors='ignore').assign(
+        **{QUARANTINE_CODE: ACCEPTED_KEY_CODE, QUARANTINE_DETAIL: duplicate_reasons(owners)})
+
+def dataset_reasons(config):
+    """Each dataset's reason dictionary, which names quarantine codes (see pipeline_core's Quarantine Reasons)."""
+    return {name: reason_codes(ds_config) for name, ds_config in config['datasets'].items()}
+
+def decode_reasons(quarantine, config):
+    """Replaces tagged quarantine rows' reason codes and details with their quarantine_reason text."""
+    if QUARANTINE_CODE not in quarantine.columns:
+        return quarantine
+    reasons = dataset_reasons(config)
+    codes = quarantine[QUARANTINE_CODE].to_numpy()
+    details = quarantine[QUARANTINE_DETAIL].to_numpy() if QUARANTINE_DETAIL in quarantine.columns else None
+    text = np.full(len(quarantine), None, dtype=object)
+    for ds_name, rows in quarantine.groupby('dataset', sort=False).indices.items():
+        text[rows] = reasons[ds_name].decode(codes[rows], None if details is None else details[rows])
+    position = quarantine.columns.get_loc(QUARANTINE_CODE)
+    quarantine = quarantine.drop(columns=[QUARANTINE_CODE, QUARANTINE_DETAIL], errors='ignore')
+    quarantine.insert(position, 'quarantine_reason', text)
+    return quarantine
+
+def quarantine_output(quarantine, config):
+    """
+    Quarantine rows as every run writes them: reasons decoded, and integer
+    columns as nullable Int64. Concatenating files' frames turns an integer
+    column float wherever another dataset lacks it, and a spooled chunk keeps
+    whatever dtype it had, so without the cast runs format 136 and 136.0.
+    """
+    quarantine = decode_reasons(quarantine, config)
+    integers = [col for col, type_name in column_types(config).items()
+                if type_name == 'integer' and col in quarantine.columns]
+    return quarantine.assign(**{col: pd.to_numeric(quarantine[col], errors='coerce').astype('Int64')
+                                for col in integers})
+
+def load_master_data():
+    """
+    Loads the product master and, when present, the store master, from their
+    snapshot (rebuilt first if products.csv or stores.csv changed). Returns
+    the snapshot (for reconciliation and rollups) and the key sets that fk
+    checks in schema_config.yaml refer to as "table.column".
+    """
+    master = load_master_snapshot(RAW_DIR, MASTER_SNAPSHOT_DIR)
+    if master.rebuilt:
+        print(f"Master data snapshot rebuilt: {master.path}")
+    return master, master.key_sets()
+
+def compile_plans(config, master_data):
+    """Compiles every dataset's rules once per run (or per pool worker)."""
+    return {name: compile_rules(ds_config, master_data["products.product_id"], master_data)
+            for name, ds_config in config['datasets'].items()}
+
+def read_and_validate(filename, ds_name, ds_config, plan, clock, csv_engine="pandas", raw_dir=None):
+    """
+    load_csv + validate_data for one raw file (in raw_dir, by default
+    RAW_DIR), timed into clock. Quarantined rows are tagged with their source.
+    """
+    with clock.stage("read") as counts:
+        df = load_csv(raw_dir or RAW_DIR, filename, ds_config, csv_engine)
+        counts["rows_out"] = len(df)
+    with clock.stage("validate", rows_in=len(df)) as counts:
+        valid, quarantine = validate_data(df, plan)
+        counts["rows_out"] = len(valid)
+    return len(df), valid, tag_source(quarantine, ds_name, filename)
+
+def reconcile_timed(reconciler, quarantine, clock):
+    with clock.stage("reconcile", rows_in=len(quarantine)) as counts:
+        recovered = reconciler.reconcile(quarantine)
+        counts["rows_out"] = len(recovered)
+    # Recovered rows join the valid ones, which carry no source columns
+    return recovered.drop(columns=SOURCE_COLUMNS, errors='ignore')
+
+def ingest_silver(filename, ds_name, ds_config, plan, reconciler, clock, csv_engine="pandas", checkpoints=None,
+                  raw_dir=None):
+    """
+    One file's Silver output: read_and_validate, then reconciliation of the
+    quarantine if a reconciler is given (snapshots). Returns the rows read,
+    the valid rows with the recovered ones, the quarantine and the recovered
+    count, from the file's checkpoint if it has one.
+    """
+    if checkpoints is not None and filename in checkpoints:
+        with clock.stage("load_checkpoint") as counts:
+            silver = checkpoints.load(filename)
+            counts["rows_out"] = len(silver[1])
+        return silver
+    rows, valid, quarantine = read_and_validate(filename, ds_name, ds_config, plan, clock, csv_engine, raw_dir)
+    recovered_count = 0
+    if reconciler is not None:
+        recovered = reconcile_timed(reconciler, quarantine, clock)
+        recovered_count = len(recovered)
+        if not recovered.empty:
+            valid = pd.concat([valid, recovered], ignore_index=True)
+    silver = (rows, valid, quarantine, recovered_count)
+    if checkpoints is not None:
+        with clock.stage("save_checkpoint", rows_in=len(valid)):
+            checkpoints.save(filename, silver)
+    return silver
+
+def timed_chunks(chunks, clock):
+    """Yields from a chunk iterator, timing each read into clock."""
+    chunks = iter(chunks)
+    while True:
+        wall, cpu = time.perf_counter(), time.process_time()
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        clock.add("read", {"wall_seconds": time.perf_counter() - wall, "cpu_seconds": time.process_time() - cpu,
+                           "calls": 1, "rows_out": len(chunk), "peak_rss_mb": peak_rss_mb()})
+        yield chunk
+
+def record_outcome(metrics, ds_name, quarantine, recovered_count=0):
+    """Adds quarantine reasons and reconciliation hits to the run metrics."""
+    unknown = 0
+    if ds_name == "inventory_snapshot" and not quarantine.empty:
+        unknown = int((quarantine[QUARANTINE_CODE] == UNKNOWN_PRODUCT_CODE).sum())
+    if not quarantine.empty:
+        metrics.count_quarantine(ds_name, quarantine[QUARANTINE_CODE].to_numpy())
+    metrics.count_reconciliation(unknown, recovered_count)
+
+def record_file(metrics, filename, ds_name, clock, rows, valid_count, quarantine, recovered_count=0):
+    """Adds one ingested file's timings and counts to the run metrics."""
+    metrics.add_file(filename, ds_name, clock, rows=rows, valid=valid_count,
+                     quarantined=len(quarantine), recovered=recovered_count)
+    record_outcome(metrics, ds_name, quarantine, recovered_count)
+
+def save_fact_table(merged, config, output_format="csv"):
+    output_file = write_dataset(merged, PROCESSED_DIR, FACT_NAME, output_format, column_types(config))
+    print(f"SUCCESS: Curated Inventory Fact Table saved to {output_file}")
+    print(merged[['store_id', 'product_id', 'quantity', 'restock_qty', 'damaged_qty', 'effective_stock']].head())
+
+def save_quarantine(all_quarantine, config, output_format="csv", ledger=None):
+    all_quarantine = quarantine_output(all_quarantine, config)
+    # Source columns last, as in quarantine_columns
+    all_quarantine = all_quarantine[[c for c in all_quarantine.columns if c not in SOURCE_COLUMNS] +
+                                    [c for c in SOURCE_COLUMNS if c in all_quarantine.columns]]
+    q_file = write_dataset(all_quarantine, QUARANTINE_DIR, QUARANTINE_NAME, output_format, column_types(config))
+    print(f"WARNING: {len(all_quarantine)} records sent to Quarantine: {q_file}")
+    if ledger is not None:
+        ledger.add(all_quarantine)
+
+def save_fact_history(history, config, output_format="csv"):
+    output_file = write_dataset(history, PROCESSED_DIR, FACT_HISTORY_NAME, output_format, column_types(config))
+    print(f"SUCCESS: Effective stock history ({history['as_of_date'].nunique()} dates) saved to {output_file}")
+
+def publish_fact(config, inventory_days, totals, output_format="csv", metrics=None, as_of=None, backfill_days=None):
+    """
+    Computes effective stock from the snapshot history and daily event totals
+    and saves the fact table, as of `as_of` if given. With backfill_days, also
+    saves the position as of each of the backfill_days days ending at as_of
+    (or at the latest snapshot), all from one set of indexes.
+    """
+    metrics = metrics or RunMetrics("fact")
+    with metrics.stage("effective_stock", rows_in=len(inventory_days)):
+        engine = AsOfStockEngine(inventory_days, totals.get('restock_qty'), totals.get('damaged_qty'))
+    publish_positions(config, engine, output_format, metrics, as_of, backfill_days)
+
+def publish_positions(config, engine, output_format="csv", metrics=None, as_of=None, backfill_days=None):
+    """
+    Saves the fact table (and the backfill history) from an as-of engine:
+    an AsOfStockEngine, or the SqlBackend after build_positions.
+    """
+    metrics = metrics or RunMetrics("fact")
+    with metrics.stage("effective_stock") as counts:
+        merged = engine.effective_stock(as_of)
+        counts["rows_out"] = len(merged)
+    with metrics.stage("write_fact", rows_in=len(merged)):
+        save_fact_table(merged, config, output_format)
+
+    if backfill_days:
+        end = pd.Timestamp(as_of) if as_of is not None else engine.latest_date()
+        dates = pd.date_range(end=end, periods=backfill_days, freq='D')
+        with metrics.stage("backfill", rows_in=len(dates)) as counts:
+            history = engine.history(dates)
+            counts["rows_out"] = len(history)
+        with metrics.stage("write_fact_history", rows_in=len(history)):
+            save_fact_history(history, config, output_format)
+
+def publish_rollup(master, quarantine, run_id=None):
+    """Rebuilds the dashboard rollup from the published fact table and quarantine."""
+    fact = read_dataset(PROCESSED_DIR, FACT_NAME, columns=FACT_COLUMNS)
+    rollup_path = os.path.join(PROCESSED_DIR, ROLLUP_FILE)
+    products = master.frame("products", ['product_id', 'category'])
+    write_rollup(rollup_path, build_rollup(fact, quarantine, products, run_id))
+    print(f"Dashboard rollup saved to {rollup_path}")
+    return len(fact) + len(quarantine)
+
+def open_ledger(config, run_id, output_format="csv", hashes=None):
+    """
+    The quarantine ledger, fed by save_quarantine or the quarantine spool as
+    a run publishes its quarantine. Files are fingerprinted with the contexts
+    of open_checkpoints; the files of a dataset deduplicated across files
+    depend on each other. hashes reuses the checkpoints' content hashes.
+    """
+    all_files = os.listdir(RAW_DIR)
+    groups = [list_dataset_files(all_files, get_dataset_config(config, ds_name)) for ds_name in dedupe_datasets(config)]
+    return QuarantineLedger(os.path.join(QUARANTINE_DIR, LEDGER_NAME), RAW_DIR, dataset_contexts(config, all_files),
+                            key_columns(config), run_id, output_format, column_types(config), groups, hashes)
+
+def close_ledger(ledger, processed=None):
+    """Records the run's open quarantine records; see QuarantineLedger.close."""
+    counts = ledger.close(processed)
+    print(f"Quarantine ledger: {counts['new']} new, {counts['resolved']} resolved, {counts['open']} open records")
+    return counts
+
+# --- Cross-File Duplicates ---
+# validate_data only sees duplicates inside one file. Datasets flagged with
+# dedupe_across_files keep an index of the keys already accepted from other
+# files (see key_index); a valid row whose key another file supplied first is
+# quarantined instead of being counted again. Files are claimed in sorted
+# order in every mode, in the parent process, so all modes agree.
+def dedupe_datasets(config):
+    return [name for name, ds_config in config['datasets'].items() if ds_config.get('dedupe_across_files')]
+
+def open_key_indexes(config, all_files):
+    """
+    The key index of every dedupe dataset, synced with its raw files. Also
+    returns the files that must be validated again because a file whose keys
+    they lost to changed or disappeared.
+    """
+    indexes, stale = {}, set()
+    context = run_context(config)
+    for ds_name in dedupe_datasets(config):
+        index = KeyIndex(os.path.join(KEY_INDEX_DIR, ds_name), context)
+        files = list_dataset_files(all_files, get_dataset_config(config, ds_name))
+        stale |= index.sync(file_fingerprints(RAW_DIR, files))
+        indexes[ds_name] = index
+    return indexes, stale
+
+def save_key_indexes(indexes):
+    for index in indexes.values():
+        index.save()
+
+def dataset_contexts(config, all_files):
+    """
+    The context of each dataset file in all_files: its dataset's rules and
+    the master data, so editing one dataset's rules (or anything outside the
+    rules) leaves the other files' stored results valid.
+    """
+    contexts = {}
+    for ds_name, ds_config in config['datasets'].items():
+        context = run_context({'datasets': {ds_name: ds_config}})
+        contexts.update((f, context) for f in list_dataset_files(all_files, ds_config))
+    return contexts
+
+def open_checkpoints(config, all_files):
+    """Silver checkpoints of the dataset files in all_files, each under its dataset_contexts context."""
+    return SilverCheckpoints(CHECKPOINT_DIR, RAW_DIR, dataset_contexts(config, all_files))
+
+def dedupe_accepted(index, valid, quarantine, ds_name, filename, clock):
+    """Claims valid's keys for filename; rows whose key is already accepted move to quarantine, in file order."""
+    if index is None:
+        return valid, quarantine
+    with clock.stage("dedupe", rows_in=len(valid)) as counts:
+        duplicate, owners = index.claim(valid, filename)
+        if duplicate.any():
+            duplicates = accepted_duplicates(valid[duplicate], owners)
+            quarantine = pd.concat([quarantine, tag_source(duplicates, ds_name, filename)]).sort_index(kind='stable')
+            valid = valid[~duplicate]
+        counts["rows_out"] = len(valid)
+    return valid, quarantine
+
+def run_pipeline(chunk_size=None, workers=1, incremental=False, full_rebuild=False, output_format="csv",
+                 match_cache=True, as_of=None, backfill_days=None, backend="pandas", admit=None, csv_engine="pandas",
+                 shards=None, dag=False, checkpoint=True):
     print("--- Starting Pipeline (Functional Core) ---")
-    
+
     # 1. Setup
     config = load_config(CONFIG_PATH)
-    
+
+    if chunk_size and (workers > 1 or incremental):
+        raise ValueError("chunk_size cannot be combined with workers > 1 or incremental runs")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'; expected one of {BACKENDS}")
+    if backend == "sql" and (chunk_size or workers > 1 or incremental):
+        raise ValueError("The sql backend cannot be combined with chunk_size, workers > 1 or incremental runs")
+    if shards is not None and (shards < 1 or chunk_size or incremental or backend == "sql"):
+        raise ValueError("shards must be >= 1 and cannot be combined with chunk_size, incremental or sql runs")
+    if dag and (chunk_size or incremental or backend == "sql" or shards):
+        raise ValueError("dag runs cannot be combined with chunk_size, incremental, sql or sharded runs")
+    if admit is not None and not incremental:
+        raise ValueError("admit only applies to incremental runs")
+    if csv_engine not in CSV_ENGINES:
+        raise ValueError(f"Unknown CSV engine '{csv_engine}'; expected one of {CSV_ENGINES}")
+    if csv_engine != "pandas" and (chunk_size or backend == "sql"):
+        raise ValueError("csv_engine applies to whole-file reads; chunked and sql runs use their own readers")
+    mode = ("sql" if backend == "sql" else "incremental" if incremental else "streaming" if chunk_size
+            else "sharded" if shards else "dag" if dag else "parallel" if workers > 1 else "serial")
+    metrics = RunMetrics(mode, {"chunk_size": chunk_size, "workers": workers, "full_rebuild": full_rebuild,
+                                "output_format": output_format, "match_cache": match_cache,
+                                "as_of": as_of, "backfill_days": backfill_days, "backend": backend,
+                                "csv_engine": csv_engine, "shards": shards, "dag": dag, "checkpoint": checkpoint})
+
     # Load Master Data
     print("Loading Master Data...")
-    products_df = load_csv(RAW_DIR, "products.csv")
-    master_product_ids = set(products_df['product_id'])
-    
-    reconciler = ReconciliationEngine(products_df)
-    
+    with metrics.stage("load_master") as counts:
+        master, master_data = load_master_data()
+        plans = compile_plans(config, master_data)
+        cache_path = MATCH_CACHE_PATH if match_cache else None
+        reconciler = ReconciliationEngine(master, cache_path, MATCH_INDEX_PATH)
+        counts["rows_out"] = master.rows("products")
+    metrics.extra["master_snapshot"] = "rebuilt" if master.rebuilt else "loaded"
+
+    # Streaming and sql runs never hold a file's Silver output whole
+    checkpoints = None
+    with metrics.stage("hash_inputs"):
+        if checkpoint and not chunk_size and backend != "sql":
+            checkpoints = open_checkpoints(config, os.listdir(RAW_DIR))
+        ledger = open_ledger(config, metrics.run_id, output_format, checkpoints and checkpoints.hashes)
+
+    if backend == "sql":
+        run_sql(config, master_data, reconciler, output_format, metrics, as_of, backfill_days, ledger)
+    elif incremental:
+        run_incremental(config, master, master_data, workers, full_rebuild, output_format, reconciler, metrics,
+                        as_of, backfill_days, admit, csv_engine, checkpoints, ledger)
+    elif chunk_size:
+        run_streaming(config, plans, reconciler, chunk_size, output_format, metrics, as_of, backfill_days, ledger)
+    elif shards:
+        run_sharded(config, master, master_data, workers, shards, output_format, reconciler, metrics,
+                    as_of, backfill_days, csv_engine, checkpoints, ledger)
+    elif dag:
+        run_dag(config, plans, reconciler, workers, output_format, metrics, as_of, backfill_days, csv_engine,
+                checkpoints, ledger)
+    elif workers > 1:
+        run_parallel(config, master, master_data, workers, output_format, reconciler, metrics,
+                     as_of, backfill_days, csv_engine, checkpoints, ledger)
+    else:
+        run_serial(config, plans, reconciler, output_format, metrics, as_of, backfill_days, csv_engine, checkpoints,
+                   ledger)
+
+    quarantine = read_dataset(QUARANTINE_DIR, QUARANTINE_NAME, columns=['quarantine_reason'])
+    with metrics.stage("rollup") as counts:
+        counts["rows_in"] = publish_rollup(master, quarantine, metrics.run_id)
+    with metrics.stage("ledger") as counts:
+        # The files the published quarantine covers: an incremental run's comes from its whole manifest
+        processed = list(load_manifest(STATE_DIR)["files"]) if incremental else None
+        counts["rows_in"] = ledger.new
+        metrics.extra["ledger"] = close_ledger(ledger, processed)
+        counts["rows_out"] = metrics.extra["ledger"]["new"]
+
+    if reconciler.cache is not None:
+        reconciler.cache.save()
+        print(f"Reconciliation cache: {reconciler.cache.stats()}")
+    if checkpoints is not None:
+        checkpoints.commit()
+        reused = sum("load_checkpoint" in entry["stages"] for entry in metrics.files)
+        metrics.extra["checkpoints"] = {"files": len(metrics.files), "reused": reused}
+        print(f"Silver checkpoints: {reused} of {len(metrics.files)} files reused")
+
+    report = metrics.report(reconciler.cache, dataset_reasons(config))
+    append_metrics(METRICS_PATH, report)
+    print(f"Run metrics: {report['wall_seconds']:.2f}s wall, {report['cpu_seconds']:.2f}s CPU, "
+          f"peak RSS {report['peak_rss_mb']} MB -> {METRICS_PATH}")
+
+def run_serial(config, plans, reconciler, output_format="csv", metrics=None, as_of=None, backfill_days=None,
+               csv_engine="pandas", checkpoints=None, ledger=None):
+    metrics = metrics or RunMetrics("serial")
     # 2. Process Inventory Snapshots
     print("Processing Inventory Snapshots...")
     inv_config = get_dataset_config(config, "inventory_snapshot")
-    
-    import fnmatch
+
     all_files = os.listdir(RAW_DIR)
-    inv_files = [f for f in all_files if fnmatch.fnmatch(f, inv_config['file_pattern'])]
-    
+    inv_files = list_dataset_files(all_files, inv_config)
+    key_indexes, _ = open_key_indexes(config, all_files)
+
     final_valid_frames = []
     final_quarantine_frames = []
 
     for f in inv_files:
         print(f"  Ingesting {f}...")
-        df = load_csv(RAW_DIR, f)
-        
-        # Validate
-        valid, quarantine = validate_data(df, inv_config, master_product_ids)
-        print(f"    Initial: Valid={len(valid)}, Quarantine={len(quarantine)}")
-        
-        # Reconcile Quarantine
-        recovered = reconciler.reconcile(quarantine)
-        if not recovered.empty:
-            print(f"    Reconciled {len(recovered)} records via Fuzzy Match!")
-            valid = pd.concat([valid, recovered], ignore_index=True)
-        
+        clock = StageClock()
+
+        # Load + Validate + Reconcile Quarantine
+        rows, valid, quarantine, recovered_count = ingest_silver(f, "inventory_snapshot", inv_config,
+                                                                 plans["inventory_snapshot"], reconciler, clock,
+                                                                 csv_engine, checkpoints)
+        print(f"    Initial: Valid={len(valid) - recovered_count}, Quarantine={len(quarantine)}")
+        record_file(metrics, f, "inventory_snapshot", clock, rows, len(valid) - recovered_count, quarantine,
+                    recovered_count)
+        if recovered_count:
+            print(f"    Reconciled {recovered_count} records via Fuzzy Match!")
+
         final_valid_frames.append(valid)
         final_quarantine_frames.append(quarantine)
 
     # 3. Aggregation / Fact Table
     if final_valid_frames:
         full_inventory = pd.concat(final_valid_frames, ignore_index=True)
-        
+
         # Load Restocks
         print("Processing Restocks...")
         restock_config = get_dataset_config(config, "restock_events")
-        res_files = [f for f in all_files if fnmatch.fnmatch(f, restock_config['file_pattern'])]
-        
+        res_files = list_dataset_files(all_files, restock_config)
+
         restock_frames = []
         for f in res_files:
-            rdf = load_csv(RAW_DIR, f)
-            # Validate Restocks
-            r_valid, r_quarantine = validate_data(rdf, restock_config, master_product_ids)
+            clock = StageClock()
+            # Load + Validate Restocks
+            rows, r_valid, r_quarantine, _ = ingest_silver(f, "restock_events", restock_config,
+                                                           plans["restock_events"], None, clock, csv_engine,
+                                                           checkpoints)
+            r_valid, r_quarantine = dedupe_accepted(key_indexes.get("restock_events"), r_valid, r_quarantine,
+                                                    "restock_events", f, clock)
+            record_file(metrics, f, "restock_events", clock, rows, len(r_valid), r_quarantine)
             restock_frames.append(r_valid)
             if not r_quarantine.empty:
                 final_quarantine_frames.append(r_quarantine)
-        
+
+        full_restock = pd.DataFrame()
         if restock_frames:
             full_restock = pd.concat(restock_frames, ignore_index=True)
 
         # Load Damaged Logs
         print("Processing Damaged Logs...")
         damaged_config = get_dataset_config(config, "damaged_log")
-        dam_files = [f for f in all_files if fnmatch.fnmatch(f, damaged_config['file_pattern'])]
-        
+        dam_files = list_dataset_files(all_files, damaged_config)
+
         damaged_frames = []
         for f in dam_files:
-            ddf = load_csv(RAW_DIR, f)
-            d_valid, d_quarantine = validate_data(ddf, damaged_config, master_product_ids)
+            clock = StageClock()
+            rows, d_valid, d_quarantine, _ = ingest_silver(f, "damaged_log", damaged_config, plans["damaged_log"],
+                                                           None, clock, csv_engine, checkpoints)
+            d_valid, d_quarantine = dedupe_accepted(key_indexes.get("damaged_log"), d_valid, d_quarantine,
+                                                    "damaged_log", f, clock)
+            record_file(metrics, f, "damaged_log", clock, rows, len(d_valid), d_quarantine)
             damaged_frames.append(d_valid)
             if not d_quarantine.empty:
                 final_quarantine_frames.append(d_quarantine)
-        
+
         full_damaged = pd.DataFrame()
         if damaged_frames:
             full_damaged = pd.concat(damaged_frames, ignore_index=True)
-        
+
+        # 4. Compute Effective Stock
+        print("Computing Effective Stock Positions...")
+
+        with metrics.stage("aggregate", rows_in=len(full_inventory) + len(full_restock) + len(full_damaged)) as counts:
+            # Sum restocks per day
+            stock_additions = None
+            if not full_restock.empty:
+                stock_additions = sum_per_key(full_restock, 'restock_qty', per_date=True)
+
+            # Sum damages per day
+            stock_deductions = None
+            if not full_damaged.empty:
+                stock_deductions = sum_per_key(full_damaged, 'damaged_qty', per_date=True)
+
+            inventory_days = latest_per_key(full_inventory, per_date=True)
+            counts["rows_out"] = len(inventory_days)
+
+        # Calc Formula: Snapshot + Restock - Damaged, then Save Gold Record
+        publish_fact(config, inventory_days, {'restock_qty': stock_additions, 'damaged_qty': stock_deductions},
+                     output_format, metrics, as_of, backfill_days)
+
+    # Save Quarantine
+    if final_quarantine_frames:
+        all_quarantine = pd.concat(final_quarantine_frames, ignore_index=True)
+        with metrics.stage("write_quarantine", rows_in=len(all_quarantine)):
+            save_quarantine(all_quarantine, config, output_format, ledger)
+    save_key_indexes(key_indexes)
+
+def run_streaming(config, plans, reconciler, chunk_size, output_format="csv", metrics=None, as_of=None,
+                  backfill_days=None, ledger=None):
+    """
+    Chunked variant of run_pipeline for snapshot files that do not fit in RAM.
+    Each chunk is validated, split and folded into running per-key aggregates;
+    quarantined rows are appended to disk as they are found. Nothing is held
+    per row, so peak memory depends on chunk size and distinct keys only.
+    """
+    metrics = metrics or RunMetrics("streaming")
+    all_files = os.listdir(RAW_DIR)
+    key_indexes, _ = open_key_indexes(config, all_files)
+    columns = quarantine_columns(config)
+    q_tmp = os.path.join(QUARANTINE_DIR, "quarantine_records.stream.tmp")
+    if os.path.exists(q_tmp):
+        os.remove(q_tmp)
+    quarantine_count = 0
+    quarantined = {"inventory_snapshot"}
+
+    def sink(quarantine):
+        nonlocal quarantine_count
+        quarantine_count += spool_quarantine(q_tmp, quarantine_output(quarantine, config), columns, ledger)
+        quarantined.update(quarantine['dataset'].unique())
+
+    # 2. Stream Inventory Snapshots
+    print(f"Streaming Inventory Snapshots (chunk_size={chunk_size})...")
+    inv_config = get_dataset_config(config, "inventory_snapshot")
+    inventory_days = None
+    for f in list_dataset_files(all_files, inv_config):
+        print(f"  Ingesting {f}...")
+        clock = StageClock()
+        file_counts = {"rows": 0, "valid": 0, "quarantined": 0, "recovered": 0}
+        with clock.stage("duplicate_scan"):
+            dup_keys = find_duplicate_keys(RAW_DIR, f, chunk_size, inv_config)
+        file_valid = None
+        file_recovered = None
+        for chunk in timed_chunks(iter_csv_chunks(RAW_DIR, f, chunk_size, inv_config), clock):
+            with clock.stage("validate", rows_in=len(chunk)) as counts:
+                valid, quarantine = validate_data(chunk, plans["inventory_snapshot"], duplicate_keys=dup_keys)
+                quarantine = tag_source(quarantine, "inventory_snapshot", f)
+                counts["rows_out"] = len(valid)
+            recovered = reconcile_timed(reconciler, quarantine, clock)
+            with clock.stage("aggregate", rows_in=len(valid) + len(recovered)):
+                file_valid = combine_latest(file_valid, valid, per_date=True)
+                if not recovered.empty:
+                    file_recovered = combine_latest(file_recovered, recovered, per_date=True)
+            with clock.stage("write_quarantine", rows_in=len(quarantine)):
+                sink(quarantine)
+            record_outcome(metrics, "inventory_snapshot", quarantine, len(recovered))
+            for key, n in (("rows", len(chunk)), ("valid", len(valid)),
+                           ("quarantined", len(quarantine)), ("recovered", len(recovered))):
+                file_counts[key] += n
+        # Recovered rows rank after the file's valid rows, as in the in-memory path
+        with clock.stage("aggregate"):
+            inventory_days = combine_latest(inventory_days, combine_latest(file_valid, file_recovered, per_date=True),
+                                            per_date=True)
+        metrics.add_file(f, "inventory_snapshot", clock, **file_counts)
+
+    # 3. Stream Event Logs
+    totals = {}
+    if inventory_days is not None:
+        for ds_name, qty_col in EVENT_DATASETS:
+            print(f"Streaming {ds_name}...")
+            ds_config = get_dataset_config(config, ds_name)
+            running = None
+            for f in list_dataset_files(all_files, ds_config):
+                clock = StageClock()
+                file_counts = {"rows": 0, "valid": 0, "quarantined": 0}
+                with clock.stage("duplicate_scan"):
+                    dup_keys = find_duplicate_keys(RAW_DIR, f, chunk_size, ds_config)
+                for chunk in timed_chunks(iter_csv_chunks(RAW_DIR, f, chunk_size, ds_config), clock):
+                    with clock.stage("validate", rows_in=len(chunk)) as counts:
+                        valid, quarantine = validate_data(chunk, plans[ds_name], duplicate_keys=dup_keys)
+                        quarantine = tag_source(quarantine, ds_name, f)
+                        counts["rows_out"] = len(valid)
+                    valid, quarantine = dedupe_accepted(key_indexes.get(ds_name), valid, quarantine, ds_name, f, clock)
+                    if not valid.empty:
+                        with clock.stage("aggregate", rows_in=len(valid)):
+                            running = combine_sums(running, sum_per_key(valid, qty_col, per_date=True), qty_col,
+                                                   per_date=True)
+                    with clock.stage("write_quarantine", rows_in=len(quarantine)):
+                        sink(quarantine)
+                    record_outcome(metrics, ds_name, quarantine)
+                    for key, n in (("rows", len(chunk)), ("valid", len(valid)), ("quarantined", len(quarantine))):
+                        file_counts[key] += n
+                metrics.add_file(f, ds_name, clock, **file_counts)
+            totals[qty_col] = running
+
         # 4. Compute Effective Stock
         print("Computing Effective Stock Positions...")
-        
-        # Sum restocks
-        stock_additions = pd.DataFrame()
-        if not full_restock.empty:
-            stock_additions = full_restock.groupby(['store_id', 'product_id'])['restock_qty'].sum().reset_index()
-
-        # Sum damages
-        stock_deductions = pd.DataFrame()
-        if not full_damaged.empty:
-            stock_deductions = full_damaged.groupby(['store_id', 'product_id'])['damaged_qty'].sum().reset_index()
-        
-        latest_inventory = full_inventory.sort_values('date').groupby(['store_id', 'product_id']).tail(1)
-        
-        # Merge Restocks
-        merged = pd.merge(latest_inventory, stock_additions, on=['store_id', 'product_id'], how='left')
-        merged['restock_qty'] = merged['restock_qty'].fillna(0)
-        
-        # Merge Damages
-        merged = pd.merge(merged, stock_deductions, on=['store_id', 'product_id'], how='left')
-        merged['damaged_qty'] = merged['damaged_qty'].fillna(0)
-        
-        # Calc Formula: Snapshot + Restock - Damaged
-        merged['effective_stock'] = merged['quantity'] + merged['restock_qty'] - merged['damaged_qty']
-        
-        # Save Gold Record
-        output_file = os.path.join(PROCESSED_DIR, "inventory_fact.csv")
-        merged.to_csv(output_file, index=False)
-        print(f"SUCCESS: Curated Inventory Fact Table saved to {output_file}")
-        print(merged[['store_id', 'product_id', 'quantity', 'restock_qty', 'damaged_qty', 'effective_stock']].head())
+        publish_fact(config, inventory_days, totals, output_format, metrics, as_of, backfill_days)
 
     # Save Quarantine
+    if os.path.exists(q_tmp):
+        with metrics.stage("publish_quarantine", rows_in=quarantine_count):
+            q_file = publish_quarantine_spool(q_tmp, config, chunk_size, output_format, quarantined)
+        print(f"WARNING: {quarantine_count} records sent to Quarantine: {q_file}")
+    save_key_indexes(key_indexes)
+
+def spool_quarantine(q_tmp, quarantine, columns, ledger=None):
+    """
+    Appends quarantined rows to the spool file in the quarantine's column
+    layout, and passes them on to the ledger. Returns the rows added.
+    """
+    if quarantine.empty:
+        return 0
+    header = not os.path.exists(q_tmp)
+    quarantine.reindex(columns=columns).to_csv(q_tmp, mode='a', header=header, index=False)
+    if ledger is not None:
+        ledger.add(quarantine)
+    return len(quarantine)
+
+def publish_quarantine_spool(q_tmp, config, chunk_size, output_format="csv", datasets=None):
+    """
+    Publishes the streamed quarantine spool file as the quarantine output.
+    The spool has every dataset's columns; as in the in-memory runs, only
+    those of datasets (the ones that quarantined rows) are published.
+    """
+    columns = quarantine_columns(config, datasets)
+    if output_format == "parquet":
+        # Convert the spooled rows chunk by chunk to keep memory bounded
+        staged = os.path.join(QUARANTINE_DIR, QUARANTINE_NAME + ".parquet.tmp")
+        shutil.rmtree(staged, ignore_errors=True)
+        types = column_types(config)
+        for chunk in iter_csv_chunks(QUARANTINE_DIR, os.path.basename(q_tmp), chunk_size):
+            append_parquet(chunk[columns], staged, types)
+        os.remove(q_tmp)
+        q_tmp = staged
+    elif columns != quarantine_columns(config):
+        # Drop the other datasets' columns chunk by chunk, as text so values are written back unchanged
+        staged = q_tmp + ".columns"
+        with pd.read_csv(q_tmp, usecols=columns, dtype=str, keep_default_na=False, chunksize=chunk_size) as reader:
+            for index, chunk in enumerate(reader):
+                chunk[columns].to_csv(staged, mode='w' if index == 0 else 'a', header=index == 0, index=False)
+        os.remove(q_tmp)
+        q_tmp = staged
+    return publish_dataset(q_tmp, QUARANTINE_DIR, QUARANTINE_NAME, output_format)
+
+def run_sql(config, master_data, reconciler, output_format="csv", metrics=None, as_of=None, backfill_days=None,
+            ledger=None):
+    """
+    Out-of-core variant of run_serial on the sql backend: raw files are loaded
+    into a scratch SQLite database, then validated, split and aggregated there
+    (see sql_backend). Only quarantined rows, reconciliation candidates and the
+    fact table come back into pandas, a bounded batch at a time.
+    """
+    metrics = metrics or RunMetrics("sql")
+    all_files = os.listdir(RAW_DIR)
+    key_indexes, _ = open_key_indexes(config, all_files)
+    columns = quarantine_columns(config)
+    q_tmp = os.path.join(QUARANTINE_DIR, "quarantine_records.sql.tmp")
+    if os.path.exists(q_tmp):
+        os.remove(q_tmp)
+    quarantine_count = 0
+    quarantined = {"inventory_snapshot"}
+
+    with SqlBackend(SQL_DB_PATH, master_data) as backend:
+        inv_files = list_dataset_files(all_files, get_dataset_config(config, "inventory_snapshot"))
+        # As in run_serial, event logs only matter once there are snapshots
+        datasets = [("inventory_snapshot", None)] + (EVENT_DATASETS if inv_files else [])
+        for ds_name, _ in datasets:
+            ds_config = get_dataset_config(config, ds_name)
+            files = list_dataset_files(all_files, ds_config)
+            if not files:
+                continue
+            print(f"Loading {ds_name} into the SQL backend ({len(files)} files)...")
+            clocks = []
+            for index, f in enumerate(files):
+                clock = StageClock()
+                with clock.stage("read") as counts:
+                    counts["rows_out"] = backend.load_file(ds_name, ds_config, RAW_DIR, f, index)
+                clocks.append(clock)
+
+            with metrics.stage("validate"):
+                backend.validate(ds_name, ds_config)
+            if ds_name in key_indexes:
+                with metrics.stage("dedupe") as counts:
+                    duplicates = []
+                    for valid in backend.iter_valid_keys(ds_name):
+                        for file_index, rows in valid.groupby('_file', sort=False):
+                            duplicate, owners = key_indexes[ds_name].claim(rows, files[file_index])
+                            duplicates.append(accepted_duplicates(rows.loc[duplicate, ['_file', '_row']], owners))
+                    if duplicates:
+                        backend.quarantine_rows(ds_name, pd.concat(duplicates, ignore_index=True))
+                    counts["rows_out"] = sum(len(d) for d in duplicates)
+            if ds_name == "inventory_snapshot":
+                with metrics.stage("reconcile") as counts:
+                    counts["rows_out"] = 0
+                    for unknown in backend.iter_unknown_products(ds_name):
+                        recovered = reconciler.reconcile(unknown)
+                        backend.add_recovered(ds_name, recovered)
+                        counts["rows_out"] += len(recovered)
+            with metrics.stage("write_quarantine") as counts:
+                for quarantine in backend.iter_quarantine(ds_name):
+                    quarantine = tag_source(quarantine.drop(columns='_file'), ds_name,
+                                            quarantine['_file'].map(dict(enumerate(files))))
+                    metrics.count_quarantine(ds_name, quarantine[QUARANTINE_CODE].to_numpy())
+                    quarantine_count += spool_quarantine(q_tmp, quarantine_output(quarantine, config), columns, ledger)
+                    quarantined.add(ds_name)
+
+            file_counts = backend.file_counts(ds_name)
+            for index, (f, clock) in enumerate(zip(files, clocks)):
+                counts = file_counts.get(index, {"rows": 0, "valid": 0, "quarantined": 0, "unknown": 0,
+                                                 "recovered": 0})
+                if ds_name == "inventory_snapshot":
+                    print(f"  {f}: Valid={counts['valid']}, Quarantine={counts['quarantined']}, "
+                          f"Reconciled={counts['recovered']}")
+                    metrics.count_reconciliation(counts["unknown"], counts["recovered"])
+                    metrics.add_file(f, ds_name, clock, rows=counts["rows"], valid=counts["valid"],
+                                     quarantined=counts["quarantined"], recovered=counts["recovered"])
+                else:
+                    metrics.add_file(f, ds_name, clock, rows=counts["rows"], valid=counts["valid"],
+                                     quarantined=counts["quarantined"])
+
+        if inv_files:
+            print("Computing Effective Stock Positions...")
+            with metrics.stage("aggregate") as counts:
+                counts["rows_out"] = backend.build_positions("inventory_snapshot", EVENT_DATASETS)
+            publish_positions(config, backend, output_format, metrics, as_of, backfill_days)
+
+    # Save Quarantine
+    if os.path.exists(q_tmp):
+        with metrics.stage("publish_quarantine", rows_in=quarantine_count):
+            q_file = publish_quarantine_spool(q_tmp, config, FETCH_ROWS, output_format, quarantined)
+        print(f"WARNING: {quarantine_count} records sent to Quarantine: {q_file}")
+    save_key_indexes(key_indexes)
+
+# --- Parallel Ingestion ---
+# Per-process state, built once by the pool initializer instead of being
+# pickled with every task.
+_worker = {}
+
+def _init_worker(config, master, master_data, cache_path=None, pooled=False, csv_engine="pandas", checkpoints=None,
+                 raw_dir=None, match_index_path=None):
+    # Spawned workers re-import this module, so the pool passes the parent's paths in
+    _worker['raw_dir'] = raw_dir or RAW_DIR
+    _worker['match_index_path'] = match_index_path or MATCH_INDEX_PATH
+    _worker['pooled'] = pooled
+    _worker['csv_engine'] = csv_engine
+    _worker['checkpoints'] = checkpoints
+    _worker['config'] = config
+    _worker['dedupe'] = set(dedupe_datasets(config))
+    _worker['plans'] = compile_plans(config, master_data)
+    _worker['reconciler'] = ReconciliationEngine(master, cache_path, _worker['match_index_path'])
+
+def ingest_file(task):
+    """
+    Pool task: load + validate one raw file (and reconcile, for snapshots).
+    Returns only compact results: the file's latest rows per key and day for
+    snapshots, per-key daily totals for event logs, plus its quarantined rows
+    and stage timings. Datasets deduplicated across files return their valid
+    rows instead of totals; run_tasks dedupes and sums them.
+    """
+    ds_name, qty_col, filename = task
+    clock = StageClock()
+    rows, valid, quarantine, recovered_count = ingest_silver(
+        filename, ds_name, get_dataset_config(_worker['config'], ds_name), _worker['plans'][ds_name],
+        _worker['reconciler'] if qty_col is None else None, clock, _worker['csv_engine'], _worker['checkpoints'],
+        _worker['raw_dir'])
+    if qty_col is None:
+        with clock.stage("aggregate", rows_in=len(valid)) as counts:
+            partial = latest_per_key(valid, per_date=True)
+            counts["rows_out"] = len(partial)
+    elif ds_name in _worker['dedupe']:
+        partial = None
+    else:
+        with clock.stage("aggregate", rows_in=len(valid)) as counts:
+            partial = sum_per_key(valid, qty_col, per_date=True)
+            counts["rows_out"] = len(partial)
+    cache = _worker['reconciler'].cache
+    return {"file": filename, "rows": rows, "valid": len(valid) - recovered_count, "recovered": recovered_count,
+            "partial": partial, "accepted": valid if partial is None else None, "quarantine": quarantine,
+            "clock": clock,
+            "cache": cache.drain() if cache is not None and _worker['pooled'] else None}
+
+def run_tasks(tasks, config, master, master_data, workers, reconciler=None, metrics=None, csv_engine="pandas",
+              key_indexes=None, ingest=None, checkpoints=None):
+    """
+    Runs ingest_file (or ingest, a wrapper of it) over tasks, in a pool when workers > 1. Workers start
+    from the stored match cache; their new entries and hit/miss counts are
+    folded back into reconciler's cache. Files of datasets in key_indexes
+    are deduped against it here, in task order. Per-file timings go to metrics.
+    """
+    cache = reconciler.cache if reconciler is not None else None
+    if workers > 1:
+        with metrics.stage("pool_ingest", rows_in=len(tasks)) if metrics else contextlib.nullcontext():
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(config, master, master_data, cache.path if cache else None,
+                                               True, csv_engine, checkpoints, RAW_DIR, MATCH_INDEX_PATH)) as pool:
+                results = list(pool.map(ingest or ingest_file, tasks))
+    else:
+        _init_worker(config, master, master_data, csv_engine=csv_engine, checkpoints=checkpoints)
+        if reconciler is not None:
+            _worker['reconciler'] = reconciler
+        results = [(ingest or ingest_file)(task) for task in tasks]
+    if cache is not None and workers > 1:
+        for result in results:
+            cache.absorb(*result['cache'])
+    for (ds_name, qty_col, f, *_), result in zip(tasks, results):
+        valid = result.pop('accepted')
+        if valid is None:
+            continue
+        clock = result['clock']
+        valid, result['quarantine'] = dedupe_accepted((key_indexes or {}).get(ds_name), valid, result['quarantine'],
+                                                      ds_name, f, clock)
+        with clock.stage("aggregate", rows_in=len(valid)) as counts:
+            result['partial'] = sum_per_key(valid, qty_col, per_date=True)
+            counts["rows_out"] = len(result['partial'])
+        result['valid'] = len(valid)
+    if metrics is not None:
+        for (ds_name, _, f, *_), result in zip(tasks, results):
+            record_file(metrics, f, ds_name, result['clock'], result['rows'], result['valid'],
+                        result['quarantine'], result['recovered'])
+    return results
+
+def run_parallel(config, master, master_data, workers, output_format="csv", reconciler=None, metrics=None,
+                 as_of=None, backfill_days=None, csv_engine="pandas", checkpoints=None, ledger=None):
+    """
+    Fans every raw file out to a process pool. Results come back in
+    submission order (sorted file names per dataset) and are merged exactly as
+    the serial path would, so the outputs are identical to it.
+    """
+    metrics = metrics or RunMetrics("parallel")
+    all_files = os.listdir(RAW_DIR)
+    key_indexes, _ = open_key_indexes(config, all_files)
+    inv_files = list_dataset_files(all_files, get_dataset_config(config, "inventory_snapshot"))
+    tasks = [("inventory_snapshot", None, f) for f in inv_files]
+    if inv_files:
+        for ds_name, qty_col in EVENT_DATASETS:
+            tasks += [(ds_name, qty_col, f) for f in list_dataset_files(all_files, get_dataset_config(config, ds_name))]
+
+    print(f"Ingesting {len(tasks)} files with {workers} workers...")
+    results = run_tasks(tasks, config, master, master_data, workers, reconciler, metrics, csv_engine,
+                        key_indexes, checkpoints=checkpoints)
+
+    inventory_partials = []
+    event_partials = {qty_col: [] for _, qty_col in EVENT_DATASETS}
+    final_quarantine_frames = []
+    for (ds_name, qty_col, f), result in zip(tasks, results):
+        if qty_col is None:
+            print(f"  {f}: Valid={result['valid']}, Quarantine={len(result['quarantine'])}, "
+                  f"Reconciled={result['recovered']}")
+            inventory_partials.append(result['partial'])
+            final_quarantine_frames.append(result['quarantine'])
+        else:
+            event_partials[qty_col].append(result['partial'])
+            if not result['quarantine'].empty:
+                final_quarantine_frames.append(result['quarantine'])
+
+    if inventory_partials:
+        print("Computing Effective Stock Positions...")
+        with metrics.stage("aggregate") as counts:
+            inventory_days = latest_per_key(pd.concat(inventory_partials, ignore_index=True), per_date=True)
+            totals = {}
+            for qty_col, partials in event_partials.items():
+                partials = [p for p in partials if not p.empty]
+                totals[qty_col] = (sum_per_key(pd.concat(partials, ignore_index=True), qty_col, per_date=True)
+                                   if partials else None)
+            counts["rows_out"] = len(inventory_days)
+        publish_fact(config, inventory_days, totals, output_format, metrics, as_of, backfill_days)
+
+    if final_quarantine_frames:
+        all_quarantine = pd.concat(final_quarantine_frames, ignore_index=True)
+        with metrics.stage("write_quarantine", rows_in=len(all_quarantine)):
+            save_quarantine(all_quarantine, config, output_format, ledger)
+    save_key_indexes(key_indexes)
+
+# --- Sharded Runs ---
+# Every fact key belongs to one store, so the effective-stock computation
+# splits by store without changing any key's result. A sharded run makes two
+# passes over a process pool:
+#   1. per raw file: ingest_file (load, validate, reconcile), then its
+#      partial (or, for dedupe datasets, its accepted rows) is split by a
+#      stable hash of store_id into one spool piece per shard. The parent
+#      claims dedupe datasets' key hashes in file order, as the other modes do.
+#   2. per shard: the shard's pieces are read in file order, duplicates
+#      dropped, aggregated and run through the as-of engine.
+# The shard fact tables are concatenated in shard order, without a global
+# sort. A worker holds one file or one shard at a time, so memory per worker
+# shrinks as shards grow; the parent holds the quarantine and the result.
+def shard_numbers(stores: pd.Series, shards: int) -> np.ndarray:
+    """Shard of each row by store_id, from a hash that is the same in every process. Missing stores go to 0."""
+    codes, uniques = pd.factorize(stores)
+    by_store = np.append(pd.util.hash_array(np.asarray(uniques, dtype=object)) % shards, 0)
+    return by_store[codes].astype(np.int64)
+
+def shard_file(task):
+    """
+    Pool task of sharded runs: ingest_file, then the file's frame split into
+    spool pieces by shard. Returns ingest_file's result with the row count of
+    each piece instead of the frame, the key hashes of dedupe datasets' rows
+    (in piece order) and, for snapshots, the latest date.
+    """
+    ds_name, qty_col, filename, spool_dir, shards = task
+    result = ingest_file((ds_name, qty_col, filename))
+    frame = result['partial'] if result['accepted'] is None else result['accepted']
+    with result['clock'].stage("partition", rows_in=len(frame)):
+        shard_of = shard_numbers(frame['store_id'], shards)
+        order = np.argsort(shard_of, kind='stable')
+        bounds = np.searchsorted(shard_of[order], np.arange(shards + 1))
+        pieces = {}
+        for shard in range(shards):
+            rows = order[bounds[shard]:bounds[shard + 1]]
+            if len(rows):
+                piece_dir = os.path.join(spool_dir, str(shard), ds_name)
+                os.makedirs(piece_dir, exist_ok=True)
+                frame.iloc[rows].to_pickle(os.path.join(piece_dir, filename + ".pkl"))
+                pieces[shard] = len(rows)
+    if result['accepted'] is not None:
+        result['keys'] = key_hashes(frame.iloc[order]) if len(frame) else np.empty(0, dtype=KEY_DTYPE)
+    if qty_col is None:
+        result['latest_date'] = pd.to_datetime(frame['date']).max() if len(frame) else pd.NaT
+    result.update(partial=None, accepted=None, pieces=pieces)
+    return result
+
+def stock_shard(task):
+    """
+    Pool task of sharded runs: effective stock of one shard from its spool
+    pieces. Returns the shard's fact rows (None without snapshots), its
+    history for backfill dates, the duplicates moved to quarantine per
+    (dataset, file) and stage timings.
+    """
+    shard, spool_dir, files, dedupe, duplicates, as_of, dates = task
+    clock = StageClock()
+    inventory, events, moved = [], {qty_col: [] for _, qty_col in EVENT_DATASETS}, {}
+    with clock.stage("aggregate") as counts:
+        for ds_name, qty_col, f in files:
+            piece = pd.read_pickle(os.path.join(spool_dir, str(shard), ds_name, f + ".pkl"))
+            if ds_name in dedupe:
+                if (ds_name, f) in duplicates:
+                    duplicate, owners = duplicates[(ds_name, f)]
+                    moved[(ds_name, f)] = tag_source(accepted_duplicates(piece[duplicate], owners), ds_name, f)
+                    piece = piece[~duplicate]
+                piece = sum_per_key(piece, qty_col, per_date=True)
+            if qty_col is None:
+                inventory.append(piece)
+            elif not piece.empty:
+                events[qty_col].append(piece)
+        inventory_days = latest_per_key(pd.concat(inventory, ignore_index=True), per_date=True) if inventory else None
+        totals = {qty_col: sum_per_key(pd.concat(pieces, ignore_index=True), qty_col, per_date=True) if pieces
+                  else None for qty_col, pieces in events.items()}
+        counts["rows_out"] = 0 if inventory_days is None else len(inventory_days)
+    fact = history = None
+    if inventory_days is not None:
+        with clock.stage("effective_stock", rows_in=len(inventory_days)) as counts:
+            engine = AsOfStockEngine(inventory_days, totals['restock_qty'], totals['damaged_qty'])
+            fact = engine.effective_stock(as_of)
+            history = engine.history(dates) if dates is not None else None
+            counts["rows_out"] = len(fact)
+    return fact, history, moved, clock
+
+def run_sharded(config, master, master_data, workers, shards, output_format="csv", reconciler=None, metrics=None,
+                as_of=None, backfill_days=None, csv_engine="pandas", checkpoints=None, ledger=None):
+    """
+    Computes the fact table store shard by store shard (see Sharded Runs).
+    Its rows equal the serial run's, in shard order; the quarantine is the
+    same, in the same order.
+    """
+    metrics = metrics or RunMetrics("sharded")
+    all_files = os.listdir(RAW_DIR)
+    key_indexes, _ = open_key_indexes(config, all_files)
+    spool_dir = os.path.join(STATE_DIR, "shards")
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    inv_files = list_dataset_files(all_files, get_dataset_config(config, "inventory_snapshot"))
+    tasks = [("inventory_snapshot", None, f, spool_dir, shards) for f in inv_files]
+    if inv_files:
+        for ds_name, qty_col in EVENT_DATASETS:
+            tasks += [(ds_name, qty_col, f, spool_dir, shards)
+                      for f in list_dataset_files(all_files, get_dataset_config(config, ds_name))]
+
+    try:
+        print(f"Ingesting {len(tasks)} files into {shards} store shards with {workers} workers...")
+        with metrics.stage("pool_ingest", rows_in=len(tasks)):
+            results = run_tasks(tasks, config, master, master_data, workers, reconciler, None, csv_engine,
+                                ingest=shard_file, checkpoints=checkpoints)
+
+        # Claim dedupe datasets' keys in file order, then hand each shard its pieces' duplicate masks
+        duplicates = {shard: {} for shard in range(shards)}
+        for (ds_name, _, f, *_), result in zip(tasks, results):
+            index = key_indexes.get(ds_name)
+            if index is None:
+                continue
+            keys = result.pop('keys')
+            with result['clock'].stage("dedupe", rows_in=len(keys)) as counts:
+                duplicate, owners = index.claim_keys(keys, f)
+                start = 0
+                for shard, rows in result['pieces'].items():
+                    part = duplicate[start:start + rows]
+                    if part.any():
+                        first = int(duplicate[:start].sum())
+                        duplicates[shard][(ds_name, f)] = (part, owners[first:first + int(part.sum())])
+                    start += rows
+                result['valid'] -= int(duplicate.sum())
+                counts["rows_out"] = result['valid']
+
+        dates = None
+        if backfill_days and inv_files:
+            latest = max((r['latest_date'] for (ds_name, *_), r in zip(tasks, results) if ds_name ==
+                          "inventory_snapshot" and pd.notna(r['latest_date'])), default=None)
+            end = pd.Timestamp(as_of) if as_of is not None else latest
+            dates = pd.date_range(end=end, periods=backfill_days, freq='D') if end is not None else None
+        dedupe = set(key_indexes)
+        shard_tasks = []
+        for shard in range(shards):
+            files = [(ds_name, qty_col, f) for (ds_name, qty_col, f, *_), result in zip(tasks, results)
+                     if shard in result['pieces']]
+            if files:
+                shard_tasks.append((shard, spool_dir, files, dedupe, duplicates[shard], as_of, dates))
+
+        print(f"Computing Effective Stock Positions in {len(shard_tasks)} shards...")
+        with metrics.stage("pool_shards", rows_in=len(shard_tasks)):
+            if workers > 1 and len(shard_tasks) > 1:
+                with ProcessPoolExecutor(max_workers=min(workers, len(shard_tasks))) as pool:
+                    shard_results = list(pool.map(stock_shard, shard_tasks))
+            else:
+                shard_results = [stock_shard(task) for task in shard_tasks]
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    moved = {}
+    facts, histories = [], []
+    for fact, history, shard_moved, clock in shard_results:
+        metrics.clock.merge(clock)
+        for key, rows in shard_moved.items():
+            moved.setdefault(key, []).append(rows)
+        if fact is not None:
+            facts.append(fact)
+        if history is not None:
+            histories.append(history)
+
+    final_quarantine_frames = []
+    for (ds_name, qty_col, f, *_), result in zip(tasks, results):
+        quarantine = result['quarantine']
+        if (ds_name, f) in moved:
+            # Back into file order among the file's other quarantined rows, as dedupe_accepted leaves them
+            quarantine = pd.concat([quarantine] + moved[(ds_name, f)]).sort_index(kind='stable')
+        record_file(metrics, f, ds_name, result['clock'], result['rows'], result['valid'], quarantine,
+                    result['recovered'])
+        if qty_col is None:
+            print(f"  {f}: Valid={result['valid']}, Quarantine={len(quarantine)}, Reconciled={result['recovered']}")
+            final_quarantine_frames.append(quarantine)
+        elif not quarantine.empty:
+            final_quarantine_frames.append(quarantine)
+
+    if facts:
+        merged = pd.concat(facts, ignore_index=True)
+        with metrics.stage("write_fact", rows_in=len(merged)):
+            save_fact_table(merged, config, output_format)
+        if histories:
+            history = pd.concat(histories, ignore_index=True)
+            with metrics.stage("write_fact_history", rows_in=len(history)):
+                save_fact_history(history, config, output_format)
+
     if final_quarantine_frames:
         all_quarantine = pd.concat(final_quarantine_frames, ignore_index=True)
-        q_file = os.path.join(QUARANTINE_DIR, "quarantine_records.csv")
-        all_quarantine.to_csv(q_file, index=False)
-        print(f"WARNING: {len(all_quarantine)} records sent to Quarantine: {q_file}")
+        with metrics.stage("write_quarantine", rows_in=len(all_quarantine)):
+            save_quarantine(all_quarantine, config, output_format, ledger)
+    save_key_indexes(key_indexes)
+
+# --- DAG Runs ---
+# The serial run as a graph of stages (see dag.StageGraph): one branch per
+# dataset in schema_config.yaml that feeds the fact table, joined only at
+# effective_stock. Each file of a branch is its own chain, ingest -> validate
+# -> reconcile (snapshots) or dedupe (datasets deduplicated across files), so
+# a file is validated as soon as it is read, while the next one is read, and
+# its raw frame is dropped once validated. The branch's aggregate stage takes
+# every file's result. Restock and damaged files are read and validated while
+# snapshots are still being reconciled, and the quarantine is written while
+# effective stock is computed. A file's dedupe stage also depends on the one
+# of the file before it, so files claim keys in sorted order as in the serial
+# run. Outputs equal the serial run's; the per-stage timings and the critical
+# path go to the metrics. Files with a Silver checkpoint are loaded from it
+# at ingest and pass through validate and reconcile; a checkpoint stage beside
+# dedupe saves the others.
+def _ingest_stage(ds_config, f, csv_engine, checkpoints=None):
+    def ingest():
+        clock = StageClock()
+        if checkpoints is not None and f in checkpoints:
+            with clock.stage("load_checkpoint") as counts:
+                rows, valid, quarantine, recovered = checkpoints.load(f)
+                counts["rows_out"] = len(valid)
+            return {"file": f, "rows": rows, "valid": valid, "quarantine": quarantine, "clock": clock,
+                    "recovered": recovered, "checkpointed": True}
+        with clock.stage("read") as counts:
+            df = load_csv(RAW_DIR, f, ds_config, csv_engine)
+            counts["rows_out"] = len(df)
+        return {"file": f, "rows": len(df), "frame": df, "clock": clock, "recovered": 0}
+    return ingest
+
+def _validate_stage(ds_name, plan):
+    def validate(record):
+        if record.get("checkpointed"):
+            return record
+        record = dict(record)
+        df = record.pop("frame")
+        with record["clock"].stage("validate", rows_in=len(df)) as counts:
+            record["valid"], quarantine = validate_data(df, plan)
+            counts["rows_out"] = len(record["valid"])
+        record["quarantine"] = tag_source(quarantine, ds_name, record["file"])
+        return record
+    return validate
+
+def _reconcile_stage(reconciler):
+    def reconcile(record):
+        if record.get("checkpointed"):
+            return record
+        recovered = reconcile_timed(reconciler, record["quarantine"], record["clock"])
+        valid = record["valid"]
+        if not recovered.empty:
+            valid = pd.concat([valid, recovered], ignore_index=True)
+        return {**record, "valid": valid, "recovered": len(recovered)}
+    return reconcile
+
+def _checkpoint_stage(checkpoints):
+    def checkpoint(record):
+        if not record.get("checkpointed"):
+            with record["clock"].stage("save_checkpoint", rows_in=len(record["valid"])):
+                checkpoints.save(record["file"], (record["rows"], record["valid"], record["quarantine"],
+                                                  record["recovered"]))
+        return record["file"]
+    return checkpoint
+
+def _dedupe_stage(ds_name, index):
+    def dedupe(record, *previous):
+        # previous, the file before's dedupe, is only a dependency for the claim order
+        valid, quarantine = dedupe_accepted(index, record["valid"], record["quarantine"], ds_name,
+                                            record["file"], record["clock"])
+        return {**record, "valid": valid, "quarantine": quarantine}
+    return dedupe
+
+def _aggregate_stage(qty_col):
+    def aggregate(*records):
+        if qty_col is None:
+            return latest_per_key(pd.concat([record["valid"] for record in records], ignore_index=True),
+                                  per_date=True)
+        frames = [record["valid"] for record in records if not record["valid"].empty]
+        return sum_per_key(pd.concat(frames, ignore_index=True), qty_col, per_date=True) if frames else None
+    return aggregate
+
+def build_stage_graph(config, plans, reconciler, key_indexes, all_files, output_format="csv", as_of=None,
+                      backfill_days=None, csv_engine="pandas", checkpoints=None, ledger=None):
+    """
+    The stage graph of a DAG run over all_files. Its outputs are
+    "write_quarantine" (the per-file records, by dataset), when there are
+    snapshot files "write_fact" (the fact row count) and with checkpoints
+    one "checkpoint:<dataset>:<file>" stage per file.
+    """
+    graph = StageGraph()
+    qty_cols = dict(EVENT_DATASETS)
+    inv_files = list_dataset_files(all_files, get_dataset_config(config, "inventory_snapshot"))
+    branches = [] # (dataset, its config, its files, the last stage of each file)
+    for ds_name, ds_config in config['datasets'].items():
+        if ds_name != "inventory_snapshot" and (ds_name not in qty_cols or not inv_files):
+            continue
+        branches.append((ds_name, ds_config, list_dataset_files(all_files, ds_config), []))
+
+    # Files are added round robin across branches: the graph starts ready stages in that order
+    for i in range(max(len(files) for _, _, files, _ in branches)):
+        for ds_name, ds_config, files, lasts in branches:
+            if i >= len(files):
+                continue
+            stage = f"{ds_name}:{files[i]}"
+            last = graph.add(f"ingest:{stage}", _ingest_stage(ds_config, files[i], csv_engine, checkpoints))
+            last = graph.add(f"validate:{stage}", _validate_stage(ds_name, plans[ds_name]), [last])
+            if ds_name == "inventory_snapshot":
+                last = graph.add(f"reconcile:{stage}", _reconcile_stage(reconciler), [last])
+            if checkpoints is not None:
+                graph.add(f"checkpoint:{stage}", _checkpoint_stage(checkpoints), [last])
+            if ds_name in key_indexes:
+                last = graph.add(f"dedupe:{stage}", _dedupe_stage(ds_name, key_indexes[ds_name]),
+                                 [last] + lasts[-1:])
+            lasts.append(last)
+    for ds_name, _, _, lasts in branches:
+        graph.add(f"aggregate:{ds_name}", _aggregate_stage(qty_cols.get(ds_name)), lasts)
+
+    # Quarantine and metrics in the serial run's order: snapshots, then events
+    order = ["inventory_snapshot"] + [ds for ds, _ in EVENT_DATASETS]
+    branches.sort(key=lambda branch: order.index(branch[0]))
+
+    def write_quarantine(*per_file):
+        # Valid rows are only counted from here on, so aggregation is their last user
+        records = [(ds_name, {**record, "valid": len(record["valid"])})
+                   for ds_name, record in zip([ds_name for ds_name, _, _, lasts in branches for _ in lasts], per_file)]
+        frames = [record["quarantine"] for ds_name, record in records
+                  if ds_name == "inventory_snapshot" or not record["quarantine"].empty]
+        if frames:
+            save_quarantine(pd.concat(frames, ignore_index=True), config, output_format, ledger)
+        return records
+
+    def effective_stock(inventory_days, *totals):
+        totals = dict(zip([qty_col for _, qty_col in EVENT_DATASETS], totals))
+        engine = AsOfStockEngine(inventory_days, totals['restock_qty'], totals['damaged_qty'])
+        merged = engine.effective_stock(as_of)
+        history = None
+        if backfill_days:
+            end = pd.Timestamp(as_of) if as_of is not None else engine.latest_date()
+            history = engine.history(pd.date_range(end=end, periods=backfill_days, freq='D'))
+        return merged, history
+
+    def write_fact(positions):
+        merged, history = positions
+        save_fact_table(merged, config, output_format)
+        if history is not None:
+            save_fact_history(history, config, output_format)
+        return len(merged)
+
+    graph.add("write_quarantine", write_quarantine, [last for _, _, _, lasts in branches for last in lasts])
+    if inv_files:
+        graph.add("effective_stock", effective_stock, [f"aggregate:{ds}" for ds in order])
+        graph.add("write_fact", write_fact, ["effective_stock"])
+    return graph
+
+def run_dag(config, plans, reconciler, workers=1, output_format="csv", metrics=None, as_of=None, backfill_days=None,
+            csv_engine="pandas", checkpoints=None, ledger=None):
+    """
+    Runs the stage graph with workers threads (one per dataset branch if
+    workers is 1) and records per-file counts, stage timings and the
+    critical path in the run metrics.
+    """
+    metrics = metrics or RunMetrics("dag")
+    all_files = os.listdir(RAW_DIR)
+    key_indexes, _ = open_key_indexes(config, all_files)
+    graph = build_stage_graph(config, plans, reconciler, key_indexes, all_files, output_format, as_of,
+                              backfill_days, csv_engine, checkpoints, ledger)
+    threads = workers if workers > 1 else sum(name.startswith("aggregate:") for name in graph.stages)
+    print(f"Running {len(graph.stages)} stages on {threads} threads...")
+    outputs = graph.run(threads)
+
+    for ds_name, record in outputs["write_quarantine"]:
+        record_file(metrics, record["file"], ds_name, record["clock"], record["rows"],
+                    record["valid"] - record["recovered"], record["quarantine"], record["recovered"])
+        if ds_name == "inventory_snapshot":
+            print(f"  {record['file']}: Valid={record['valid'] - record['recovered']}, "
+                  f"Quarantine={len(record['quarantine'])}, Reconciled={record['recovered']}")
+    save_key_indexes(key_indexes)
+
+    report = graph.report()
+    for timing in report["stages"]:
+        # Per-file stages are already in the file clocks; the rest keep the names other modes use
+        name = timing["stage"].split(":", 1)[0]
+        if name in ("aggregate", "effective_stock", "write_fact", "write_quarantine"):
+            metrics.clock.add(name, {"wall_seconds": timing["seconds"], "cpu_seconds": timing["cpu_seconds"],
+                                     "calls": 1})
+    metrics.extra["dag"] = report
+    print(f"Critical path ({report['critical_path_seconds']:.2f}s of {report['wall_seconds']:.2f}s wall): "
+          f"{' -> '.join(report['critical_path'])}")
+
+# --- Incremental Runs ---
+def run_context(config):
+    """
+    Fingerprint of everything besides the raw files that shapes per-file
+    results. If the rules or the master data change, stored state is stale.
+    """
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+    for master_file in ("products.csv", "stores.csv"):
+        path = os.path.join(RAW_DIR, master_file)
+        if os.path.exists(path):
+            digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+def run_incremental(config, master, master_data, workers=1, full_rebuild=False, output_format="csv",
+                    reconciler=None, metrics=None, as_of=None, backfill_days=None, admit=None, csv_engine="pandas",
+                    checkpoints=None, ledger=None):
+    """
+    Ingests only raw files that are new or changed since the last run (per the
+    manifest in STATE_DIR) and merges their effects into the stored per-key
+    state. New files are folded into the running totals directly; changed or
+    removed files are retracted by re-merging the stored per-file results, as
+    are files that had lost keys to them (see open_key_indexes). Outputs hold
+    the same rows as a full run over the same files, though not necessarily
+    in the same order (a late file's rows come after those merged before it).
+    With admit (watch mode), new files outside it are left for a later run.
+    """
+    metrics = metrics or RunMetrics("incremental")
+    context = run_context(config)
+    manifest = load_manifest(STATE_DIR)
+    all_files = on_disk = os.listdir(RAW_DIR)
+    if admit is not None:
+        admitted = set(admit) | set(manifest.get("files", {}))
+        all_files = [f for f in all_files if f in admitted]
+    datasets = [("inventory_snapshot", None)] + EVENT_DATASETS
+    files_by_ds = {ds_name: list_dataset_files(all_files, get_dataset_config(config, ds_name))
+                   for ds_name, _ in datasets}
+
+    if full_rebuild or manifest.get("context") != context or manifest.get("version") != MANIFEST_VERSION:
+        print("Full rebuild: discarding incremental state...")
+        reset_state(STATE_DIR)
+        manifest = load_manifest(STATE_DIR)
+    key_indexes, stale = open_key_indexes(config, on_disk)
+
+    tracked = [f for ds_name, _ in datasets for f in files_by_ds[ds_name]]
+    with metrics.stage("manifest_diff", rows_in=len(tracked)):
+        new, changed, removed, entries = diff_manifest(manifest, RAW_DIR, tracked)
+    # Unchanged files that had lost keys to a changed or removed one
+    stale = stale & set(tracked) - set(new) - set(changed)
+    unchanged = len(tracked) - len(new) - len(changed) - len(stale)
+    metrics.extra["file_changes"] = {"new": len(new), "changed": len(changed), "removed": len(removed),
+                                     "revalidated": len(stale), "unchanged": unchanged}
+    print(f"Incremental run: {len(new)} new, {len(changed)} changed, {len(removed)} removed, "
+          f"{len(stale)} re-validated, {unchanged} unchanged files")
+
+    # Retractions (and recovery from an interrupted run) need a full re-merge
+    remerge = bool(changed or removed or stale or manifest.get("dirty"))
+    manifest["dirty"] = True
+    save_manifest(STATE_DIR, manifest)
+
+    todo = set(new) | set(changed) | stale
+    tasks = [(ds_name, qty_col, f) for ds_name, qty_col in datasets for f in files_by_ds[ds_name] if f in todo]
+    results = {}
+    ingested = run_tasks(tasks, config, master, master_data, workers, reconciler, metrics, csv_engine,
+                         key_indexes, checkpoints=checkpoints)
+    for (ds_name, qty_col, f), result in zip(tasks, ingested):
+        print(f"  Ingested {f}: Valid={result['valid']}, Quarantine={len(result['quarantine'])}")
+        save_file_state(STATE_DIR, f, result['partial'], result['quarantine'])
+        results[f] = result
+    for f in removed:
+        drop_file_state(STATE_DIR, f)
+
+    def partials_for(ds_name, only_new):
+        frames = []
+        for f in files_by_ds[ds_name]:
+            if f in results:
+                frames.append(results[f]['partial'])
+            elif not only_new:
+                frames.append(load_file_state(STATE_DIR, f, get_dataset_config(config, ds_name))[0])
+        return [frame for frame in frames if not frame.empty]
+
+    # Fold contributions into the per-key state
+    with metrics.stage("aggregate") as counts:
+        inv_partials = partials_for("inventory_snapshot", only_new=not remerge)
+        inventory_days = None if remerge else load_running_state(
+            STATE_DIR, "inventory_days", get_dataset_config(config, "inventory_snapshot"))
+        if inv_partials:
+            inventory_days = combine_latest(inventory_days, pd.concat(inv_partials, ignore_index=True), per_date=True)
+        save_running_state(STATE_DIR, "inventory_days", inventory_days)
+
+        totals = {}
+        for ds_name, qty_col in EVENT_DATASETS:
+            running = None if remerge else load_running_state(STATE_DIR, qty_col, get_dataset_config(config, ds_name))
+            partials = partials_for(ds_name, only_new=not remerge)
+            if partials:
+                running = combine_sums(running, sum_per_key(pd.concat(partials, ignore_index=True), qty_col,
+                                                            per_date=True), qty_col, per_date=True)
+            save_running_state(STATE_DIR, qty_col, running)
+            totals[qty_col] = running
+        counts["rows_out"] = 0 if inventory_days is None else len(inventory_days)
+
+    if files_by_ds["inventory_snapshot"] and inventory_days is not None:
+        print("Computing Effective Stock Positions...")
+        publish_fact(config, inventory_days, totals, output_format, metrics, as_of, backfill_days)
+
+    # Rebuild the quarantine ledger from the per-file quarantine state
+    final_quarantine_frames = []
+    if files_by_ds["inventory_snapshot"]:
+        for ds_name, qty_col in datasets:
+            for f in files_by_ds[ds_name]:
+                if f in results:
+                    quarantine = results[f]['quarantine']
+                else:
+                    quarantine = load_file_state(STATE_DIR, f, get_dataset_config(config, ds_name))[1]
+                if qty_col is None or not quarantine.empty:
+                    final_quarantine_frames.append(quarantine)
+    if final_quarantine_frames:
+        all_quarantine = pd.concat(final_quarantine_frames, ignore_index=True)
+        with metrics.stage("write_quarantine", rows_in=len(all_quarantine)):
+            save_quarantine(all_quarantine, config, output_format, ledger)
+
+    save_key_indexes(key_indexes)
+    save_manifest(STATE_DIR, {"version": manifest["version"], "context": context,
+                              "files": entries, "dirty": False})
+
+# --- Watch Mode ---
+def run_watch(poll_seconds=1.0, settle_seconds=2.0, max_batch_files=50, max_latency_seconds=10.0,
+              max_batches=None, workers=1, output_format="csv", match_cache=True, as_of=None, backfill_days=None,
+              csv_engine="pandas", checkpoint=True):
+    """
+    Runs until interrupted (or for max_batches batches): raw files matching a
+    dataset's file_pattern are picked up as they land, are re-sent or are
+    deleted, and fed through incremental runs in micro-batches (see watcher).
+    """
+    config = load_config(CONFIG_PATH)
+    patterns = [ds_config['file_pattern'] for ds_config in config['datasets'].values()]
+    known = {f: (entry["size"], entry["mtime"]) for f, entry in load_manifest(STATE_DIR).get("files", {}).items()}
+    batcher = FileBatcher(settle_seconds, max_batch_files, max_latency_seconds, known)
+    print(f"Watching {RAW_DIR} for {', '.join(patterns)} (batches of up to {max_batch_files} files, "
+          f"settle {settle_seconds}s, max latency {max_latency_seconds}s)...")
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            batcher.observe(scan_raw_dir(RAW_DIR, patterns))
+            batch = batcher.ready()
+            if not batch:
+                time.sleep(poll_seconds)
+                continue
+            waited = batcher.waited(batch)
+            started = time.perf_counter()
+            try:
+                run_pipeline(workers=workers, incremental=True, output_format=output_format,
+                             match_cache=match_cache, as_of=as_of, backfill_days=backfill_days, admit=batch,
+                             csv_engine=csv_engine, checkpoint=checkpoint)
+            except Exception as e:
+                # The files are retried once they change again; the next run re-merges after the interrupted one
+                print(f"ERROR: batch of {len(batch)} files failed: {e!r}")
+            else:
+                print(f"Batch of {len(batch)} files published in {time.perf_counter() - started:.2f}s "
+                      f"({waited + time.perf_counter() - started:.2f}s after the first landed)")
+            batcher.mark_done(batch)
+            batches += 1
+    except KeyboardInterrupt:
+        print("Watch stopped.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inventory data harmonization pipeline")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Stream raw files in chunks of this many rows instead of loading them whole")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Ingest raw files in parallel across this many processes")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Split the effective-stock computation into this many store shards, "
+                             "run across --workers processes")
+    parser.add_argument("--dag", action="store_true",
+                        help="Run the stages as a graph, dataset branches concurrently on --workers threads "
+                             "(one per dataset by default); reports the critical path")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only ingest raw files that are new or changed since the last run")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="With --incremental: discard stored state and reprocess every file")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="csv",
+                        help="Write outputs as flat CSV or as Parquet partitioned by date and store_id")
+    parser.add_argument("--no-match-cache", action="store_true",
+                        help="Do not use the persistent fuzzy-match cache")
+    parser.add_argument("--no-checkpoints", action="store_true",
+                        help="Do not reuse or save per-file Silver checkpoints (validated and reconciled rows)")
+    parser.add_argument("--backend", choices=BACKENDS, default="pandas",
+                        help="Execution backend: in-memory pandas, or an embedded SQLite database "
+                             "for inputs that do not fit in RAM")
+    parser.add_argument("--csv-engine", choices=CSV_ENGINES, default="pandas",
+                        help="CSV parser for whole-file reads: pandas, or pyarrow's multi-threaded reader "
+                             "(falls back to pandas when pyarrow is unavailable)")
+    parser.add_argument("--as-of", default=None,
+                        help="Compute effective stock as of this date (YYYY-MM-DD) instead of the latest data")
+    parser.add_argument("--backfill-days", type=int, default=None,
+                        help="Also save effective stock as of each of this many days, ending at --as-of "
+                             "(or the latest snapshot date)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and ingest raw files incrementally, in micro-batches, as they land")
+    parser.add_argument("--poll-seconds", type=float, default=1.0,
+                        help="With --watch: how often to list the raw directory")
+    parser.add_argument("--settle-seconds", type=float, default=2.0,
+                        help="With --watch: how long a file's size and mtime must hold still before it is read")
+    parser.add_argument("--max-batch-files", type=int, default=50,
+                        help="With --watch: most files per incremental run")
+    parser.add_argument("--max-latency-seconds", type=float, default=10.0,
+                        help="With --watch: run a batch once its first settled file has waited this long, "
+                             "even while more files are arriving")
+    args = parser.parse_args()
+    if args.csv_engine != "pandas" and (args.chunk_size or args.backend != "pandas"):
+        parser.error("--csv-engine applies to whole-file reads; "
+                     "it cannot be combined with --chunk-size or --backend sql")
+    if args.dag and (args.chunk_size or args.incremental or args.watch or args.shards or args.backend != "pandas"):
+        parser.error("--dag cannot be combined with --chunk-size, --incremental, --watch, --shards or --backend sql")
+    if args.shards is not None and (args.chunk_size or args.incremental or args.watch or args.backend != "pandas"):
+        parser.error("--shards cannot be combined with --chunk-size, --incremental, --watch or --backend sql")
+    if args.watch and (args.chunk_size or args.backend != "pandas"):
+        parser.error("--watch runs incremental pandas runs; it cannot be combined with --chunk-size or --backend sql")
+    return args
 
 if __name__ == "__main__":
-    run_pipeline()
+    args = parse_args()
+    if args.watch:
+        run_watch(args.poll_seconds, args.settle_seconds, args.max_batch_files, args.max_latency_seconds,
+                  workers=args.workers, output_format=args.output_format, match_cache=not args.no_match_cache,
+                  as_of=args.as_of, backfill_days=args.backfill_days, csv_engine=args.csv_engine,
+                  checkpoint=not args.no_checkpoints)
+    else:
+        run_pipeline(chunk_size=args.chunk_size, workers=args.workers,
+                     incremental=args.incremental, full_rebuild=args.full_rebuild,
+                     output_format=args.output_format, match_cache=not args.no_match_cache,
+                     as_of=args.as_of, backfill_days=args.backfill_days, backend=args.backend,
+                     csv_engine=args.csv_engine, shards=args.shards, dag=args.dag,
+                     checkpoint=not args.no_checkpoints)
@@ -0,0 +1,196 @@
+import os
+import json
+import uuid
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional
+from pipeline_core import load_csv
+
+# --- Master Data Snapshot ---
+# Parsing products.csv (and stores.csv) and rebuilding ID sets on every run is
+# a fixed startup cost that grows with the catalog. The master files are
+# compiled instead into a snapshot that is rebuilt only when a source file
+# changes (size or mtime) or SNAPSHOT_VERSION does:
+#   * every column as its own .npy file, strings as fixed-width unicode, so
+#     columns are memory-mapped and only the ones read are paged in;
+#   * per master table, the sorted distinct keys of its ID column, also
+#     memory-mapped: fk and product checks binary-search them (see KeySet)
+#     instead of hashing the catalog into a set;
+#   * the product IDs in catalog order with their master_version, which is
+#     what ReconciliationEngine needs (its candidate index is persisted
+#     separately, keyed by that version).
+# Each build goes to its own directory and current.json is switched to it
+# atomically, so a process that still maps the previous build is unaffected.
+SNAPSHOT_VERSION = 1
+MASTER_FILES = {"products": "products.csv", "stores": "stores.csv"}
+MASTER_KEYS = {"products": "product_id", "stores": "store_id"}
+REQUIRED_MASTERS = ("products",)
+CURRENT_FILE = "current.json"
+MANIFEST_FILE = "manifest.json"
+
+class KeySet:
+    """
+    The distinct keys of a master column as a sorted, memory-mapped unicode
+    array. Iterates and answers `in` like the set it replaces; contains()
+    checks a whole array of values at once.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.keys = np.load(path, mmap_mode='r')
+
+    def __reduce__(self):
+        # Pool workers re-map the file instead of receiving the keys
+        return KeySet, (self.path,)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys.tolist())
+
+    def __contains__(self, value) -> bool:
+        return bool(self.contains(np.array([value], dtype=object))[0])
+
+    def contains(self, values: np.ndarray) -> np.ndarray:
+        """Membership of each value (missing values are never members)."""
+        values = np.asarray(values, dtype=object)
+        found = np.zeros(len(values), dtype=bool)
+        present = pd.notna(values)
+        if len(self.keys) and present.any():
+            probe = values[present].astype(str)
+            idx = np.minimum(np.searchsorted(self.keys, probe), len(self.keys) - 1)
+            found[present] = self.keys[idx] == probe
+        return found
+
+class MasterSnapshot:
+    """A loaded snapshot build. Columns and key arrays are mapped on first use."""
+    def __init__(self, path: str, rebuilt: bool = False):
+        self.path = path
+        self.rebuilt = rebuilt
+        with open(os.path.join(path, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest["master_version"]
+        self._master_ids = None
+
+    def __reduce__(self):
+        return MasterSnapshot, (self.path,)
+
+    @property
+    def tables(self) -> List[str]:
+        return list(self.manifest["tables"])
+
+    def rows(self, table: str) -> int:
+        return self.manifest["tables"][table]["rows"] if table in self.manifest["tables"] else 0
+
+    def column(self, table: str, col: str) -> pd.Series:
+        """One column with the values (and missing values) it had in the CSV."""
+        spec = self.manifest["tables"][table]["columns"][col]
+        values = np.load(os.path.join(self.path, spec["file"]), mmap_mode='r')
+        if spec["kind"] == "numeric":
+            return pd.Series(values, name=col)
+        values = values.astype(object)
+        if spec.get("mask"):
+            values[np.load(os.path.join(self.path, spec["mask"]))] = None
+        return pd.Series(values, name=col)
+
+    def frame(self, table: str, columns: Optional[Iterable[str]] = None) -> Optional[pd.DataFrame]:
+        """The master table (or some of its columns) as a frame; None if it was not in the raw data."""
+        if table not in self.manifest["tables"]:
+            return None
+        stored = self.manifest["tables"][table]["columns"]
+        columns = [col for col in (columns or stored) if col in stored]
+        return pd.DataFrame({col: self.column(table, col) for col in columns}, columns=columns)
+
+    def key_sets(self) -> Dict[str, KeySet]:
+        """Key sets by "table.column", the names fk checks in schema_config.yaml use."""
+        return {name: KeySet(os.path.join(self.path, file)) for name, file in self.manifest["keys"].items()}
+
+    @property
+    def master_ids(self) -> List[str]:
+        """Distinct product IDs in catalog order (first occurrence), for reconciliation."""
+        if self._master_ids is None:
+            self._master_ids = np.load(os.path.join(self.path, "products.master_ids.npy"), mmap_mode='r').tolist()
+        return self._master_ids
+
+def _fingerprint(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _sources(raw_dir: str) -> Dict[str, List[int]]:
+    return {table: _fingerprint(os.path.join(raw_dir, filename)) for table, filename in MASTER_FILES.items()
+            if os.path.exists(os.path.join(raw_dir, filename))}
+
+def _save_column(build_dir: str, stem: str, series: pd.Series) -> Dict:
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        np.save(os.path.join(build_dir, stem + ".npy"), series.to_numpy())
+        return {"kind": "numeric", "file": stem + ".npy"}
+    missing = series.isna().to_numpy()
+    spec = {"kind": "string", "file": stem + ".npy"}
+    np.save(os.path.join(build_dir, spec["file"]),
+            np.asarray(series.astype(object).where(~missing, "").to_numpy(), dtype=str))
+    if missing.any():
+        spec["mask"] = stem + ".mask.npy"
+        np.save(os.path.join(build_dir, spec["mask"]), missing)
+    return spec
+
+def build_snapshot(raw_dir: str, snapshot_dir: str) -> str:
+    """Compiles the master files in raw_dir into a new build under snapshot_dir. Returns its directory."""
+    from reconciliation import master_version
+    name = f"build-{uuid.uuid4().hex[:12]}"
+    build_dir = os.path.join(snapshot_dir, name)
+    os.makedirs(build_dir)
+    manifest = {"version": SNAPSHOT_VERSION, "sources": _sources(raw_dir), "tables": {}, "keys": {}}
+    for table, filename in MASTER_FILES.items():
+        if table not in manifest["sources"] and table not in REQUIRED_MASTERS:
+            continue
+        df = load_csv(raw_dir, filename)
+        columns = {col: _save_column(build_dir, f"{table}.{col}", df[col]) for col in df.columns}
+        manifest["tables"][table] = {"rows": len(df), "columns": columns}
+        key = MASTER_KEYS[table]
+        if key in df.columns:
+            keys = df[key].dropna().astype(str).to_numpy(dtype=str)
+            np.save(os.path.join(build_dir, f"{table}.{key}.keys.npy"), np.unique(keys))
+            manifest["keys"][f"{table}.{key}"] = f"{table}.{key}.keys.npy"
+        if table == "products":
+            master_ids = list(dict.fromkeys(df['product_id'].dropna().astype(str)))
+            np.save(os.path.join(build_dir, "products.master_ids.npy"), np.asarray(master_ids, dtype=str))
+            manifest["master_version"] = master_version(master_ids)
+    with open(os.path.join(build_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+    # The build only becomes current once it is complete
+    current = os.path.join(snapshot_dir, CURRENT_FILE)
+    with open(current + ".tmp", 'w') as f:
+        json.dump({"build": name}, f)
+    os.replace(current + ".tmp", current)
+    return build_dir
+
+def _current_build(snapshot_dir: str) -> Optional[str]:
+    current = os.path.join(snapshot_dir, CURRENT_FILE)
+    if not os.path.exists(current):
+        return None
+    with open(current, 'r') as f:
+        build_dir = os.path.join(snapshot_dir, json.load(f)["build"])
+    return build_dir if os.path.exists(os.path.join(build_dir, MANIFEST_FILE)) else None
+
+def _is_fresh(build_dir: str, raw_dir: str) -> bool:
+    with open(os.path.join(build_dir, MANIFEST_FILE), 'r') as f:
+        manifest = json.load(f)
+    return manifest.get("version") == SNAPSHOT_VERSION and manifest.get("sources") == _sources(raw_dir)
+
+def _remove_old_builds(snapshot_dir: str, keep: str):
+    for name in os.listdir(snapshot_dir):
+        path = os.path.join(snapshot_dir, name)
+        if name.startswith("build-") and path != keep:
+            # A build another process still maps may not be removable (Windows); it goes next time
+            shutil.rmtree(path, ignore_errors=True)
+
+def load_master_snapshot(raw_dir: str, snapshot_dir: str) -> MasterSnapshot:
+    """The current snapshot of raw_dir's master files, rebuilt first if they changed."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    build_dir = _current_build(snapshot_dir)
+    if build_dir is not None and _is_fresh(build_dir, raw_dir):
+        return MasterSnapshot(build_dir)
+    build_dir = build_snapshot(raw_dir, snapshot_dir)
+    _remove_old_builds(snapshot_dir, build_dir)
+    return MasterSnapshot(build_dir, rebuilt=True)
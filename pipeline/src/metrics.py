@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import uuid
+import contextlib
+from collections import Counter
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+from pipeline_core import REASON_SEPARATOR
+
+# --- Run Metrics ---
+# Every run records, per stage and per raw file: wall time, CPU time, the
+# process's peak RSS so far, and rows in/out. The run adds quarantine counts by
+# reason and reconciliation hit rates, and is appended as one JSON line to the
+# metrics log that the dashboard's Pipeline Performance tab reads. Quarantine
+# reasons are counted as reason codes and named when the report is made; a row
+# counts once under each of its reasons.
+METRICS_VERSION = 2 # 2: quarantine_by_reason counts every reason of a row, quarantine_total counts rows
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident memory of this process and its waited-for children, in MB.
+    On Linux VmHWM is used, since ru_maxrss can carry over the peak of the
+    process that spawned this one. None where unavailable (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", 'r') as f:
+            own = next((int(line.split()[1]) for line in f if line.startswith("VmHWM:")), None)
+        if own is not None:
+            return round(max(own, children) / 2**10, 1)
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, children)
+    return round(rss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+def reason_group(reason) -> str:
+    # Type errors carry the offending value ("quantity not a valid integer (abc)")
+    return str(reason).split(" (", 1)[0]
+
+def reason_groups(reasons: pd.Series) -> pd.Series:
+    """The reason group of each reason a quarantine_reason column lists, one row per reason."""
+    return reasons.dropna().astype(str).str.split(REASON_SEPARATOR).explode().map(reason_group)
+
+class StageClock:
+    """
+    Accumulates timings per named stage. A stage entered several times (once
+    per file or chunk) sums its times and rows. Plain dicts, so a clock can be
+    returned from a pool worker and merged into the run's clock.
+    """
+    def __init__(self):
+        self.stages: Dict[str, Dict] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None):
+        counts = {"rows_in": rows_in, "rows_out": None}
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield counts
+        self.add(name, {"wall_seconds": time.perf_counter() - wall, "cpu_seconds": time.process_time() - cpu,
+                        "calls": 1, "rows_in": counts["rows_in"], "rows_out": counts["rows_out"],
+                        "peak_rss_mb": peak_rss_mb()})
+
+    def add(self, name: str, record: Dict):
+        entry = self.stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0,
+                                              "rows_in": None, "rows_out": None, "peak_rss_mb": None})
+        for key, value in record.items():
+            if value is None:
+                continue
+            if key == "peak_rss_mb":
+                entry[key] = value if entry[key] is None else max(entry[key], value)
+            else:
+                entry[key] = value if entry[key] is None else entry[key] + value
+
+    def merge(self, other: "StageClock"):
+        for name, record in other.stages.items():
+            self.add(name, record)
+
+    def to_dict(self) -> Dict:
+        return {name: {k: round(v, 4) if isinstance(v, float) else v for k, v in record.items()}
+                for name, record in self.stages.items()}
+
+class RunMetrics:
+    def __init__(self, mode: str, options: Optional[Dict] = None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.options = options or {}
+        self.started_at = datetime.now(timezone.utc)
+        self._wall, self._cpu = time.perf_counter(), time.process_time()
+        self.clock = StageClock()
+        self.files = []
+        self.quarantine_codes: Dict[str, Counter] = {} # dataset -> rows per distinct reason code
+        self.quarantine_rows = 0
+        self.reconciliation = {"unknown_rows": 0, "recovered_rows": 0}
+        self.extra = {}
+
+    def stage(self, name: str, rows_in: Optional[int] = None):
+        return self.clock.stage(name, rows_in)
+
+    def add_file(self, filename: str, dataset: str, clock: StageClock, **counts):
+        """Records one raw file's stage timings and row counts, and adds them to the run totals."""
+        self.clock.merge(clock)
+        self.files.append({"file": filename, "dataset": dataset, **counts, "stages": clock.to_dict()})
+
+    def count_quarantine(self, dataset: str, codes: np.ndarray):
+        """Adds quarantined rows by their reason codes (see pipeline_core's Quarantine Reasons)."""
+        if len(codes):
+            values, counts = np.unique(codes, return_counts=True)
+            self.quarantine_codes.setdefault(dataset, Counter()).update(dict(zip(values.tolist(), counts.tolist())))
+            self.quarantine_rows += len(codes)
+
+    def count_reconciliation(self, unknown_rows: int, recovered_rows: int):
+        self.reconciliation["unknown_rows"] += unknown_rows
+        self.reconciliation["recovered_rows"] += recovered_rows
+
+    def report(self, cache=None, reasons: Optional[Dict] = None) -> Dict:
+        """The run's report. reasons maps each dataset to its ReasonCodes, which name the counted codes."""
+        by_reason = Counter()
+        for dataset, code_counts in self.quarantine_codes.items():
+            by_reason.update(reasons[dataset].counts(code_counts))
+        reconciliation = dict(self.reconciliation)
+        unknown = reconciliation["unknown_rows"]
+        reconciliation["hit_rate"] = round(reconciliation["recovered_rows"] / unknown, 4) if unknown else None
+        if cache is not None:
+            lookups = cache.hits + cache.misses
+            reconciliation.update({"cache_hits": cache.hits, "cache_misses": cache.misses,
+                                   "cache_hit_rate": round(cache.hits / lookups, 4) if lookups else None})
+        return {
+            "version": METRICS_VERSION,
+            "run_id": self.run_id,
+            "mode": self.mode,
+            "options": self.options,
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(time.perf_counter() - self._wall, 4),
+            "cpu_seconds": round(time.process_time() - self._cpu, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": self.clock.to_dict(),
+            "files": self.files,
+            "quarantine_by_reason": dict(by_reason),
+            "quarantine_total": self.quarantine_rows,
+            "reconciliation": reconciliation,
+            **self.extra,
+        }
+
+def append_metrics(path: str, report: Dict):
+    """Appends one run's report as a JSON line."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(report, default=str) + "\n")
+
+def load_metrics(path: str) -> list:
+    """All run reports in the log, oldest first. Unreadable lines (e.g. a torn final write) are skipped."""
+    if not os.path.exists(path):
+        return []
+    reports = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                reports.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return reports
@@ -1,7 +1,11 @@
 import yaml
+import numpy as np
 import pandas as pd
 import os
-from typing import Dict, List, Tuple
+import csv
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+KEY_COLUMNS = ['store_id', 'product_id']
 
 # --- Config Functions ---
 def load_config(config_path: str) -> Dict:
@@ -12,59 +16,582 @@ def get_dataset_config(config: Dict, dataset_name: str) -> Dict:
     return config['datasets'].get(dataset_name)
 
 # --- Ingestion Functions ---
-def load_csv(data_dir: str, filename: str) -> pd.DataFrame:
+def load_csv(data_dir: str, filename: str, rules: Optional[Dict] = None, engine: str = "pandas") -> pd.DataFrame:
+    """
+    Reads a CSV. With a dataset config as rules, only its required_columns
+    are read, with the compact dtypes described under Typed Reading. engine
+    picks the parser (see CSV Engines).
+    """
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"Unknown CSV engine '{engine}'; expected one of {CSV_ENGINES}")
     path = os.path.join(data_dir, filename)
     if not os.path.exists(path):
         raise FileNotFoundError(f"File not found: {path}")
-    return pd.read_csv(path)
+    df = _read_csv_arrow(path, rules) if engine == "arrow" else None
+    if df is None:
+        df = pd.read_csv(path) if rules is None else pd.read_csv(path, **_typed_read_options(rules))
+    return df if rules is None else apply_types(df, rules)
 
-# --- Validation Functions ---
-def validate_data(df: pd.DataFrame, rules: Dict, master_products: set) -> Tuple[pd.DataFrame, pd.DataFrame]:
+def iter_csv_chunks(data_dir: str, filename: str, chunk_size: int,
+                    rules: Optional[Dict] = None) -> Iterator[pd.DataFrame]:
+    """
+    Streams a CSV in chunks of at most chunk_size rows, so peak memory
+    depends on the chunk size rather than the file size.
+    """
+    path = os.path.join(data_dir, filename)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"File not found: {path}")
+    options = _typed_read_options(rules) if rules is not None else {}
+    with pd.read_csv(path, chunksize=chunk_size, **options) as reader:
+        for chunk in reader:
+            yield chunk if rules is None else apply_types(chunk, rules)
+
+# --- CSV Engines ---
+# "pandas" is pandas' single-threaded C parser. "arrow" is pyarrow's
+# multi-threaded CSV reader over a memory-mapped file: blocks of
+# ARROW_BLOCK_BYTES are parsed in parallel (on pyarrow's CPU pool, see
+# pyarrow.set_cpu_count), and declared columns are read dictionary-encoded,
+# which become categoricals without a per-row Python string. Categories are
+# sorted and missing values are the pandas defaults, so the frame matches the
+# pandas engine's and apply_types and everything downstream are unchanged.
+# Without pyarrow, or for a file Arrow rejects, the pandas engine is used.
+CSV_ENGINES = ("pandas", "arrow")
+ARROW_BLOCK_BYTES = 4 << 20
+PANDAS_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+def _read_csv_arrow(path: str, rules: Optional[Dict] = None) -> Optional[pd.DataFrame]:
+    """The file read with pyarrow (untyped: declared columns as categoricals), or None to fall back."""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return None
+    include, column_types = None, {}
+    if rules is not None:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            header = next(csv.reader(f), [])
+        types = declared_types(rules)
+        # File order, and declared columns the file lacks are left out, as with usecols
+        include = [name for name in header if name in types]
+        column_types = {name: pa.dictionary(pa.int32(), pa.string()) for name in include}
+    read_options = pa_csv.ReadOptions(use_threads=True, block_size=ARROW_BLOCK_BYTES)
+    convert_options = pa_csv.ConvertOptions(include_columns=include, column_types=column_types,
+                                            null_values=PANDAS_NA_VALUES, strings_can_be_null=True)
+    try:
+        with pa.memory_map(path) as source:
+            table = pa_csv.read_csv(source, read_options=read_options, convert_options=convert_options)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return None
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.reorder_categories(df[col].cat.categories.sort_values())
+    return df
+
+def get_date_column(columns) -> Optional[str]:
+    if 'date' in columns:
+        return 'date'
+    if 'event_date' in columns:
+        return 'event_date'
+    return None
+
+def find_duplicate_keys(data_dir: str, filename: str, chunk_size: int,
+                        rules: Optional[Dict] = None) -> Optional[pd.MultiIndex]:
+    """
+    Pre-pass for chunked validation: counts (store, product, date) keys over the
+    whole file, reading only the key columns, and returns the keys seen more
+    than once. Memory is bounded by the number of distinct keys. Pass the
+    same rules as for iter_csv_chunks so the keys are typed like the chunks.
+    """
+    path = os.path.join(data_dir, filename)
+    header = pd.read_csv(path, nrows=0).columns
+    date_col = get_date_column(header)
+    if date_col is None or not all(x in header for x in KEY_COLUMNS):
+        return None
+
+    subset = KEY_COLUMNS + [date_col]
+    counts = None
+    options = {}
+    if rules is not None:
+        rules = {'required_columns': [c for c in rules.get('required_columns', []) if c['name'] in subset]}
+        options = _typed_read_options(rules)
+    with pd.read_csv(path, usecols=subset, chunksize=chunk_size, dtype=options.get('dtype')) as reader:
+        for chunk in reader:
+            if rules is not None:
+                # Plain values, so counts from chunks with different categories line up
+                chunk = apply_types(chunk, rules).drop(columns=TYPE_COLUMNS, errors='ignore')
+                chunk = chunk.astype({col: object for col in subset
+                                      if isinstance(chunk[col].dtype, pd.CategoricalDtype)})
+            chunk_counts = chunk.value_counts(subset=subset, sort=False, dropna=False)
+            counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+
+    if counts is None:
+        return None
+    return counts[counts > 1].index
+
+# --- Typed Reading ---
+# The "type" of each required column selects a compact in-memory dtype: string
+# columns (IDs) become categoricals, integers the narrowest int type that holds
+# the file's values, dates datetime64. Every column is first read as a
+# categorical, so each distinct raw value is parsed only once. Values that do
+# not parse as their declared type become missing and are flagged: their
+# reason bits in TYPE_CODE_COLUMN and their messages (with the raw value) in
+# TYPE_ERROR_COLUMN, which validate_data turns into the row's quarantine code
+# and detail.
+TYPE_ERROR_COLUMN = "_type_error"
+TYPE_CODE_COLUMN = "_type_code"
+TYPE_COLUMNS = [TYPE_ERROR_COLUMN, TYPE_CODE_COLUMN]
+INT_DTYPES = [(np.int8, "Int8"), (np.int16, "Int16"), (np.int32, "Int32"), (np.int64, "Int64")]
+
+def declared_types(rules: Dict) -> Dict[str, str]:
+    return {col['name']: col.get('type', 'string') for col in rules.get('required_columns', [])}
+
+def _typed_read_options(rules: Dict) -> Dict:
+    types = declared_types(rules)
+    return {"usecols": lambda name: name in types, "dtype": {name: "category" for name in types}}
+
+def _parse_categories(categories: pd.Index, type_name: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Parses distinct raw values. Returns (parsed values, failed mask)."""
+    raw = pd.Series(categories.astype(str))
+    if type_name == 'integer':
+        parsed = pd.to_numeric(raw, errors='coerce').astype(np.float64)
+        failed = parsed.isna() | (parsed % 1 != 0) | (parsed.abs() > np.iinfo(np.int64).max)
+    elif type_name == 'float':
+        parsed = pd.to_numeric(raw, errors='coerce').astype(np.float64)
+        failed = parsed.isna()
+    elif type_name == 'date':
+        parsed = pd.to_datetime(raw, format='ISO8601', errors='coerce')
+        failed = parsed.isna()
+    else:
+        raise ValueError(f"Unknown column type '{type_name}'")
+    return parsed.where(~failed).to_numpy(), failed.to_numpy()
+
+def _narrowest_int(values: np.ndarray) -> pd.Series:
+    present = values[~np.isnan(values)]
+    lo, hi = (present.min(), present.max()) if len(present) else (0, 0)
+    for numpy_type, nullable_type in INT_DTYPES:
+        info = np.iinfo(numpy_type)
+        if info.min <= lo and hi <= info.max:
+            break
+    if len(present) == len(values):
+        return pd.Series(values.astype(numpy_type))
+    return pd.Series(values).astype(nullable_type)
+
+def type_reason(col: str, type_name: str) -> str:
+    return f"{col} not a valid {type_name}"
+
+def apply_types(df: pd.DataFrame, rules: Dict) -> pd.DataFrame:
+    """Casts df's declared columns to their compact dtypes (see Typed Reading)."""
+    errors = flagged = None
+    for col, type_name in declared_types(rules).items():
+        if col not in df.columns:
+            continue
+        raw = df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype('category')
+        if type_name == 'string':
+            df[col] = raw
+            continue
+        parsed, failed = _parse_categories(raw.cat.categories, type_name)
+        codes = raw.cat.codes.to_numpy()
+        # Code -1 (missing) picks the appended missing value
+        missing = np.datetime64('NaT') if type_name == 'date' else np.nan
+        values = np.append(parsed, np.array([missing], dtype=parsed.dtype))[codes]
+        bad = np.append(failed, False)[codes]
+        if type_name == 'integer':
+            typed = _narrowest_int(values.astype(np.float64))
+        else:
+            typed = pd.Series(values)
+        df[col] = typed.set_axis(df.index)
+        if bad.any():
+            if errors is None:
+                reasons = reason_codes(rules)
+                errors = np.full(len(df), None, dtype=object)
+                flagged = np.zeros(len(df), dtype=reasons.dtype)
+            # Each message goes first: later columns' type errors are reported first
+            messages = [f"{type_reason(col, type_name)} ({value})" for value in raw[bad]]
+            errors[bad] = [message if previous is None else message + REASON_SEPARATOR + previous
+                           for message, previous in zip(messages, errors[bad])]
+            flagged[bad] |= reasons.code(type_reason(col, type_name))
+    if errors is not None:
+        df[TYPE_ERROR_COLUMN] = errors
+        df[TYPE_CODE_COLUMN] = flagged
+    return df
+
+# --- Rule Compilation ---
+# Column checks in schema_config.yaml are written either as "name_arg" strings
+# ("min_0", "max_1000", "prefix_S", "fk_stores.store_id") or as one-key
+# mappings ({regex: "^S[0-9]{3}$"}, {enum: [a, b]}). Each becomes a vectorized
+# predicate returning True where a row FAILS the check, and has a reason
+# text that depends on the config alone (see Quarantine Reasons).
+UNKNOWN_PRODUCT_REASON = "Unknown Product ID"
+DUPLICATE_REASON = "Duplicate Entry"
+ACCEPTED_KEY_REASON = "Key already accepted" # the key was accepted from another file (see key_index)
+
+def _parse_number(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+def _missing(series: pd.Series) -> pd.Series:
+    return series.isna()
+
+def isin_keys(series: pd.Series, keys) -> pd.Series:
+    """
+    series.isin(keys) for a set of keys, or for a key set with a vectorized
+    contains() (master_snapshot.KeySet), which sees each distinct value once.
+    """
+    if not hasattr(keys, 'contains'):
+        return series.isin(keys)
+    codes, uniques = pd.factorize(series)
+    hits = np.append(keys.contains(np.asarray(uniques, dtype=object)), False) # code -1 (missing) -> False
+    return pd.Series(hits[codes], index=series.index)
+
+def _build_min(col, arg, master_data):
+    bound = _parse_number(arg)
+    return lambda s: s < bound
+
+def _build_max(col, arg, master_data):
+    bound = _parse_number(arg)
+    return lambda s: s > bound
+
+def _build_prefix(col, arg, master_data):
+    return lambda s: _missing(s) | ~s.astype(str).str.startswith(str(arg))
+
+def _build_regex(col, arg, master_data):
+    return lambda s: _missing(s) | ~s.astype(str).str.fullmatch(str(arg))
+
+def _build_enum(col, arg, master_data):
+    allowed = set(arg) if isinstance(arg, (list, tuple, set)) else set(str(arg).split('|'))
+    return lambda s: ~s.isin(allowed)
+
+def _build_fk(col, arg, master_data):
+    if master_data is None or arg not in master_data:
+        raise ValueError(f"Check fk_{arg} on {col} needs master data '{arg}'")
+    keys = master_data[arg]
+    return lambda s: ~isin_keys(s, keys)
+
+CHECK_BUILDERS = {"min": _build_min, "max": _build_max, "prefix": _build_prefix,
+                  "regex": _build_regex, "enum": _build_enum, "fk": _build_fk}
+CHECK_REASONS = {"min": "{col} < {arg}", "max": "{col} > {arg}", "prefix": "{col} missing prefix {arg}",
+                 "regex": "{col} does not match {arg}", "enum": "{col} not in allowed values",
+                 "fk": "{col} not in {arg}"}
+
+def _parse_check(check) -> Tuple[str, object]:
+    if isinstance(check, dict):
+        if len(check) != 1:
+            raise ValueError(f"Check must have exactly one key: {check}")
+        return next(iter(check.items()))
+    name, _, arg = str(check).partition('_')
+    return name, arg
+
+def check_reason(col: str, check) -> str:
+    """The reason text of a configured column check. Unknown check names raise."""
+    name, arg = _parse_check(check)
+    if name not in CHECK_BUILDERS:
+        raise ValueError(f"Unknown check '{check}' on column {col}")
+    return CHECK_REASONS[name].format(col=col, arg=arg)
+
+class ValidationPlan:
     """
-    Splits input df into valid_df and quarantine_df based on rules.
+    A dataset's rules compiled once into vectorized checks and its reason
+    dictionary, then reused for every file (or chunk) of that dataset.
     """
-    df['quarantine_reason'] = None
-    
-    # We'll use a mask to track invalid rows
-    # True = Invalid/Quarantine
-    quarantine_mask = pd.Series([False] * len(df))
+    def __init__(self, column_checks: List[Tuple[str, str, Callable]], master_products: Optional[set],
+                 reasons: "ReasonCodes"):
+        self.column_checks = column_checks # (column, reason, predicate) in config order
+        self.master_products = master_products
+        self.reasons = reasons
 
-    # Check: Negative Stock / Min Value
+def compile_rules(rules: Dict, master_products: Optional[set] = None,
+                  master_data: Optional[Dict[str, set]] = None) -> ValidationPlan:
+    """
+    Compiles a dataset config into a ValidationPlan. master_data maps
+    "table.column" names (e.g. "stores.store_id") to key sets for fk checks.
+    Unknown check names raise instead of being silently skipped.
+    """
+    column_checks = []
     for col in rules.get('required_columns', []):
-        col_name = col['name']
-        checks = col.get('checks', [])
-        
-        if col_name not in df.columns:
-            continue 
-
-        if "min_0" in checks:
-            is_negative = df[col_name] < 0
-            df.loc[is_negative, 'quarantine_reason'] = f"{col_name} < 0"
-            quarantine_mask |= is_negative
-
-        if "max_1000" in checks: # Example logical max
-            is_huge = df[col_name] > 1000
-            df.loc[is_huge, 'quarantine_reason'] = f"{col_name} > 1000"
-            quarantine_mask |= is_huge
+        for check in col.get('checks', []):
+            reason = check_reason(col['name'], check)
+            name, arg = _parse_check(check)
+            column_checks.append((col['name'], reason, CHECK_BUILDERS[name](col['name'], arg, master_data)))
+    return ValidationPlan(column_checks, master_products, reason_codes(rules))
+
+# --- Quarantine Reasons ---
+# A quarantined row's reasons are a bitmask in QUARANTINE_CODE: bit i is set
+# when the row failed reason i of its dataset's ReasonCodes, a dictionary
+# derived from the dataset config. Every failing check is kept, in a 1-8 byte
+# integer instead of an object string per row; per-reason counts are bit
+# tests, and reconciliation takes the rows whose code is exactly
+# UNKNOWN_PRODUCT_CODE (failing on nothing but their product ID). Reasons
+# shared by every dataset have fixed bits.
+#
+# Codes are decoded into quarantine_reason text only when the quarantine is
+# written: the row's reasons in priority order (type errors, column checks
+# from the last one back, unknown product, duplicates) joined by
+# REASON_SEPARATOR, so the first is the one a row used to report alone. Type
+# errors and keys accepted from another file carry row-specific text (the raw
+# value, the file that owns the key) in QUARANTINE_DETAIL, which stands in
+# for their reasons' text.
+QUARANTINE_CODE = "quarantine_code"
+QUARANTINE_DETAIL = "quarantine_detail"
+REASON_SEPARATOR = "; "
+FIXED_REASONS = [UNKNOWN_PRODUCT_REASON, DUPLICATE_REASON, ACCEPTED_KEY_REASON]
+UNKNOWN_PRODUCT_CODE, DUPLICATE_CODE, ACCEPTED_KEY_CODE = 1, 2, 4
+CODE_DTYPES = [np.uint8, np.uint16, np.uint32, np.uint64]
+
+class ReasonCodes:
+    """
+    A reason dictionary: the fixed reasons, then a dataset's own in priority
+    order, each owning one bit. Reasons in detailed take their text from the
+    row's detail when it has one.
+    """
+    def __init__(self, reasons: List[str], detailed: Optional[List[str]] = None):
+        self.reasons = FIXED_REASONS + [r for r in dict.fromkeys(reasons) if r not in FIXED_REASONS]
+        if len(self.reasons) > 64:
+            raise ValueError(f"{len(self.reasons)} quarantine reasons do not fit a 64-bit code")
+        self.dtype = next(dtype for dtype in CODE_DTYPES if np.iinfo(dtype).bits >= len(self.reasons))
+        self.bits = {reason: bit for bit, reason in enumerate(self.reasons)}
+        self.order = list(range(len(FIXED_REASONS), len(self.reasons))) + list(range(len(FIXED_REASONS)))
+        self.detailed = ACCEPTED_KEY_CODE
+        for reason in detailed or []:
+            self.detailed |= self.code(reason)
+
+    def code(self, reason: str) -> int:
+        return 1 << self.bits[reason]
+
+    def counts(self, code_counts: Dict[int, int]) -> Dict[str, int]:
+        """Rows per reason from rows per distinct code; a row counts once for each of its reasons."""
+        codes = np.fromiter(code_counts.keys(), dtype=np.uint64, count=len(code_counts))
+        rows = np.fromiter(code_counts.values(), dtype=np.int64, count=len(code_counts))
+        counts = {}
+        for bit, reason in enumerate(self.reasons):
+            count = int(rows[(codes >> np.uint64(bit)) & np.uint64(1) == 1].sum())
+            if count:
+                counts[reason] = count
+        return counts
+
+    def text(self, code: int, detail: Optional[str] = None) -> Optional[str]:
+        if not code:
+            return None
+        parts = []
+        for bit in self.order:
+            if not code >> bit & 1:
+                continue
+            if detail is not None and self.detailed >> bit & 1:
+                # One detail stands for all of the row's detailed reasons
+                if detail not in parts:
+                    parts.append(detail)
+            else:
+                parts.append(self.reasons[bit])
+        return REASON_SEPARATOR.join(parts)
+
+    def decode(self, codes: np.ndarray, details: Optional[np.ndarray] = None) -> np.ndarray:
+        """The reason text of each code (None for 0). Each distinct code is spelled out once."""
+        codes = np.asarray(codes).astype(np.uint64)
+        uniques, inverse = np.unique(codes, return_inverse=True)
+        texts = np.array([self.text(int(code)) for code in uniques], dtype=object)[inverse]
+        if details is not None:
+            details = np.asarray(details, dtype=object)
+            rows = np.flatnonzero((codes & np.uint64(self.detailed) != 0) & pd.notna(details))
+            texts[rows] = [self.text(int(codes[row]), details[row]) for row in rows]
+        return texts
+
+def reason_codes(rules: Dict) -> ReasonCodes:
+    """The reason dictionary of a dataset config (see Quarantine Reasons)."""
+    typed = [type_reason(col, type_name) for col, type_name in declared_types(rules).items() if type_name != 'string']
+    checks = [check_reason(col['name'], check) for col in rules.get('required_columns', [])
+              for check in col.get('checks', [])]
+    return ReasonCodes(typed[::-1] + checks[::-1], detailed=typed)
+
+# --- Validation Functions ---
+def validate_data(df: pd.DataFrame, rules, master_products: Optional[set] = None,
+                  duplicate_keys: Optional[pd.MultiIndex] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Splits input df into valid_df and quarantine_df based on rules, which is
+    either a ValidationPlan or a raw dataset config (compiled on the fly).
+    When df is one chunk of a larger file, pass the file-wide duplicate_keys
+    (see find_duplicate_keys) so duplicates spanning chunks are still caught.
+    Quarantined rows carry their reasons as QUARANTINE_CODE (and, with type
+    errors, QUARANTINE_DETAIL); see Quarantine Reasons.
+    """
+    plan = rules if isinstance(rules, ValidationPlan) else compile_rules(rules, master_products)
+
+    # Every check sets its reason's bit in the row's code (see Quarantine
+    # Reasons), starting from the type errors apply_types found.
+    reasons = plan.reasons
+    code = np.zeros(len(df), dtype=reasons.dtype)
+    if TYPE_CODE_COLUMN in df.columns:
+        code |= df.pop(TYPE_CODE_COLUMN).to_numpy(dtype=reasons.dtype)
+    details = df.pop(TYPE_ERROR_COLUMN).to_numpy() if TYPE_ERROR_COLUMN in df.columns else None
+    for col_name, reason, predicate in plan.column_checks:
+        if col_name in df.columns:
+            code[predicate(df[col_name]).fillna(False).to_numpy(dtype=bool)] |= reasons.code(reason)
 
     # Check: Master Data Validation (Product ID logic)
-    if 'product_id' in df.columns:
-        is_unknown = ~df['product_id'].isin(master_products)
-        new_unknowns = is_unknown & (~quarantine_mask)
-        df.loc[new_unknowns, 'quarantine_reason'] = "Unknown Product ID"
-        quarantine_mask |= is_unknown
+    if 'product_id' in df.columns and plan.master_products is not None:
+        code[~isin_keys(df['product_id'], plan.master_products).to_numpy()] |= UNKNOWN_PRODUCT_CODE
 
     # Check: Duplicates (Store + Product + Date)
-    if all(x in df.columns for x in ['store_id', 'product_id']):
-        date_col = 'date' if 'date' in df.columns else 'event_date'
-        if date_col in df.columns:
-            subset = ['store_id', 'product_id', date_col]
-            is_dup = df.duplicated(subset=subset, keep=False) 
-            new_dups = is_dup & (~quarantine_mask)
-            df.loc[new_dups, 'quarantine_reason'] = "Duplicate Entry"
-            quarantine_mask |= is_dup
-
-    quarantine_df = df[quarantine_mask].copy()
-    valid_df = df[~quarantine_mask].copy()
-    
+    if all(x in df.columns for x in KEY_COLUMNS):
+        date_col = get_date_column(df.columns)
+        if date_col is not None:
+            subset = KEY_COLUMNS + [date_col]
+            if duplicate_keys is not None:
+                is_dup = pd.MultiIndex.from_frame(df[subset]).isin(duplicate_keys)
+            else:
+                is_dup = df.duplicated(subset=subset, keep=False).to_numpy()
+            code[is_dup] |= DUPLICATE_CODE
+
+    # Valid rows keep an empty reason column, which reconciled rows fill in
+    quarantine_mask = code != 0
+    quarantine_df = df[quarantine_mask].assign(**{QUARANTINE_CODE: code[quarantine_mask]})
+    if details is not None:
+        quarantine_df[QUARANTINE_DETAIL] = details[quarantine_mask]
+    valid_df = df[~quarantine_mask].assign(quarantine_reason=None)
+
     return valid_df, quarantine_df
+
+# --- Aggregation Functions ---
+# With per_date=True the aggregates keep one row per (store, product, day)
+# instead of per (store, product). That history is what the as-of engine
+# below needs; it is still far smaller than the raw rows.
+def latest_per_key(df: Optional[pd.DataFrame], date_col: str = 'date',
+                   per_date: bool = False) -> Optional[pd.DataFrame]:
+    """
+    Latest snapshot row per (store, product). Ties on date keep the row that
+    came last in input order, so results are deterministic.
+    """
+    if df is None:
+        return None
+    keys = KEY_COLUMNS + [date_col] if per_date else KEY_COLUMNS
+    return df.sort_values(date_col, kind='stable').groupby(keys, observed=True, dropna=False).tail(1)
+
+def sum_per_key(df: pd.DataFrame, qty_col: str, per_date: bool = False) -> pd.DataFrame:
+    # Quantities may be read as narrow ints; total them as int64 so sums cannot overflow
+    quantities = df[qty_col].astype('Int64') if df[qty_col].dtype.kind in 'iu' else df[qty_col]
+    keys = KEY_COLUMNS + [get_date_column(df.columns)] if per_date else KEY_COLUMNS
+    totals = quantities.groupby([df[col] for col in keys], observed=True, dropna=False).sum()
+    return totals.reset_index()
+
+def combine_latest(running: Optional[pd.DataFrame], new: Optional[pd.DataFrame],
+                   date_col: str = 'date', per_date: bool = False) -> Optional[pd.DataFrame]:
+    """Folds a new batch of snapshot rows into a running latest-per-key frame."""
+    if running is None or new is None:
+        return latest_per_key(new if running is None else running, date_col, per_date)
+    return latest_per_key(pd.concat([running, new], ignore_index=True), date_col, per_date)
+
+def combine_sums(running: Optional[pd.DataFrame], new: pd.DataFrame, qty_col: str,
+                 per_date: bool = False) -> pd.DataFrame:
+    """Folds per-key partial sums into running per-key totals."""
+    if running is None:
+        return new
+    return sum_per_key(pd.concat([running, new], ignore_index=True), qty_col, per_date)
+
+# --- As-of Effective Stock ---
+# A snapshot is the opening count of its day, so events dated on or after a
+# key's snapshot date move its stock and earlier events are already counted.
+# Daily event totals are sorted by (key, day) with running sums, so the events
+# between any two days cost two binary searches per key; snapshots are indexed
+# the same way to find each key's latest snapshot on or before a date.
+DAY_BITS = 32 # Low bits of the packed (key, day) sort key hold the day
+DAY_OFFSET = 1 << 31 # Shifts day numbers (days since 1970, may be negative) to >= 0
+
+def _day_numbers(dates: pd.Series) -> np.ndarray:
+    """Days since 1970 as int64; missing dates sort before every real day."""
+    days = pd.to_datetime(dates).to_numpy(dtype='datetime64[D]')
+    numbers = days.astype(np.int64)
+    numbers[np.isnat(days)] = -DAY_OFFSET
+    return np.clip(numbers, -DAY_OFFSET, DAY_OFFSET - 1)
+
+def _packed(codes: np.ndarray, days: np.ndarray) -> np.ndarray:
+    return (codes.astype(np.int64) << DAY_BITS) + (days + DAY_OFFSET)
+
+class EventIndex:
+    """Daily totals of one event quantity, searchable by key and day range."""
+    def __init__(self, daily_totals: pd.DataFrame, qty_col: str, key_index: pd.MultiIndex):
+        codes = key_index.get_indexer(pd.MultiIndex.from_frame(daily_totals[KEY_COLUMNS]))
+        known = codes >= 0 # events for keys without any snapshot never reach the fact table
+        date_col = get_date_column(daily_totals.columns)
+        packed = _packed(codes[known], _day_numbers(daily_totals[date_col])[known])
+        order = np.argsort(packed, kind='stable')
+        quantities = daily_totals[qty_col].fillna(0).to_numpy(dtype=np.int64)[known][order]
+        self.packed = packed[order]
+        self.cumulative = np.concatenate([[0], np.cumsum(quantities)])
+
+    def range_sum(self, codes: np.ndarray, first_days: np.ndarray, last_days: np.ndarray) -> np.ndarray:
+        """Total quantity per key over the inclusive day range [first, last]."""
+        lo = np.searchsorted(self.packed, _packed(codes, first_days), side='left')
+        hi = np.searchsorted(self.packed, _packed(codes, last_days), side='right')
+        return self.cumulative[hi] - self.cumulative[lo]
+
+class AsOfStockEngine:
+    """
+    Effective stock per (store, product) as of any date, from the snapshot
+    history (latest row per key and day, see latest_per_key(per_date=True))
+    and daily restock and damaged totals (sum_per_key(per_date=True)).
+    """
+    def __init__(self, snapshots: pd.DataFrame, stock_additions: Optional[pd.DataFrame] = None,
+                 stock_deductions: Optional[pd.DataFrame] = None):
+        self.snapshots = snapshots.reset_index(drop=True)
+        keys = pd.MultiIndex.from_frame(self.snapshots[KEY_COLUMNS])
+        self.key_index = keys.unique()
+        codes = self.key_index.get_indexer(keys)
+        self.days = _day_numbers(self.snapshots['date'])
+        # Stable, so same-day rows keep input order and the last one is the latest
+        order = np.argsort(_packed(codes, self.days), kind='stable')
+        self.snap_packed = _packed(codes, self.days)[order]
+        self.snap_rows = order
+        self.events = {}
+        for totals, qty_col in ((stock_additions, 'restock_qty'), (stock_deductions, 'damaged_qty')):
+            if totals is not None and not totals.empty:
+                self.events[qty_col] = EventIndex(totals, qty_col, self.key_index)
+
+    def _latest_rows(self, as_of_day: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(snapshot row, key code) of each key's latest snapshot on or before the day."""
+        codes = np.arange(len(self.key_index), dtype=np.int64)
+        pos = np.searchsorted(self.snap_packed, _packed(codes, np.full(len(codes), as_of_day)), side='right') - 1
+        found = pos >= 0
+        found[found] = (self.snap_packed[pos[found]] >> DAY_BITS) == codes[found]
+        rows = self.snap_rows[pos[found]]
+        # Row order of latest_per_key: by snapshot date (missing last), then input order
+        sort_days = np.where(self.days[rows] == -DAY_OFFSET, DAY_OFFSET, self.days[rows])
+        order = np.lexsort((rows, sort_days))
+        return rows[order], codes[found][order]
+
+    def effective_stock(self, as_of=None) -> pd.DataFrame:
+        """
+        Gold formula: Snapshot + Restock - Damaged, per (store, product), using
+        each key's latest snapshot on or before as_of and the events dated from
+        that snapshot's day through as_of. as_of=None uses all data and gives
+        the current position; with a date, an as_of_date column is added.
+        """
+        as_of_day = DAY_OFFSET - 1 if as_of is None else int(_day_numbers(pd.Series([as_of]))[0])
+        rows, codes = self._latest_rows(as_of_day)
+        merged = self.snapshots.iloc[rows].reset_index(drop=True)
+        last_days = np.full(len(rows), as_of_day)
+        for qty_col in ('restock_qty', 'damaged_qty'):
+            index = self.events.get(qty_col)
+            merged[qty_col] = index.range_sum(codes, self.days[rows], last_days) if index else 0
+        merged['effective_stock'] = merged['quantity'] + merged['restock_qty'] - merged['damaged_qty']
+        if as_of is not None:
+            merged.insert(0, 'as_of_date', pd.Timestamp(as_of))
+        return merged
+
+    def history(self, dates) -> pd.DataFrame:
+        """Effective stock as of each date, stacked; the indexes are built once for all dates."""
+        frames = [self.effective_stock(day) for day in dates]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def latest_date(self) -> Optional[pd.Timestamp]:
+        latest = pd.to_datetime(self.snapshots['date']).max()
+        return None if pd.isna(latest) else latest
+
+def compute_effective_stock(latest_inventory: pd.DataFrame,
+                            stock_additions: Optional[pd.DataFrame],
+                            stock_deductions: Optional[pd.DataFrame], as_of=None) -> pd.DataFrame:
+    """
+    Gold formula: Snapshot + Restock - Damaged, per (store, product). Takes
+    snapshot rows (latest per key, or the per-day history) and daily event
+    totals; see AsOfStockEngine.
+    """
+    return AsOfStockEngine(latest_inventory, stock_additions, stock_deductions).effective_stock(as_of)
@@ -1,10 +1,118 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
 import pandas as pd
+from typing import Dict, Iterable, List, Optional, Tuple
 from rapidfuzz import process, fuzz
+from candidate_index import CandidateIndex
+from pipeline_core import QUARANTINE_CODE, QUARANTINE_DETAIL, UNKNOWN_PRODUCT_CODE
+
+MATCH_THRESHOLD = 90 # Threshold from architecture
+MAX_SCORE_CELLS = 8_000_000 # Bounds the score matrix built per cdist call
+INDEX_MIN_MASTER_IDS = 20_000 # Below this, brute-force cdist is faster than blocking
+
+CACHE_MAX_ENTRIES = 100_000
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+def master_version(master_ids: List[str]) -> str:
+    """Content version of the master ID list; any catalog change yields a new one."""
+    return hashlib.sha256("\n".join(sorted(map(str, master_ids))).encode()).hexdigest()[:16]
+
+class MatchCache:
+    """
+    Persistent memo of bad_id -> (resolved_id, score) across runs. Misses are
+    cached too (resolved_id None), so IDs that never match are not re-scored.
+    Entries are tagged with the master-data version and dropped when it
+    changes; beyond that they expire after ttl_seconds and the least recently
+    used are evicted past max_entries.
+    """
+    def __init__(self, path: str, version: str, max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = {}
+        self.updates = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            stored = json.load(f)
+        if stored.get("version") != self.version:
+            return # Master data changed since the cache was written
+        cutoff = time.time() - self.ttl_seconds
+        self.entries = {k: v for k, v in stored.get("entries", {}).items() if v["created"] >= cutoff}
+
+    def get(self, bad_id: str) -> Optional[Tuple[Optional[str], float]]:
+        entry = self.entries.get(bad_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry["last_used"] = time.time()
+        self.updates[bad_id] = entry # a worker's hits must reach the parent, or eviction sees stale uses
+        return entry["resolved_id"], entry["score"]
+
+    def put(self, bad_id: str, resolved_id: Optional[str], score: float):
+        now = time.time()
+        entry = {"resolved_id": resolved_id, "score": score, "created": now, "last_used": now}
+        self.entries[bad_id] = entry
+        self.updates[bad_id] = entry
+
+    def drain(self) -> Tuple[Dict, int, int]:
+        """Hands over new and used entries and counters (used to ship them back from pool workers)."""
+        drained = (self.updates, self.hits, self.misses)
+        self.updates, self.hits, self.misses = {}, 0, 0
+        return drained
+
+    def absorb(self, updates: Dict, hits: int, misses: int):
+        """Merges entries drained from another cache, keeping the latest use of each."""
+        for bad_id, entry in updates.items():
+            current = self.entries.get(bad_id)
+            if current is not None and current["last_used"] > entry["last_used"]:
+                entry = {**entry, "last_used": current["last_used"]}
+            self.entries[bad_id] = entry
+        self.hits += hits
+        self.misses += misses
+
+    def save(self):
+        entries = self.entries
+        if len(entries) > self.max_entries:
+            keep = sorted(entries, key=lambda k: entries[k]["last_used"], reverse=True)[:self.max_entries]
+            entries = {k: entries[k] for k in keep}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"version": self.version, "entries": entries}, f)
+        os.replace(tmp, self.path)
+        self.entries = entries
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = (self.hits / lookups * 100) if lookups else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), {len(self.entries)} entries"
 
 class ReconciliationEngine:
-    def __init__(self, master_products_df: pd.DataFrame):
-        self.master_products_map = dict(zip(master_products_df['product_id'], master_products_df['product_name']))
-        self.master_ids = list(self.master_products_map.keys())
+    def __init__(self, master_products, cache_path: Optional[str] = None,
+                 index_path: Optional[str] = None, use_index: Optional[bool] = None):
+        # master_products: the products frame, or a master_snapshot.MasterSnapshot with the IDs and version prebuilt
+        if isinstance(master_products, pd.DataFrame):
+            self.master_ids = list(dict.fromkeys(master_products['product_id']))
+            version = master_version(self.master_ids)
+        else:
+            self.master_ids = master_products.master_ids
+            version = master_products.version
+        self.cache = MatchCache(cache_path, version) if cache_path else None
+        if use_index is None:
+            use_index = len(self.master_ids) >= INDEX_MIN_MASTER_IDS
+        self.index = self._load_index(index_path, f"{version}:{MATCH_THRESHOLD}") if use_index else None
         # We might need to match against master IDs or Names? 
         # Typically data has IDs. If ID is "P0O05" (typo), we want to match P0005.
         # But "P0O05" is a string. "P0005" is a string.
@@ -20,26 +128,91 @@ class ReconciliationEngine:
         if quarantine_df.empty:
             return pd.DataFrame()
 
-        # Filter only Unknown Product ID errors
-        params = quarantine_df['quarantine_reason'] == "Unknown Product ID"
-        to_check = quarantine_df[params].copy()
+        # Filter only rows failing on nothing but their Product ID
+        params = quarantine_df[QUARANTINE_CODE] == UNKNOWN_PRODUCT_CODE
+        to_check = quarantine_df[params].drop(columns=[QUARANTINE_CODE, QUARANTINE_DETAIL], errors='ignore')
         
         if to_check.empty:
             return pd.DataFrame()
 
-        recovered_rows = []
-        
-        for index, row in to_check.iterrows():
-            bad_id = row['product_id']
-            # Fuzzy match bad_id against all master_ids
-            # rapidfuzz.process.extractOne returns (match, score, index)
-            match = process.extractOne(bad_id, self.master_ids, scorer=fuzz.ratio)
-            
+        # Score each distinct bad ID once, then broadcast the result to its rows
+        matches = self.match_ids(to_check['product_id'].dropna().unique())
+        if not matches:
+            return pd.DataFrame()
+
+        bad_ids = to_check['product_id']
+        recovered = to_check[bad_ids.isin(matches.keys())].copy()
+        bad_ids = recovered['product_id']
+        reasons = {bad_id: f"Fixed (Fuzzy Match: {bad_id} -> {best_id}, Score: {score})"
+                   for bad_id, (best_id, score) in matches.items()}
+        recovered['product_id'] = bad_ids.map({bad_id: m[0] for bad_id, m in matches.items()})
+        recovered['quarantine_reason'] = bad_ids.map(reasons)
+        return recovered
+
+    def match_ids(self, bad_ids: Iterable) -> Dict[str, Tuple[str, float]]:
+        """
+        Resolves distinct unknown IDs against the master list in one
+        vectorized cdist call. Returns {bad_id: (best_id, score)} for IDs whose
+        best score reaches MATCH_THRESHOLD; ties go to the first master ID,
+        as with extractOne.
+        """
+        bad_ids = [b for b in bad_ids if isinstance(b, str)]
+        if not bad_ids or not self.master_ids:
+            return {}
+
+        matches = {}
+        if self.cache is not None:
+            unseen = []
+            for bad_id in bad_ids:
+                cached = self.cache.get(bad_id)
+                if cached is None:
+                    unseen.append(bad_id)
+                elif cached[0] is not None:
+                    matches[bad_id] = cached
+            bad_ids = unseen
+
+        scored = self._score(bad_ids)
+        if self.cache is not None:
+            for bad_id in bad_ids:
+                best_id, score = scored.get(bad_id, (None, 0.0))
+                self.cache.put(bad_id, best_id, score)
+        matches.update(scored)
+        return matches
+
+    def _load_index(self, index_path: Optional[str], version: str) -> CandidateIndex:
+        index = CandidateIndex.load(index_path, version) if index_path else None
+        if index is None:
+            index = CandidateIndex.build(self.master_ids, MATCH_THRESHOLD)
+            if index_path:
+                index.save(index_path, version)
+        self._master_array = np.array(self.master_ids, dtype=object)
+        return index
+
+    def _score(self, bad_ids: List[str]) -> Dict[str, Tuple[str, float]]:
+        if self.index is not None:
+            return self._score_indexed(bad_ids)
+        matches = {}
+        batch = max(1, MAX_SCORE_CELLS // len(self.master_ids))
+        for start in range(0, len(bad_ids), batch):
+            queries = bad_ids[start:start + batch]
+            scores = process.cdist(queries, self.master_ids, scorer=fuzz.ratio,
+                                   score_cutoff=MATCH_THRESHOLD, dtype=np.float64, workers=-1)
+            best = scores.argmax(axis=1)
+            best_scores = scores[np.arange(len(queries)), best]
+            for i in np.flatnonzero(best_scores >= MATCH_THRESHOLD):
+                matches[queries[i]] = (self.master_ids[best[i]], float(best_scores[i]))
+        return matches
+
+    def _score_indexed(self, bad_ids: List[str]) -> Dict[str, Tuple[str, float]]:
+        # Only the blocked candidates are scored; they come back in master-list
+        # order, so extractOne breaks ties exactly like the full scan.
+        matches = {}
+        for bad_id in bad_ids:
+            candidates = self.index.candidates(bad_id)
+            if len(candidates) == 0:
+                continue
+            match = process.extractOne(bad_id, self._master_array[candidates].tolist(),
+                                       scorer=fuzz.ratio, score_cutoff=MATCH_THRESHOLD)
             if match:
-                best_id, score, _ = match
-                if score >= 90: # Threshold from architecture
-                     row['product_id'] = best_id
-                     row['quarantine_reason'] = f"Fixed (Fuzzy Match: {bad_id} -> {best_id}, Score: {score})"
-                     recovered_rows.append(row)
-        
-        return pd.DataFrame(recovered_rows)
+                matches[bad_id] = (match[0], float(match[1]))
+        return matches
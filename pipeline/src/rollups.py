@@ -0,0 +1,87 @@
+import os
+import json
+from datetime import datetime, timezone
+import pandas as pd
+from typing import Dict, Optional
+from metrics import reason_groups
+
+# --- Dashboard Rollups ---
+# The dashboard's headline metrics and summary charts read this small JSON
+# artifact, written by every pipeline run next to the fact table, instead of
+# the fact table and quarantine ledger themselves. A page load then costs the
+# same however large those grow. The dashboard keys its cache on the file's
+# mtime, so a new run shows up on the next load; a rollup written by another
+# ROLLUP_VERSION is ignored rather than misread.
+ROLLUP_VERSION = 1
+ROLLUP_FILE = "dashboard_rollup.json"
+FACT_COLUMNS = ['store_id', 'product_id', 'restock_qty', 'damaged_qty', 'effective_stock']
+QUANTITY_COLUMNS = ['effective_stock', 'restock_qty', 'damaged_qty']
+
+def _group_totals(fact: pd.DataFrame, by: str) -> list:
+    grouped = fact.groupby(by, observed=True, sort=True)
+    totals = grouped[QUANTITY_COLUMNS].sum()
+    totals.insert(0, 'skus', grouped['product_id'].nunique())
+    return [{by: key, **{col: int(value) for col, value in row.items()}}
+            for key, row in totals.iterrows()]
+
+def build_rollup(fact: pd.DataFrame, quarantine: pd.DataFrame, products_df: Optional[pd.DataFrame] = None,
+                 run_id: Optional[str] = None) -> Dict:
+    """
+    Totals, per-store and per-category aggregates of the fact table, and
+    quarantine counts by reason group. fact needs FACT_COLUMNS, quarantine
+    only quarantine_reason; products_df supplies categories when it has them.
+    """
+    fact = fact.reindex(columns=FACT_COLUMNS)
+    for col in QUANTITY_COLUMNS:
+        fact[col] = pd.to_numeric(fact[col], errors='coerce').fillna(0)
+    valid_count, quarantine_count = len(fact), len(quarantine)
+    processed = valid_count + quarantine_count
+
+    by_category = []
+    if products_df is not None and 'category' in products_df.columns:
+        categories = products_df.drop_duplicates('product_id').set_index('product_id')['category']
+        by_category = _group_totals(fact.assign(category=fact['product_id'].map(categories).fillna("Unknown")),
+                                    'category')
+
+    reasons = {}
+    if quarantine_count:
+        counts = reason_groups(quarantine['quarantine_reason']).value_counts()
+        reasons = {reason: int(count) for reason, count in counts.items()}
+
+    return {
+        "version": ROLLUP_VERSION,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "run_id": run_id,
+        "fact_rows": valid_count,
+        "quarantine_rows": quarantine_count,
+        "quality_score": round(valid_count / processed * 100, 4) if processed else None,
+        "totals": {
+            "effective_stock": int(fact['effective_stock'].sum()),
+            "restock_qty": int(fact['restock_qty'].sum()),
+            "damaged_qty": int(fact['damaged_qty'].sum()),
+            "active_skus": int(fact['product_id'].nunique()),
+            "stores": int(fact['store_id'].nunique()),
+        },
+        "by_store": _group_totals(fact, 'store_id') if valid_count else [],
+        "by_category": by_category,
+        "quarantine_by_reason": reasons,
+    }
+
+def write_rollup(path: str, rollup: Dict):
+    """Writes the rollup and swaps it in, so the dashboard never reads a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(rollup, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+def load_rollup(path: str) -> Optional[Dict]:
+    """The rollup at path, or None when it is missing, unreadable or from another ROLLUP_VERSION."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            rollup = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return rollup if rollup.get("version") == ROLLUP_VERSION else None
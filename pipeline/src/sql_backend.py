@@ -0,0 +1,386 @@
+import os
+import re
+import sqlite3
+import pandas as pd
+from typing import Dict, Iterator, List, Optional, Tuple
+from pipeline_core import (KEY_COLUMNS, UNKNOWN_PRODUCT_CODE, DUPLICATE_CODE, QUARANTINE_CODE, QUARANTINE_DETAIL,
+                           REASON_SEPARATOR, declared_types, get_date_column, check_reason, reason_codes,
+                           type_reason, _parse_check, _parse_number, _parse_categories)
+
+# --- SQL Execution Backend ---
+# Runs the config-driven validation, quarantine split and effective-stock
+# aggregation as SQL in an embedded SQLite database file. Raw CSVs are streamed
+# into it in chunks and SQLite sorts, groups and joins on disk, so memory stays
+# flat however large the input. Results match the pandas path row for row:
+# values are parsed by the same typed-reading rules (once per distinct value),
+# checks set the same reason codes as validate_data, and ties keep input order.
+LOAD_CHUNK_ROWS = 100_000
+FETCH_ROWS = 50_000
+CACHE_KB = 16 * 2**10 # SQLite page cache, which also caps in-memory sorts; larger ones spill to temp files
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S" # Fixed width, so text order is date order
+PRAGMAS = ["PRAGMA journal_mode=OFF", "PRAGMA synchronous=OFF", "PRAGMA temp_store=FILE",
+           f"PRAGMA cache_size=-{CACHE_KB}"]
+
+def _q(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _literal(value) -> str:
+    if isinstance(value, bool) or value is None:
+        raise ValueError(f"Unsupported literal in check: {value!r}")
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _fullmatch(pattern, value):
+    return value is not None and re.fullmatch(pattern, value) is not None
+
+def _py_values(series: pd.Series) -> list:
+    return [None if pd.isna(v) else v for v in series.tolist()]
+
+# SQL forms of the CHECK_BUILDERS predicates: true where a row FAILS the check.
+# NULL results count as passing, like the pandas masks after fillna(False).
+def _sql_min(col, arg, tables):
+    return f"{col} < {_literal(_parse_number(arg))}"
+
+def _sql_max(col, arg, tables):
+    return f"{col} > {_literal(_parse_number(arg))}"
+
+def _sql_prefix(col, arg, tables):
+    return f"{col} IS NULL OR substr(CAST({col} AS TEXT), 1, {len(str(arg))}) != {_literal(str(arg))}"
+
+def _sql_regex(col, arg, tables):
+    return f"{col} IS NULL OR NOT regexp_fullmatch({_literal(str(arg))}, CAST({col} AS TEXT))"
+
+def _sql_enum(col, arg, tables):
+    allowed = list(arg) if isinstance(arg, (list, tuple, set)) else str(arg).split('|')
+    return f"{col} IS NULL OR {col} NOT IN ({', '.join(_literal(v) for v in allowed)})"
+
+def _sql_fk(col, arg, tables):
+    return f"{col} IS NULL OR {col} NOT IN (SELECT key FROM {tables[arg]})"
+
+SQL_CHECKS = {"min": _sql_min, "max": _sql_max, "prefix": _sql_prefix,
+              "regex": _sql_regex, "enum": _sql_enum, "fk": _sql_fk}
+
+class SqlBackend:
+    """
+    One run's working database. Per dataset: raw_<ds> holds the raw text of
+    the declared columns, checked_<ds> the typed rows with their quarantine
+    code (0 when valid) and detail. _file and _row record input order. The
+    database file is deleted on close.
+    """
+    def __init__(self, db_path: str, master_data: Dict[str, set]):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.create_function("regexp_fullmatch", 2, _fullmatch, deterministic=True)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        self.master_data = master_data
+        self.master_tables = {}
+        for i, (name, keys) in enumerate(master_data.items()):
+            table = f"master_{i}"
+            self.conn.execute(f"CREATE TABLE {table} (key PRIMARY KEY)")
+            self.conn.executemany(f"INSERT OR IGNORE INTO {table} VALUES (?)",
+                                  ((k,) for k in keys if not pd.isna(k)))
+            self.master_tables[name] = table
+        self.columns: Dict[str, List[str]] = {} # loaded columns per dataset, in file order
+        self.types: Dict[str, str] = {"quarantine_reason": "string", QUARANTINE_CODE: "integer",
+                                      QUARANTINE_DETAIL: "string", "restock_qty": "integer",
+                                      "damaged_qty": "integer", "effective_stock": "integer"}
+        self.events: Dict[str, str] = {} # qty column -> dataset
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
+
+    # --- Loading ---
+    def load_file(self, ds_name: str, rules: Dict, data_dir: str, filename: str, file_index: int) -> int:
+        """Streams one raw CSV's declared columns into raw_<ds>. Returns its row count."""
+        types = declared_types(rules)
+        self.types.update({col: t for col, t in types.items() if col not in self.types})
+        table = _q(f"raw_{ds_name}")
+        columns = self.columns.get(ds_name)
+        if columns is None:
+            columns = self.columns[ds_name] = []
+            self.conn.execute(f"CREATE TABLE {table} (_file INTEGER, _row INTEGER)")
+
+        rows = 0
+        path = os.path.join(data_dir, filename)
+        with pd.read_csv(path, usecols=lambda name: name in types, dtype=str,
+                         chunksize=LOAD_CHUNK_ROWS) as reader:
+            for chunk in reader:
+                for col in chunk.columns:
+                    if col not in columns:
+                        self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {_q(col)} TEXT")
+                        columns.append(col)
+                names = ", ".join(_q(c) for c in chunk.columns)
+                marks = ", ".join("?" * (len(chunk.columns) + 2))
+                values = [_py_values(chunk[col]) for col in chunk.columns]
+                self.conn.executemany(f"INSERT INTO {table} (_file, _row, {names}) VALUES ({marks})",
+                                      zip([file_index] * len(chunk), range(rows, rows + len(chunk)), *values))
+                rows += len(chunk)
+        self.conn.commit()
+        return rows
+
+    def _parse_column(self, ds_name: str, col: str, type_name: str) -> str:
+        """Parses a column's distinct raw values once into a lookup table (raw, value, failed)."""
+        lookup = _q(f"types_{ds_name}_{col}")
+        self.conn.execute(f"CREATE TABLE {lookup} (raw TEXT PRIMARY KEY, value, failed INTEGER)")
+        cursor = self.conn.execute(f"SELECT DISTINCT {_q(col)} FROM {_q(f'raw_{ds_name}')} "
+                                   f"WHERE {_q(col)} IS NOT NULL")
+        while True:
+            batch = [row[0] for row in cursor.fetchmany(FETCH_ROWS)]
+            if not batch:
+                break
+            parsed, failed = _parse_categories(pd.Index(batch), type_name)
+            if type_name == 'date':
+                values = [None if f else pd.Timestamp(v).strftime(DATE_FORMAT) for v, f in zip(parsed, failed)]
+            elif type_name == 'integer':
+                values = [None if f else int(v) for v, f in zip(parsed, failed)]
+            else:
+                values = [None if f else float(v) for v, f in zip(parsed, failed)]
+            self.conn.executemany(f"INSERT INTO {lookup} VALUES (?, ?, ?)",
+                                  zip(batch, values, [int(f) for f in failed]))
+        return lookup
+
+    # --- Validation ---
+    def validate(self, ds_name: str, rules: Dict):
+        """
+        Builds checked_<ds>: the same split as validate_data, per file. Each
+        failing check sets its bit of the row's quarantine_code; the detail
+        lists the row's type errors with their raw values.
+        """
+        columns = self.columns[ds_name]
+        types = declared_types(rules)
+        codes = reason_codes(rules)
+        selects, joins, type_errors, type_codes = [], [], [], []
+        for col in columns:
+            type_name = types.get(col, 'string')
+            if type_name == 'string':
+                selects.append(f"r.{_q(col)}")
+                continue
+            alias = f"t{len(joins)}"
+            lookup = self._parse_column(ds_name, col, type_name)
+            joins.append(f"LEFT JOIN {lookup} {alias} ON {alias}.raw = r.{_q(col)}")
+            selects.append(f"{alias}.value AS {_q(col)}")
+            # apply_types runs in declared order and puts each message first, so later columns' come first
+            reason = type_reason(col, type_name)
+            type_errors.append((list(types).index(col), f"COALESCE(CASE WHEN {alias}.failed THEN "
+                                f"{_literal(reason + ' (')} || r.{_q(col)} || ')' END || "
+                                f"{_literal(REASON_SEPARATOR)}, '')"))
+            type_codes.append(f"CASE WHEN {alias}.failed THEN {codes.code(reason)} ELSE 0 END")
+        type_error, type_code = "NULL", "0"
+        if type_errors:
+            messages = " || ".join(e for _, e in sorted(type_errors, reverse=True))
+            type_error = f"NULLIF(rtrim({messages}, {_literal(REASON_SEPARATOR)}), '')"
+            type_code = " | ".join(type_codes)
+
+        failures = ["_type_code"]
+        for col in rules.get('required_columns', []):
+            for check in col.get('checks', []):
+                reason = check_reason(col['name'], check)
+                if col['name'] in columns:
+                    name, arg = _parse_check(check)
+                    condition = SQL_CHECKS[name](_q(col['name']), arg, self.master_tables)
+                    failures.append(f"CASE WHEN {condition} THEN {codes.code(reason)} ELSE 0 END")
+        if 'product_id' in columns and "products.product_id" in self.master_tables:
+            failures.append(f"CASE WHEN product_id IS NULL OR product_id NOT IN "
+                            f"(SELECT key FROM {self.master_tables['products.product_id']}) "
+                            f"THEN {UNKNOWN_PRODUCT_CODE} ELSE 0 END")
+        date_col = get_date_column(columns)
+        if date_col is not None and all(x in columns for x in KEY_COLUMNS):
+            keys = ", ".join(_q(c) for c in KEY_COLUMNS + [date_col])
+            failures.append(f"CASE WHEN COUNT(*) OVER (PARTITION BY _file, {keys}) > 1 "
+                            f"THEN {DUPLICATE_CODE} ELSE 0 END")
+
+        names = ", ".join(_q(c) for c in columns)
+        self.conn.execute(f"""
+            CREATE TABLE {_q(f'checked_{ds_name}')} AS
+            WITH typed AS (
+                SELECT r._file, r._row, {', '.join(selects)}, {type_error} AS _type_error, {type_code} AS _type_code
+                FROM {_q(f'raw_{ds_name}')} r {' '.join(joins)}
+            )
+            SELECT _file, _row, {names}, ({' | '.join(failures)}) AS {QUARANTINE_CODE},
+                   _type_error AS {QUARANTINE_DETAIL} FROM typed""")
+        self.conn.execute(f"DROP TABLE {_q(f'raw_{ds_name}')}")
+        self.conn.commit()
+
+    def _frame(self, rows: list, columns: List[str]) -> pd.DataFrame:
+        """Rows fetched from SQL as a frame with the pandas path's dtypes."""
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        for col in columns:
+            type_name = self.types.get(col, 'string')
+            if type_name == 'date':
+                df[col] = pd.to_datetime(df[col], format=DATE_FORMAT)
+            elif type_name == 'integer':
+                df[col] = df[col].astype('Int64') if df[col].isna().any() else df[col].astype('int64')
+            elif type_name == 'float':
+                df[col] = df[col].astype('float64')
+        return df
+
+    def _iter_query(self, sql: str, columns: List[str]) -> Iterator[pd.DataFrame]:
+        cursor = self.conn.execute(sql)
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                return
+            yield self._frame(rows, columns)
+
+    def iter_quarantine(self, ds_name: str) -> Iterator[pd.DataFrame]:
+        """Quarantined rows in input order, with the _file they came from, FETCH_ROWS at a time."""
+        columns = ['_file'] + self.columns[ds_name] + [QUARANTINE_CODE, QUARANTINE_DETAIL]
+        yield from self._iter_query(f"SELECT {', '.join(_q(c) for c in columns)} FROM {_q(f'checked_{ds_name}')} "
+                                    f"WHERE {QUARANTINE_CODE} != 0 ORDER BY _file, _row", columns)
+
+    def iter_valid_keys(self, ds_name: str) -> Iterator[pd.DataFrame]:
+        """_file, _row and key columns of the valid rows in input order, for cross-file duplicate checks."""
+        columns = ['_file', '_row'] + KEY_COLUMNS + [get_date_column(self.columns[ds_name])]
+        yield from self._iter_query(f"SELECT {', '.join(_q(c) for c in columns)} FROM {_q(f'checked_{ds_name}')} "
+                                    f"WHERE {QUARANTINE_CODE} = 0 ORDER BY _file, _row", columns)
+
+    def quarantine_rows(self, ds_name: str, rows: pd.DataFrame):
+        """Quarantines the valid rows identified by _file and _row with their quarantine code and detail."""
+        self.conn.execute("CREATE TEMP TABLE quarantined (_file INTEGER, _row INTEGER, code INTEGER, detail TEXT, "
+                          "PRIMARY KEY (_file, _row))")
+        self.conn.executemany("INSERT INTO quarantined VALUES (?, ?, ?, ?)",
+                              zip(*(_py_values(rows[col]) for col in ['_file', '_row', QUARANTINE_CODE,
+                                                                       QUARANTINE_DETAIL])))
+        table = _q(f'checked_{ds_name}')
+        self.conn.execute(f"UPDATE {table} SET {QUARANTINE_CODE} = q.code, {QUARANTINE_DETAIL} = q.detail "
+                          f"FROM quarantined q "
+                          f"WHERE {table}._file = q._file AND {table}._row = q._row")
+        self.conn.execute("DROP TABLE quarantined")
+        self.conn.commit()
+
+    def iter_unknown_products(self, ds_name: str) -> Iterator[pd.DataFrame]:
+        """Rows quarantined for their product ID alone, with _file and _row, for reconciliation."""
+        columns = ['_file', '_row'] + self.columns[ds_name] + [QUARANTINE_CODE]
+        yield from self._iter_query(f"SELECT {', '.join(_q(c) for c in columns)} FROM {_q(f'checked_{ds_name}')} "
+                                    f"WHERE {QUARANTINE_CODE} = {UNKNOWN_PRODUCT_CODE} "
+                                    f"ORDER BY _file, _row", columns)
+
+    def add_recovered(self, ds_name: str, recovered: pd.DataFrame):
+        """Stores reconciled rows; they rank after their file's valid rows, as in run_serial."""
+        table = _q(f"recovered_{ds_name}")
+        columns = ['_file', '_row'] + self.columns[ds_name] + ['quarantine_reason']
+        names = ", ".join(_q(c) for c in columns)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT _file, _row, "
+                          f"{', '.join(_q(c) for c in self.columns[ds_name])}, NULL AS quarantine_reason "
+                          f"FROM {_q(f'checked_{ds_name}')} WHERE 0")
+        if recovered.empty:
+            return
+        values = []
+        for col in columns:
+            series = recovered[col]
+            if self.types.get(col) == 'date':
+                series = series.dt.strftime(DATE_FORMAT)
+            values.append(_py_values(series))
+        self.conn.executemany(f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))})",
+                              zip(*values))
+        self.conn.commit()
+
+    def file_counts(self, ds_name: str) -> Dict[int, Dict[str, int]]:
+        """Per file index: rows, valid, quarantined, unknown (product) and recovered counts."""
+        counts = {}
+        for file_index, rows, valid, unknown in self.conn.execute(
+                f"SELECT _file, COUNT(*), SUM({QUARANTINE_CODE} = 0), "
+                f"COALESCE(SUM({QUARANTINE_CODE} = {UNKNOWN_PRODUCT_CODE}), 0) "
+                f"FROM {_q(f'checked_{ds_name}')} GROUP BY _file"):
+            counts[file_index] = {"rows": rows, "valid": valid, "quarantined": rows - valid,
+                                  "unknown": unknown, "recovered": 0}
+        if self._has_table(f"recovered_{ds_name}"):
+            for file_index, recovered in self.conn.execute(
+                    f"SELECT _file, COUNT(*) FROM {_q(f'recovered_{ds_name}')} GROUP BY _file"):
+                counts[file_index]["recovered"] = recovered
+        return counts
+
+    def _has_table(self, name: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                 (name,)).fetchone() is not None
+
+    # --- Aggregation ---
+    def build_positions(self, snapshot_ds: str, event_datasets: List[Tuple[str, str]]) -> int:
+        """
+        Builds the per-day aggregates the as-of queries read: inventory_days
+        (latest snapshot row per key and date, in latest_per_key's order) and
+        one daily totals table per event quantity. Returns the snapshot rows kept.
+        """
+        self.snapshot_columns = self.columns[snapshot_ds] + ['quarantine_reason']
+        names = ", ".join(_q(c) for c in self.snapshot_columns)
+        # Valid rows have no reason; reconciled ones carry their fix note
+        parts = [f"SELECT _file, 0 AS _part, _row, {', '.join(_q(c) for c in self.columns[snapshot_ds])}, "
+                 f"NULL AS quarantine_reason FROM {_q(f'checked_{snapshot_ds}')} WHERE {QUARANTINE_CODE} = 0"]
+        if self._has_table(f"recovered_{snapshot_ds}"):
+            parts.append(f"SELECT _file, 1 AS _part, _row, {names} FROM {_q(f'recovered_{snapshot_ds}')}")
+        keys = ", ".join(_q(c) for c in KEY_COLUMNS + ['date'])
+        self.conn.execute(f"""
+            CREATE TABLE inventory_days AS
+            SELECT ROW_NUMBER() OVER (ORDER BY date IS NULL, date, _file, _part, _row) AS _ord,
+                   COALESCE(substr(date, 1, 10), '') AS _day, {names}
+            FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY _file DESC, _part DESC, _row DESC) AS _rn
+                  FROM ({' UNION ALL '.join(parts)}))
+            WHERE _rn = 1""")
+        self.conn.execute("CREATE INDEX inventory_days_key ON inventory_days (store_id, product_id, _day, _ord)")
+
+        for ds_name, qty_col in event_datasets:
+            table = _q(f"totals_{qty_col}")
+            self.events[qty_col] = ds_name
+            if ds_name in self.columns:
+                date_col = get_date_column(self.columns[ds_name])
+                self.conn.execute(f"""
+                    CREATE TABLE {table} AS
+                    SELECT store_id, product_id, COALESCE(substr({_q(date_col)}, 1, 10), '') AS _day,
+                           COALESCE(SUM({_q(qty_col)}), 0) AS qty
+                    FROM {_q(f'checked_{ds_name}')} WHERE {QUARANTINE_CODE} = 0
+                    GROUP BY store_id, product_id, _day""")
+            else:
+                self.conn.execute(f"CREATE TABLE {table} (store_id, product_id, _day, qty)")
+            self.conn.execute(f"CREATE INDEX {_q(f'totals_{qty_col}_key')} ON {table} (store_id, product_id, _day)")
+        self.conn.commit()
+        return self.conn.execute("SELECT COUNT(*) FROM inventory_days").fetchone()[0]
+
+    # --- As-of Queries (same contract as AsOfStockEngine) ---
+    def effective_stock(self, as_of=None) -> pd.DataFrame:
+        """
+        Gold formula per (store, product) from each key's latest snapshot on or
+        before as_of and the events dated from that snapshot's day through
+        as_of. Snapshots without a date rank before every dated one.
+        """
+        as_of_day = None if as_of is None else pd.Timestamp(as_of).strftime('%Y-%m-%d')
+        bound = "" if as_of_day is None else f"WHERE _day <= {_literal(as_of_day)}"
+        event_bound = "" if as_of_day is None else f"AND t._day <= {_literal(as_of_day)}"
+        sums = [f"""COALESCE((SELECT SUM(t.qty) FROM {_q(f'totals_{qty_col}')} t
+                     WHERE t.store_id = l.store_id AND t.product_id = l.product_id
+                       AND t._day >= l._day {event_bound}), 0) AS {_q(qty_col)}"""
+                for qty_col in ('restock_qty', 'damaged_qty')]
+        names = ", ".join(f"l.{_q(c)}" for c in self.snapshot_columns)
+        columns = self.snapshot_columns + ['restock_qty', 'damaged_qty']
+        frames = list(self._iter_query(f"""
+            SELECT {names}, {', '.join(sums)}
+            FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY store_id, product_id ORDER BY _day DESC, _ord DESC) AS _rn
+                  FROM inventory_days {bound}) l
+            WHERE _rn = 1
+            ORDER BY l._day = '', l._day, l._ord""", columns))
+        merged = pd.concat(frames, ignore_index=True) if frames else self._frame([], columns)
+        merged['effective_stock'] = merged['quantity'] + merged['restock_qty'] - merged['damaged_qty']
+        if as_of is not None:
+            merged.insert(0, 'as_of_date', pd.Timestamp(as_of))
+        return merged
+
+    def history(self, dates) -> pd.DataFrame:
+        frames = [self.effective_stock(day) for day in dates]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def latest_date(self) -> Optional[pd.Timestamp]:
+        latest = self.conn.execute("SELECT MAX(date) FROM inventory_days").fetchone()[0]
+        return None if latest is None else pd.Timestamp(latest)
@@ -0,0 +1,255 @@
+import os
+import shutil
+import uuid
+import pandas as pd
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# --- Output Storage ---
+# The Gold fact table and the quarantine ledger are written either as flat CSV
+# (the original layout, kept for compatibility) or as zstd-compressed Parquet
+# datasets partitioned by date and store_id. Parquet readers can then prune
+# partitions and columns instead of parsing whole text files.
+OUTPUT_FORMATS = ("csv", "parquet")
+PARTITION_COLUMNS = ['date', 'store_id']
+FACT_NAME = "inventory_fact"
+FACT_HISTORY_NAME = "inventory_fact_history"
+QUARANTINE_NAME = "quarantine_records"
+QUERY_BATCH_ROWS = 100_000
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet output requires pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+def arrow_type(type_name: str):
+    pa = _require_pyarrow()
+    return {"integer": pa.int64(), "float": pa.float64(), "date": pa.date32()}.get(type_name, pa.string())
+
+def column_types(config: Dict) -> Dict[str, str]:
+    """Declared type of every column named in the schema config."""
+    types = {}
+    for ds in config['datasets'].values():
+        for col in ds.get('required_columns', []):
+            types.setdefault(col['name'], col.get('type', 'string'))
+    types.update({"as_of_date": "date", "quarantine_reason": "string", "restock_qty": "integer",
+                  "damaged_qty": "integer", "effective_stock": "integer"})
+    return types
+
+def to_arrow_table(df: pd.DataFrame, types: Dict[str, str]):
+    """
+    Converts df with explicit column types. A column whose values do not fit
+    its declared type (e.g. a non-numeric quantity in a quarantined row) is
+    kept as string rather than failing the write.
+    """
+    pa = _require_pyarrow()
+    arrays, fields = [], []
+    for col in df.columns:
+        values = df[col]
+        target = arrow_type(types.get(col, "string"))
+        if target == pa.string():
+            values = values.astype(object).where(values.notna(), None).map(
+                lambda v: v if v is None or isinstance(v, str) else str(v))
+        elif target == pa.date32():
+            parsed = pd.to_datetime(values, format='ISO8601', errors='coerce')
+            if not (parsed.isna() & values.notna()).any():
+                values = parsed.dt.date
+        try:
+            array = pa.array(values, type=target, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            array = pa.array(values.astype(object).where(values.notna(), None).map(
+                lambda v: v if v is None else str(v)), type=pa.string())
+        arrays.append(array)
+        fields.append(pa.field(col, array.type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+def dataset_path(base_dir: str, name: str, output_format: str) -> str:
+    return os.path.join(base_dir, name if output_format == "parquet" else f"{name}.csv")
+
+def _partition_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Event rows carry event_date instead of date; partition them under it.
+    if 'event_date' in df.columns and 'date' in df.columns:
+        df = df.assign(date=df['date'].fillna(df['event_date']))
+    return df
+
+def append_parquet(df: pd.DataFrame, path: str, types: Dict[str, str]):
+    """Adds df as new files under the partitioned dataset at path."""
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+    table = to_arrow_table(_partition_frame(df), types)
+    pq.write_to_dataset(table, path, partition_cols=PARTITION_COLUMNS, compression="zstd",
+                        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                        existing_data_behavior="overwrite_or_ignore")
+
+def write_dataset(df: pd.DataFrame, base_dir: str, name: str, output_format: str,
+                  types: Optional[Dict[str, str]] = None) -> str:
+    """
+    Replaces the named output. The dataset is written next to the old one and
+    swapped in, and any copy in the other format is removed so readers never
+    pick up a stale table.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    tmp = dataset_path(base_dir, name, output_format) + ".tmp"
+    _remove(tmp)
+    if output_format == "parquet":
+        append_parquet(df, tmp, types or {})
+    else:
+        df.to_csv(tmp, index=False)
+    return publish_dataset(tmp, base_dir, name, output_format)
+
+def publish_dataset(staged_path: str, base_dir: str, name: str, output_format: str) -> str:
+    """Moves a fully written CSV file or Parquet directory into place as the named output."""
+    path = dataset_path(base_dir, name, output_format)
+    _remove(path)
+    os.replace(staged_path, path)
+    for other in OUTPUT_FORMATS:
+        if other != output_format:
+            _remove(dataset_path(base_dir, name, other))
+    return path
+
+def read_dataset(base_dir: str, name: str, columns: Optional[List[str]] = None,
+                 filters=None) -> pd.DataFrame:
+    """
+    Reads the named output in whichever format it was written. For Parquet,
+    columns and filters (pyarrow expression or DNF list, e.g.
+    [('store_id', '=', 'S001')]) are pushed down so only matching partitions
+    and requested columns are read. For CSV they are applied after parsing.
+    """
+    parquet_path = dataset_path(base_dir, name, "parquet")
+    csv_path = dataset_path(base_dir, name, "csv")
+    if os.path.isdir(parquet_path):
+        _require_pyarrow()
+        import pyarrow.parquet as pq
+        table = pq.read_table(parquet_path, columns=columns, filters=filters, partitioning=_partitioning())
+        return table.to_pandas()
+    if os.path.exists(csv_path):
+        filters = filters or []
+        usecols = None
+        if columns is not None:
+            usecols = list(dict.fromkeys(list(columns) + [col for col, _, _ in filters]))
+        df = pd.read_csv(csv_path, usecols=usecols)
+        for col, op, value in filters:
+            df = df[_apply_op(df[col], op, value)]
+        return df if columns is None else df[list(columns)]
+    return pd.DataFrame()
+
+def dataset_mtime(base_dir: str, name: str) -> Optional[float]:
+    """Modification time of the named output in whichever format exists (None if neither), for cache keys."""
+    for output_format in OUTPUT_FORMATS:
+        path = dataset_path(base_dir, name, output_format)
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+    return None
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([(col, pa.string()) for col in PARTITION_COLUMNS]), flavor="hive")
+
+def _prefixes(value) -> List[str]:
+    return [value] if isinstance(value, str) else list(value)
+
+def _apply_op(series: pd.Series, op: str, value):
+    if op in ("=", "=="):
+        return series == value
+    if op == "!=":
+        return series != value
+    if op == "in":
+        return series.isin(value)
+    if op == "startswith":
+        text = series.astype(object).where(series.notna(), None)
+        return text.map(lambda v: v is not None and str(v).startswith(tuple(_prefixes(value)))).astype(bool)
+    if op == "contains":
+        text = series.astype(object).where(series.notna(), None)
+        return text.map(lambda v: v is not None and any(part in str(v) for part in _prefixes(value))).astype(bool)
+    if op == ">":
+        return series > value
+    if op == ">=":
+        return series >= value
+    if op == "<":
+        return series < value
+    if op == "<=":
+        return series <= value
+    raise ValueError(f"Unsupported filter op: {op}")
+
+# --- Paged Queries ---
+# Table views fetch one page at a time. Matching rows are streamed in batches
+# (Parquet fragments, pruned by the date/store_id partitions, or CSV chunks)
+# and only rows of the requested page are kept, plus the total match count.
+# Filters take read_dataset's (column, op, value) form, plus "startswith"
+# and "contains" with one string or a list of them (matching any).
+def _arrow_filter(filters):
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    comparisons = {"=": "__eq__", "==": "__eq__", "!=": "__ne__", ">": "__gt__", ">=": "__ge__",
+                   "<": "__lt__", "<=": "__le__"}
+    expression = None
+    for col, op, value in filters or []:
+        field = ds.field(col)
+        if op in comparisons:
+            term = getattr(field, comparisons[op])(value)
+        elif op == "in":
+            term = field.isin(list(value)) if len(value) else ds.scalar(False)
+        elif op == "startswith":
+            term = ds.scalar(False)
+            for prefix in _prefixes(value):
+                term = term | pc.starts_with(field, pattern=prefix)
+        elif op == "contains":
+            term = ds.scalar(False)
+            for part in _prefixes(value):
+                term = term | pc.match_substring(field, pattern=part)
+        else:
+            raise ValueError(f"Unsupported filter op: {op}")
+        expression = term if expression is None else expression & term
+    return expression
+
+def _filtered_batches(base_dir: str, name: str, columns: Optional[List[str]], filters) -> Iterator:
+    parquet_path = dataset_path(base_dir, name, "parquet")
+    csv_path = dataset_path(base_dir, name, "csv")
+    if os.path.isdir(parquet_path):
+        _require_pyarrow()
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(parquet_path, format="parquet", partitioning=_partitioning())
+        scanner = dataset.scanner(columns=columns, filter=_arrow_filter(filters), batch_size=QUERY_BATCH_ROWS)
+        yield from scanner.to_batches()
+    elif os.path.exists(csv_path):
+        with pd.read_csv(csv_path, chunksize=QUERY_BATCH_ROWS) as reader:
+            for chunk in reader:
+                # Same date column as the Parquet layout, where event rows sit under their event_date
+                chunk = _partition_frame(chunk)
+                for col, op, value in filters or []:
+                    chunk = chunk[_apply_op(chunk[col], op, value)]
+                yield chunk if columns is None else chunk[list(columns)]
+
+def query_dataset(base_dir: str, name: str, filters=None, offset: int = 0, limit: int = 100,
+                  columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, int]:
+    """
+    Rows [offset, offset + limit) of the named output that match filters, in
+    scan order, and the number of matching rows. Scan order is file order for
+    CSV and partition by partition for Parquet, not the order rows were
+    written in; it is the same on every call over the same output, so pages
+    neither overlap nor skip rows. Memory holds one batch and the page,
+    however large the dataset.
+    """
+    parts, total = [], 0
+    for batch in _filtered_batches(base_dir, name, columns, filters):
+        start, stop = max(offset - total, 0), max(offset + limit - total, 0)
+        if start < len(batch) and stop > 0:
+            parts.append(batch[start:stop])
+        total += len(batch)
+    if not parts:
+        return pd.DataFrame(columns=columns), total
+    if isinstance(parts[0], pd.DataFrame):
+        return pd.concat(parts, ignore_index=True), total
+    import pyarrow as pa
+    return pa.Table.from_batches(parts).to_pandas(), total
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
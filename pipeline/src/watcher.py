@@ -0,0 +1,89 @@
+import os
+import fnmatch
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# --- Raw File Watcher ---
+# Watch mode polls the raw directory and hands newly landed (or re-sent, or
+# deleted) files to incremental runs in micro-batches. A file is only taken
+# once its size and mtime have held still for settle_seconds, so a file that
+# is still being copied in is not read half-written. Settled files are
+# flushed as soon as nothing else is arriving, when max_batch_files of them
+# have settled, or when the oldest has waited max_latency_seconds, whichever
+# comes first: a steady stream of arrivals cannot hold a batch back forever.
+Fingerprint = Tuple[int, float]
+
+def scan_raw_dir(raw_dir: str, patterns: Iterable[str]) -> Dict[str, Fingerprint]:
+    """(size, mtime) of every file in raw_dir matching one of patterns."""
+    patterns = list(patterns)
+    listing = {}
+    with os.scandir(raw_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and any(fnmatch.fnmatch(entry.name, p) for p in patterns):
+                stat = entry.stat()
+                listing[entry.name] = (stat.st_size, stat.st_mtime)
+    return listing
+
+class FileBatcher:
+    def __init__(self, settle_seconds: float = 2.0, max_batch_files: int = 50, max_latency_seconds: float = 10.0,
+                 known: Optional[Dict[str, Fingerprint]] = None):
+        if max_batch_files < 1:
+            raise ValueError("max_batch_files must be at least 1")
+        self.settle_seconds = settle_seconds
+        self.max_batch_files = max_batch_files
+        self.max_latency_seconds = max_latency_seconds
+        self.done = dict(known or {}) # file -> fingerprint last handed out
+        self.pending = {} # file -> {"fingerprint" (None: deleted), "first_seen", "stable_since"}
+
+    def observe(self, listing: Dict[str, Fingerprint], now: Optional[float] = None):
+        """Updates the pending set from a directory listing."""
+        now = time.monotonic() if now is None else now
+        for f, fingerprint in listing.items():
+            if self.done.get(f) == fingerprint:
+                self.pending.pop(f, None)
+                continue
+            entry = self.pending.get(f)
+            if entry is None:
+                self.pending[f] = {"fingerprint": fingerprint, "first_seen": now, "stable_since": now}
+            elif entry["fingerprint"] != fingerprint:
+                entry.update(fingerprint=fingerprint, stable_since=now)
+        for f in set(self.done) | set(self.pending):
+            if f in listing:
+                continue
+            if f not in self.done:
+                # Appeared and vanished before it was handed out
+                del self.pending[f]
+            elif f not in self.pending or self.pending[f]["fingerprint"] is not None:
+                # Deletions need no settling
+                first_seen = self.pending.get(f, {}).get("first_seen", now)
+                self.pending[f] = {"fingerprint": None, "first_seen": first_seen,
+                                   "stable_since": now - self.settle_seconds}
+
+    def ready(self, now: Optional[float] = None) -> List[str]:
+        """The next batch to run, oldest arrivals first, or [] if it should wait."""
+        now = time.monotonic() if now is None else now
+        settled = sorted((entry["first_seen"], f) for f, entry in self.pending.items()
+                         if now - entry["stable_since"] >= self.settle_seconds)
+        if not settled:
+            return []
+        quiet = len(settled) == len(self.pending)
+        overdue = now - settled[0][0] >= self.max_latency_seconds
+        if quiet or overdue or len(settled) >= self.max_batch_files:
+            return [f for _, f in settled[:self.max_batch_files]]
+        return []
+
+    def waited(self, files: Iterable[str], now: Optional[float] = None) -> float:
+        """Seconds the longest-waiting of files has been pending."""
+        now = time.monotonic() if now is None else now
+        return max((now - self.pending[f]["first_seen"] for f in files if f in self.pending), default=0.0)
+
+    def mark_done(self, files: Iterable[str]):
+        """Records files as handed out at their pending fingerprint."""
+        for f in files:
+            entry = self.pending.pop(f, None)
+            if entry is None:
+                continue
+            if entry["fingerprint"] is None:
+                self.done.pop(f, None)
+            else:
+                self.done[f] = entry["fingerprint"]
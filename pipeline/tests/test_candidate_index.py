@@ -0,0 +1,38 @@
+import random
+import string
+import pandas as pd
+import pytest
+from reconciliation import ReconciliationEngine
+
+def _typo(rng: random.Random, product_id: str) -> str:
+    chars = list(product_id)
+    i = rng.randrange(len(chars))
+    edit = rng.choice(["substitute", "insert", "delete", "transpose"])
+    if edit == "substitute":
+        chars[i] = rng.choice(string.ascii_uppercase + string.digits)
+    elif edit == "insert":
+        chars.insert(i, rng.choice(string.ascii_uppercase + string.digits))
+    elif edit == "delete" and len(chars) > 1:
+        del chars[i]
+    elif i + 1 < len(chars):
+        chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    return "".join(chars)
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_indexed_matches_equal_brute_force_cdist(seed):
+    rng = random.Random(seed)
+    master_ids = list(dict.fromkeys(
+        [f"P{n:05d}" for n in rng.sample(range(100_000), 1500)]
+        + ["".join(rng.choices(string.ascii_uppercase + string.digits, k=rng.randint(4, 14))) for _ in range(500)]))
+    bad_ids = [_typo(rng, rng.choice(master_ids)) for _ in range(1000)]
+    bad_ids += ["".join(rng.choices(string.ascii_uppercase, k=rng.randint(1, 12))) for _ in range(200)]
+    bad_ids = [b for b in dict.fromkeys(bad_ids) if b not in set(master_ids)]
+    master = pd.DataFrame({"product_id": master_ids})
+
+    indexed = ReconciliationEngine(master, use_index=True)
+    brute = ReconciliationEngine(master, use_index=False)
+    assert indexed.index is not None and brute.index is None
+
+    expected = brute._score(bad_ids)
+    assert indexed._score_indexed(bad_ids) == expected
+    assert len(expected) > len(bad_ids) // 4 # insertions and deletions in 6-character IDs still score >= 90
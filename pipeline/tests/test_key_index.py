@@ -0,0 +1,42 @@
+import numpy as np
+import key_index
+from key_index import KEY_DTYPE, BloomFilter, KeyIndex
+
+def test_bloom_filter_has_no_false_negatives(tmp_path):
+    rng = np.random.default_rng(0)
+    bloom = BloomFilter.create(str(tmp_path / "bloom.bin"), 10_000)
+    added = rng.integers(0, 2 ** 63, 10_000, dtype=np.uint64)
+    bloom.add(added)
+    assert bloom.contains(added).all()
+    others = np.setdiff1d(rng.integers(0, 2 ** 63, 10_000, dtype=np.uint64), added)
+    assert bloom.contains(others).mean() < 0.05 # about 1% at 10 bits and 4 hashes per key
+
+def test_claims_match_a_python_dict_across_runs(tmp_path, monkeypatch):
+    # A small Bloom filter and merge chunk so the runs below rebuild and merge them
+    monkeypatch.setattr(key_index, "MIN_BLOOM_KEYS", 256)
+    monkeypatch.setattr(key_index, "MERGE_CHUNK", 100)
+    rng = np.random.default_rng(1)
+    path = str(tmp_path / "index")
+    files = [f"restock_{n}.csv" for n in range(6)]
+    owners = {} # key -> file that first claimed it
+    for run in range(8):
+        index = KeyIndex(path, context="rules")
+        assert index.sync({f: [1, 0] for f in files}) == set()
+        for f in rng.permutation(files):
+            fresh = rng.integers(0, 2 ** 63, int(rng.integers(0, 300)), dtype=np.uint64)
+            known = np.fromiter(owners, dtype=np.uint64, count=len(owners))
+            reused = rng.choice(known, min(len(known), 100), replace=False) if len(known) else known
+            keys = np.unique(np.concatenate([fresh, reused])).astype(KEY_DTYPE)
+            rng.shuffle(keys)
+
+            duplicate, names = index.claim_keys(keys, f)
+            expected = [owners.get(k, f) != f for k in keys.tolist()]
+            assert duplicate.tolist() == expected
+            assert names.tolist() == [owners[k] for k, dup in zip(keys.tolist(), expected) if dup]
+            for k in keys.tolist():
+                owners.setdefault(k, f)
+        index.save()
+        del index
+    index = KeyIndex(path, context="rules")
+    assert index.meta["keys"] == len(owners)
+    assert sum(len(keys) for keys, _ in index.segments) == len(owners)
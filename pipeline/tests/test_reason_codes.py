@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from pipeline_core import (FIXED_REASONS, QUARANTINE_CODE, QUARANTINE_DETAIL, REASON_SEPARATOR, apply_types,
+                           compile_rules, reason_codes, validate_data)
+
+RULES = {"required_columns": [
+    {"name": "event_date", "type": "date"},
+    {"name": "store_id", "type": "string", "checks": ["fk_stores.store_id"]},
+    {"name": "product_id", "type": "string"},
+    {"name": "restock_qty", "type": "integer", "checks": ["min_0", "max_1000"]},
+]}
+
+# Each row with the reason it was quarantined with when rows kept only one,
+# and the reasons it is quarantined with now (that one first)
+ROWS = [
+    (["2026-01-01", "S1", "P1", "5"], None, None),
+    (["2026-01-02", "S1", "P1", "-1"], "restock_qty < 0", []),
+    (["2026-01-03", "S1", "P1", "2000"], "restock_qty > 1000", []),
+    (["2026-01-04", "S1", "P9", "5"], "Unknown Product ID", []),
+    (["2026-01-05", "S1", "P8", "-3"], "restock_qty < 0", ["Unknown Product ID"]),
+    (["2026-01-06", "S9", "P1", "5"], "store_id not in stores.store_id", []),
+    (["2026-01-07", "S9", "P1", "-1"], "restock_qty < 0", ["store_id not in stores.store_id"]),
+    (["2026-01-08", "S1", "P1", "abc"], "restock_qty not a valid integer (abc)", []),
+    (["2026-01-09", "S2", "P2", "7"], "Duplicate Entry", []),
+    (["2026-01-09", "S2", "P2", "8"], "Duplicate Entry", []),
+    (["not a date", "S1", "P7", "5"], "event_date not a valid date (not a date)", ["Unknown Product ID"]),
+]
+
+def test_decoded_reasons_start_with_the_single_reason_rows_used_to_get():
+    df = pd.DataFrame([values for values, _, _ in ROWS], columns=[c["name"] for c in RULES["required_columns"]])
+    plan = compile_rules(RULES, {"P1", "P2"}, {"stores.store_id": {"S1", "S2"}})
+    valid, quarantine = validate_data(apply_types(df, RULES), plan)
+
+    assert valid.index.tolist() == [0]
+    texts = plan.reasons.decode(quarantine[QUARANTINE_CODE].to_numpy(), quarantine[QUARANTINE_DETAIL].to_numpy())
+    expected = [REASON_SEPARATOR.join([first] + rest) for _, first, rest in ROWS if first is not None]
+    assert texts.tolist() == expected
+
+def test_decode_spells_out_each_code_like_text():
+    reasons = reason_codes(RULES)
+    assert reasons.reasons[:len(FIXED_REASONS)] == FIXED_REASONS
+    for bit, reason in enumerate(reasons.reasons):
+        assert reasons.text(reasons.code(reason)) == reason
+        assert reasons.bits[reason] == bit
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 1 << len(reasons.reasons), 500).astype(reasons.dtype)
+    assert reasons.decode(codes).tolist() == [reasons.text(int(code)) for code in codes]
+    assert reasons.decode(np.zeros(2, dtype=reasons.dtype)).tolist() == [None, None]